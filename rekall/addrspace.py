@@ -30,10 +30,23 @@
    Alias for all address spaces
 
 """
+import bisect
+import itertools
+import re
+
+from rekall import config
 from rekall import registry
 from rekall import utils
 
 
+config.DeclareOption(
+    "--page_cache_mb", group="Performance",
+    action=config.IntParser,
+    help="The amount of memory (in MB) used to cache data read from the "
+    "image. This is shared by all the address spaces of the session. Set to 0 "
+    "to disable caching (e.g. when analysing live memory).")
+
+
 class BaseAddressSpace(object):
     """ This is the base class of all Address Spaces. """
 
@@ -52,6 +65,9 @@ class BaseAddressSpace(object):
     # address space autoselection for image detection.
     _md_image = False
 
+    # True if the data may change while we analyse it (e.g. live memory).
+    volatile = False
+
     def __init__(self, base=None, session=None, write=False, profile=None,
                  **_):
         """Base is the AS we will be stacking on top of, opts are options which
@@ -85,6 +101,31 @@ class BaseAddressSpace(object):
         # cache frequently.
         self.cache = utils.AgeBasedCache(max_age=20)
 
+    def reopen(self):
+        """Reopens any file handles this address space holds.
+
+        This is called in a newly forked process (e.g. a scan worker) so that
+        it does not share file offsets with its parent.
+        """
+
+    def data_may_change(self):
+        """Returns True if the data we read from this address space may change.
+
+        This is the case when this address space, or any address space it is
+        stacked on, is writeable or volatile. Data read from it should then not
+        be cached.
+        """
+        address_space = self
+        while True:
+            if (getattr(address_space, "writeable", False) or
+                    address_space.volatile):
+                return True
+
+            if address_space.base is address_space:
+                return False
+
+            address_space = address_space.base
+
     def as_assert(self, assertion, error=None):
         """Duplicate for the assert command (so that optimizations don't disable
         them)
@@ -102,6 +143,37 @@ class BaseAddressSpace(object):
 
         return "\x00" * length
 
+    def read_many(self, requests):
+        """Reads many regions of the address space at once.
+
+        Consumers which need many small reads (e.g. the members of an array or
+        the entries of a page table) should issue them in a single call, so
+        the address space is able to translate, sort and coalesce them.
+
+        Args:
+          requests: A list of (addr, length) tuples.
+
+        Returns:
+          A list with the data of each request, in the order of requests.
+        """
+        results = [None] * len(requests)
+
+        # Reading in address order keeps the access to the image sequential.
+        for i in sorted(xrange(len(requests)), key=lambda i: requests[i][0]):
+            results[i] = self.read(*requests[i])
+
+        return results
+
+    def get_buffer(self, addr, length):
+        """Returns the data at addr as an object supporting the buffer protocol.
+
+        Address spaces which are able to (e.g. mmap backed ones) return a
+        window into their underlying storage instead of copying the data. The
+        result is therefore not necessarily a string, but it can be sliced and
+        used to back a BufferAddressSpace. By default we just read the data.
+        """
+        return self.read(addr, length)
+
     def get_available_addresses(self):
         """Generates address ranges (offset, phys_offset, size) for this AS.
 
@@ -143,10 +215,15 @@ class BaseAddressSpace(object):
         """Generates merged address ranges from get_available_addresses()."""
         try:
             # Try to get this from the cache.
-            for x in self.cache.Get("Ranges"):
-                yield x
+            ranges = self.cache.Get("Ranges")
         except KeyError:
-            pass
+            ranges = self._get_persistent_ranges()
+
+        if ranges is not None:
+            for x in ranges:
+                yield x
+
+            return
 
         result = []
         contiguous_voffset = 0
@@ -184,6 +261,34 @@ class BaseAddressSpace(object):
         # Cache this for next time.
         self.cache.Put("Ranges", result)
 
+        key = self.persistent_cache_key()
+        if key is not None:
+            self.session.persistent_cache.Put(key, result)
+
+    def _get_persistent_ranges(self):
+        """Loads the merged address ranges from the persistent cache."""
+        key = self.persistent_cache_key()
+        if key is None or self.session.persistent_cache is None:
+            return None
+
+        ranges = self.session.persistent_cache.Get(key)
+        if ranges is None:
+            return None
+
+        ranges = [tuple(x) for x in ranges]
+        self.cache.Put("Ranges", ranges)
+
+        return ranges
+
+    def persistent_cache_key(self):
+        """The key under which our address ranges are persistently cached.
+
+        Only address spaces which are expensive to enumerate need to be cached
+        (e.g. paged address spaces). Returns None if the address ranges should
+        not be cached.
+        """
+        return None
+
     def is_valid_address(self, _addr):
         """ Tell us if the address is valid """
         return True
@@ -221,7 +326,28 @@ class BaseAddressSpace(object):
 
 ## This is a specialised AS for use internally - Its used to provide
 ## transparent support for a string buffer so types can be
-## instantiated off the buffer.
+## instantiated off the buffer. The data may also be any object supporting the
+## buffer protocol (e.g. a buffer() window into an mmap), in which case it is
+## not copied.
+def ReopenAddressSpaces(*address_spaces):
+    """Reopens the address spaces and all the address spaces below them.
+
+    This is called in a newly forked process (e.g. a worker process) so that it
+    does not share file offsets with its parent. Each address space is only
+    reopened once, even if it is part of several stacks.
+    """
+    reopened = set()
+    for address_space in address_spaces:
+        while (address_space is not None and
+               id(address_space) not in reopened):
+            address_space.reopen()
+            reopened.add(id(address_space))
+            if address_space.base is address_space:
+                break
+
+            address_space = address_space.base
+
+
 class BufferAddressSpace(BaseAddressSpace):
     __abstract = True
 
@@ -256,6 +382,27 @@ class BufferAddressSpace(BaseAddressSpace):
         """Returns the offset in self.data for the virtual offset."""
         return offset - self.base_offset
 
+    def find(self, needle, addr):
+        """Returns the address of the first needle at or after addr, or -1."""
+        offset = addr - self.base_offset
+        if isinstance(self.data, str):
+            index = self.data.find(needle, offset)
+        else:
+            # Buffer objects do not have a find() method, but the regex engine
+            # is able to search them without copying.
+            m = re.compile(re.escape(needle)).search(self.data, offset)
+            index = m.start() if m else -1
+
+        if index == -1:
+            return -1
+
+        return index + self.base_offset
+
+    def startswith(self, needle, addr):
+        """Does the data at addr start with needle?"""
+        offset = addr - self.base_offset
+        return self.data[offset:offset + len(needle)] == needle
+
     def __repr__(self):
         return "<%s @ %#x %s [%#X-%#X]>" % (
             self.__class__.__name__, hash(self), self.name,
@@ -269,45 +416,160 @@ class BufferAddressSpace(BaseAddressSpace):
         return self.base_offset + len(self.data)
 
 
+class PageCache(utils.FastStore):
+    """A cache of data read by the address spaces of a session.
+
+    All the address spaces of the session share this cache (it is available as
+    session.page_cache), so the total memory used for caching is bounded by the
+    page_cache_mb parameter, however many address spaces are open. Unlike the
+    FastStore, the cache is limited by the total length of the cached data
+    rather than by the number of entries.
+
+    Each address space stores its data under its own namespace (obtained from
+    NewNamespace()), e.g. cache.Put((namespace, chunk_number), data).
+    """
+
+    # The default size of the cache in MB.
+    PAGE_CACHE_MB = 100
+
+    def __init__(self, session=None):
+        super(PageCache, self).__init__(max_size=0, lock=True)
+        self.session = session
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._namespaces = itertools.count()
+
+    def NewNamespace(self):
+        """Returns a namespace which is not used by any other address space."""
+        return self._namespaces.next()
+
+    @property
+    def max_bytes(self):
+        return self.session.GetParameter(
+            "page_cache_mb", self.PAGE_CACHE_MB) * 1024 * 1024
+
+    @utils.Synchronized
+    def Expire(self):
+        """Expires the oldest data until we are within the budget."""
+        max_bytes = self.max_bytes
+        while self._age and self.size > max_bytes:
+            self.ExpireObject(self._age.PopLeft())
+
+    @utils.Synchronized
+    def ExpireObject(self, key):
+        item = super(PageCache, self).ExpireObject(key)
+        if item is not None:
+            self.size -= len(item)
+
+        return item
+
+    @utils.Synchronized
+    def Put(self, key, item):
+        # Replacing an item must not count it twice.
+        try:
+            _, old_item = self._hash[key]
+            self.size -= len(old_item)
+        except KeyError:
+            pass
+
+        self.size += len(item)
+
+        return super(PageCache, self).Put(key, item)
+
+    def Get(self, key):
+        try:
+            result = super(PageCache, self).Get(key)
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.hits += 1
+        return result
+
+    @utils.Synchronized
+    def Flush(self):
+        super(PageCache, self).Flush()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._hash)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        if total:
+            return float(self.hits) / total
+
+        return 0.0
+
+
 class CachingAddressSpaceMixIn(object):
+    """Caches the data read from the address space in the session page cache.
+    """
     # The size of chunks we cache. This should be large enough to make file
     # reads efficient.
     CHUNK_SIZE = 32 * 1024
-    CACHE_SIZE = 1000
+
+    # When the address space is read sequentially (e.g. when scanning or
+    # copying the image), read this many chunks ahead at once. This helps when
+    # a single large read is much cheaper than many small ones.
+    READ_AHEAD_CHUNKS = 0
 
     def __init__(self, **kwargs):
         super(CachingAddressSpaceMixIn, self).__init__(**kwargs)
-        self._cache = utils.FastStore(self.CACHE_SIZE)
+        self._cache = self.session.page_cache
+        self._cache_namespace = self._cache.NewNamespace()
+
+        # The chunk after the last chunk we read from the real class.
+        self._next_chunk = None
 
     def read(self, addr, length):
-        result = ""
+        result = []
         while length > 0:
             data = self.read_partial(addr, length)
             if not data:
                 break
 
-            result += data
+            result.append(data)
             length -= len(data)
             addr += len(data)
 
-        return result
+        return "".join(result)
+
+    def _read_chunks(self, chunk_number):
+        """Reads the chunk (and possibly those after it) into the cache."""
+        count = 1
+        if self.READ_AHEAD_CHUNKS and chunk_number == self._next_chunk:
+            count += self.READ_AHEAD_CHUNKS
+
+        # Just read the data from the real class.
+        data = super(CachingAddressSpaceMixIn, self).read(
+            chunk_number * self.CHUNK_SIZE, self.CHUNK_SIZE * count)
+
+        for i in range(count):
+            self._cache.Put((self._cache_namespace, chunk_number + i),
+                            data[i * self.CHUNK_SIZE:(i + 1) * self.CHUNK_SIZE])
+
+        self._next_chunk = chunk_number + count
+
+        return data[:self.CHUNK_SIZE]
 
     def read_partial(self, addr, length):
         if addr == None:
             return addr
 
+        # Data which may change (e.g. live memory) must be read every time.
+        if self.data_may_change():
+            return super(CachingAddressSpaceMixIn, self).read(addr, length)
+
         chunk_number = addr / self.CHUNK_SIZE
         chunk_offset = addr % self.CHUNK_SIZE
         available_length = min(length, self.CHUNK_SIZE - chunk_offset)
 
         try:
-            data = self._cache.Get(chunk_number)
+            data = self._cache.Get((self._cache_namespace, chunk_number))
         except KeyError:
-            # Just read the data from the real class.
-            data = super(CachingAddressSpaceMixIn, self).read(
-                chunk_number * self.CHUNK_SIZE, self.CHUNK_SIZE)
-
-            self._cache.Put(chunk_number, data)
+            data = self._read_chunks(chunk_number)
 
         return data[chunk_offset:chunk_offset+available_length]
 
@@ -347,18 +609,98 @@ class PagedReader(BaseAddressSpace):
 
         vaddr, length = int(vaddr), int(length)
 
-        result = ''
+        result = []
 
         while length > 0:
             buf = self._read_chunk(vaddr, length)
             if not buf:
                 break
 
-            result += buf
+            result.append(buf)
             vaddr += len(buf)
             length -= len(buf)
 
-        return result
+        return "".join(result)
+
+    def _get_segments(self, vaddr, length):
+        """Splits the range into segments which are contiguous in the base.
+
+        Yields:
+          Tuples of (paddr, length) covering the range. The paddr is None for
+          segments which are not mapped.
+        """
+        while length > 0:
+            to_read = min(length, self.PAGE_SIZE - (vaddr % self.PAGE_SIZE))
+            yield self.vtop(vaddr), to_read
+
+            vaddr += to_read
+            length -= to_read
+
+    def _reads_through_base(self):
+        """Returns True if our data is read from the base at vtop() offsets.
+
+        Address spaces which read the data themselves (e.g. when they are the
+        first address space, or override _read_chunk()) can not batch reads of
+        their base.
+        """
+        if self.base is self:
+            return False
+
+        read_chunk = self.__class__._read_chunk.im_func
+        return read_chunk in (PagedReader._read_chunk.im_func,
+                              RunBasedAddressSpace._read_chunk.im_func)
+
+    def read_many(self, requests):
+        """Reads many regions with a single batched read of the base.
+
+        The regions are translated into segments of the base address space,
+        which are sorted by physical address and coalesced so that adjacent
+        pages are read together. The data is copied into one preallocated
+        buffer, and unmapped segments are left as zeros.
+        """
+        if not self._reads_through_base():
+            return super(PagedReader, self).read_many(requests)
+
+        buffer_size = self.session.GetParameter("buffer_size")
+        positions = [0]
+        segments = []
+
+        for vaddr, length in requests:
+            if length > buffer_size:
+                raise IOError("Too much data to read.")
+
+            position = positions[-1]
+            for paddr, segment_length in self._get_segments(
+                    int(vaddr), int(length)):
+                if paddr is not None:
+                    segments.append((paddr, segment_length, position))
+
+                position += segment_length
+
+            positions.append(positions[-1] + int(length))
+
+        # Coalesce the segments into runs of [start, end, segments].
+        runs = []
+        for segment in sorted(segments):
+            paddr, segment_length = segment[:2]
+            if runs and paddr <= runs[-1][1]:
+                runs[-1][1] = max(runs[-1][1], paddr + segment_length)
+                runs[-1][2].append(segment)
+            else:
+                runs.append([paddr, paddr + segment_length, [segment]])
+
+        result = bytearray(positions[-1])
+        run_data = self.base.read_many([(start, end - start)
+                                        for start, end, _ in runs])
+
+        for (start, _, run_segments), data in zip(runs, run_data):
+            for paddr, segment_length, position in run_segments:
+                segment_data = buffer(data, paddr - start, segment_length)
+                result[position:position + len(segment_data)] = segment_data
+
+        return [str(buffer(result, positions[i], positions[i + 1] -
+                           positions[i]))
+                for i in xrange(len(requests))]
 
     def is_valid_address(self, addr):
         vaddr = self.vtop(addr)
@@ -378,26 +720,112 @@ class RunBasedAddressSpace(PagedReader):
     runs = None
     __abstract = True
 
+    # The runs are indexed by buckets of this many address bits (1mb).
+    RUN_BUCKET_SHIFT = 20
+
     def __init__(self, **kwargs):
         super(RunBasedAddressSpace, self).__init__(**kwargs)
         self.runs = utils.SortedCollection(key=lambda x: x[0])
 
-    def _read_chunk(self, addr, length):
-        """Read from addr as much as possible up to a length of length."""
+        # A tuple of (number of runs, run starts, buckets). See
+        # _get_run_index().
+        self._run_index = None
+
+        # The run of the last lookup. Reads are mostly sequential, so this is
+        # usually the run of the next lookup too.
+        self._last_run = None
+
+    def _get_run_index(self):
+        """Returns the index of the runs, rebuilding it when runs were added.
+
+        The index maps each bucket of the address space to the [first, last)
+        indexes of the runs which overlap it. Finding a run is then a dict
+        lookup and a search among the few runs in the bucket, instead of a
+        bisection of all the runs. The index only holds an entry for each
+        mapped bucket, so it stays small for sparse images.
+        """
+        if self._run_index is None or self._run_index[0] != len(self.runs):
+            starts = []
+            buckets = {}
+            for i, (start, _, length) in enumerate(self.runs):
+                starts.append(start)
+                if length <= 0:
+                    continue
+
+                for bucket in xrange(
+                        start >> self.RUN_BUCKET_SHIFT,
+                        ((start + length - 1) >> self.RUN_BUCKET_SHIFT) + 1):
+                    if bucket in buckets:
+                        buckets[bucket][1] = i + 1
+                    else:
+                        buckets[bucket] = [i, i + 1]
+
+            self._run_index = (len(self.runs), starts, buckets)
+            self._last_run = None
+
+        return self._run_index
+
+    def _find_run(self, addr):
+        """Returns the run (start, file_offset, length) containing addr."""
+        _, starts, buckets = self._get_run_index()
+
+        run = self._last_run
+        if run is not None and run[0] <= addr < run[0] + run[2]:
+            return run
+
+        bucket = buckets.get(addr >> self.RUN_BUCKET_SHIFT)
+        if bucket is None:
+            return None
+
+        first, last = bucket
+        i = bisect.bisect_right(starts, addr, first, last) - 1
+        if i < first:
+            return None
+
+        run = self.runs[i]
+        if addr < run[0] + run[2]:
+            self._last_run = run
+            return run
+
+    def _translate(self, addr, length):
+        """Translates as much of the range at addr as possible.
+
+        Returns:
+          A tuple of (file_offset, length). If addr is not mapped, file_offset
+          is None and length extends up to the next run.
+        """
         file_offset, available_length = self._get_available_buffer(addr, length)
 
         # Mapping not valid. We need to pad until the next run.
         if file_offset is None:
+            _, starts, _ = self._get_run_index()
+
+            # If there's no next run, we need to add length padding.
             pad_length = length
-            try:
-                virt_addr, file_address, file_length = self.runs.find_gt(addr)
-                pad_length = min(length, (virt_addr - addr))
-            except ValueError:
-                # If there's no next run, we need to add length padding.
-                pass
-            return "\x00" * pad_length
-        else:
-            return self.base.read(file_offset, min(length, available_length))
+            i = bisect.bisect_right(starts, addr)
+            if i < len(starts):
+                pad_length = min(length, starts[i] - addr)
+
+            return None, pad_length
+
+        return file_offset, min(length, available_length)
+
+    def _read_chunk(self, addr, length):
+        """Read from addr as much as possible up to a length of length."""
+        file_offset, available_length = self._translate(addr, length)
+        if file_offset is None:
+            return "\x00" * available_length
+
+        return self.base.read(file_offset, available_length)
+
+    def _get_segments(self, addr, length):
+        # Runs are contiguous in the file, so segments can span many pages.
+        while length > 0:
+            file_offset, available_length = self._translate(addr, length)
+            yield file_offset, available_length
+
+            addr += available_length
+            length -= available_length
 
     def vtop(self, addr):
         file_offset, _ = self._get_available_buffer(addr, 1)
@@ -419,17 +847,15 @@ class RunBasedAddressSpace(PagedReader):
         """
         addr = int(addr)
 
-        try:
-            virt_addr, file_address, file_length = self.runs.find_le(addr)
-            available_length = file_length - (addr - virt_addr)
-            physical_offset = addr - virt_addr + file_address
+        run = self._find_run(addr)
+        if run is None:
+            return None, 0
 
-            if available_length > 0:
-                return physical_offset, min(length, available_length)
-        except ValueError:
-            pass
+        virt_addr, file_address, file_length = run
+        available_length = file_length - (addr - virt_addr)
+        physical_offset = addr - virt_addr + file_address
 
-        return None, 0
+        return physical_offset, min(length, available_length)
 
     def is_valid_address(self, addr):
         return self.vtop(addr) is not None
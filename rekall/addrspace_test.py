@@ -1,9 +1,13 @@
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 
 from rekall import addrspace
 from rekall import obj
 from rekall import session
+from rekall.plugins.addrspaces import standard
 
 
 class CustomRunsAddressSpace(addrspace.RunBasedAddressSpace):
@@ -15,6 +19,23 @@ class CustomRunsAddressSpace(addrspace.RunBasedAddressSpace):
             self.runs.insert(i)
 
 
+class DirectRunsAddressSpace(addrspace.RunBasedAddressSpace):
+    """A first address space which reads its runs itself (like winpmem)."""
+
+    def __init__(self, runs=None, data=None, **kwargs):
+        super(DirectRunsAddressSpace, self).__init__(**kwargs)
+        self.data = data
+        for i in runs:
+            self.runs.insert(i)
+
+    def _read_chunk(self, addr, length):
+        offset, available_length = self._get_available_buffer(addr, length)
+        if offset is None:
+            return "\x00" * min(length, available_length)
+
+        return self.data[offset:offset + min(length, available_length)]
+
+
 class RunBasedTest(unittest.TestCase):
     """Test the RunBasedAddressSpace implementation."""
 
@@ -55,5 +76,197 @@ class RunBasedTest(unittest.TestCase):
         self.assertEqual(self.contiguous_as.read(2000, 10),
                          "\x00" * 10)
 
+
+    def testReadMany(self):
+        requests = [(1025, 10), (0, 20), (1000, 30), (1003, 2), (2000, 10)]
+        for address_space in (self.contiguous_as, self.discontiguous_as):
+            self.assertEqual(address_space.read_many(requests),
+                             [address_space.read(*x) for x in requests])
+
+    def testReadManyWithoutBase(self):
+        address_space = DirectRunsAddressSpace(
+            session=self.session, runs=[(1000, 0, 1), (1020, 1, 9)],
+            data="0123456789")
+        self.assertTrue(address_space.base is address_space)
+
+        requests = [(1025, 10), (0, 20), (1000, 30), (2000, 10)]
+        self.assertEqual(address_space.read_many(requests),
+                         [address_space.read(*x) for x in requests])
+        self.assertEqual(address_space.read_many([(1021, 3), (1000, 1)]),
+                         ["234", "0"])
+
+    def testRunLookup(self):
+        # Many small runs with gaps, and a large run spanning many buckets.
+        runs = [(0x1000 * i, 0x800 * i, 0x800) for i in range(0, 2000, 3)]
+        runs.append((0x10000000, 0, 0x1000000))
+        address_space = CustomRunsAddressSpace(
+            session=self.session, runs=runs, data="")
+
+        for addr in range(0, 0x800000, 0x3ff) + [
+                0x10000000, 0x10fffff, 0x10ffffff, 0x11000000]:
+            expected = None
+            for start, file_offset, length in runs:
+                if start <= addr < start + length:
+                    expected = addr - start + file_offset
+
+            self.assertEqual(address_space.vtop(addr), expected)
+
+        # Runs added later are also found.
+        address_space.runs.insert((0x20000000, 0x42, 0x10))
+        self.assertEqual(address_space.vtop(0x20000004), 0x46)
+
+
+class ReversedPagesAddressSpace(addrspace.PagedReader):
+    """Maps the pages of the base in reverse order, skipping page 2."""
+    PAGE_SIZE = 0x10
+
+    def __init__(self, data=None, **kwargs):
+        super(ReversedPagesAddressSpace, self).__init__(**kwargs)
+        self.base = addrspace.BufferAddressSpace(data=data,
+                                                 session=self.session)
+        self.pages = len(data) / self.PAGE_SIZE
+
+    def vtop(self, vaddr):
+        page, offset = divmod(vaddr, self.PAGE_SIZE)
+        if page == 2 or page >= self.pages:
+            return None
+
+        return (self.pages - page - 1) * self.PAGE_SIZE + offset
+
+
+class PagedReaderTest(unittest.TestCase):
+    """Test the batched reads of the PagedReader."""
+
+    def testReadMany(self):
+        address_space = ReversedPagesAddressSpace(
+            session=session.Session(),
+            data="".join(chr(ord("a") + i) * 0x10 for i in range(8)))
+
+        requests = [(0x5, 0x30), (0x75, 0x20), (0x0, 0x80), (0x12, 0x1),
+                    (0x20, 0x8), (0x100, 0x4)]
+        self.assertEqual(address_space.read_many(requests),
+                         [address_space.read(*x) for x in requests])
+        self.assertEqual(address_space.read_many([(0xe, 0x4)]),
+                         ["hhgg"])
+
+
+class BufferTest(unittest.TestCase):
+    """Test the BufferAddressSpace over buffer objects."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+    def testBufferObjects(self):
+        data = "xxhello world hello"
+        for buf in (data[2:], buffer(data, 2)):
+            buffer_as = addrspace.BufferAddressSpace(
+                data=buf, base_offset=100, session=self.session)
+
+            self.assertEqual(buffer_as.read(106, 5), "world")
+            self.assertEqual(buffer_as.read(114, 5), "llo\x00\x00")
+            self.assertEqual(buffer_as.find("hello", 100), 100)
+            self.assertEqual(buffer_as.find("hello", 101), 112)
+            self.assertEqual(buffer_as.find("nothere", 100), -1)
+            self.assertTrue(buffer_as.startswith("world", 106))
+            self.assertFalse(buffer_as.startswith("lo\x00", 115))
+
+
+class CachingBufferAddressSpace(addrspace.CachingAddressSpaceMixIn,
+                                addrspace.BufferAddressSpace):
+    CHUNK_SIZE = 0x1000
+
+
+class ReadAheadBufferAddressSpace(CachingBufferAddressSpace):
+    READ_AHEAD_CHUNKS = 4
+
+    def __init__(self, **kwargs):
+        super(ReadAheadBufferAddressSpace, self).__init__(**kwargs)
+        self.reads = []
+
+    def _read_chunks(self, chunk_number):
+        self.reads.append(chunk_number)
+        return super(ReadAheadBufferAddressSpace, self)._read_chunks(
+            chunk_number)
+
+
+class PageCacheTest(unittest.TestCase):
+    """Test the session wide page cache."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.session.SetParameter("page_cache_mb", 1)
+
+    def testSharedBudget(self):
+        address_spaces = [
+            CachingBufferAddressSpace(data=chr(i) * 0x100000,
+                                      session=self.session)
+            for i in range(3)]
+
+        for address_space in address_spaces:
+            for offset in range(0, 0x100000, 0x1000):
+                self.assertEqual(address_space.read(offset + 10, 2),
+                                 address_space.data[0] * 2)
+
+        page_cache = self.session.page_cache
+        self.assertEqual(page_cache.size, 0x100000)
+        self.assertEqual(len(page_cache), 0x100)
+        self.assertEqual(page_cache.misses, 0x300)
+
+        # Only the most recently read data is still cached.
+        address_spaces[2].read(0x1000, 10)
+        self.assertEqual(page_cache.hits, 1)
+        address_spaces[0].read(0x1000, 10)
+        self.assertEqual(page_cache.hits, 1)
+
+    def testReadAhead(self):
+        data = "".join(chr(i) * 0x1000 for i in range(32))
+        address_space = ReadAheadBufferAddressSpace(
+            data=data, session=self.session)
+
+        # Random reads only read the chunk they need.
+        self.assertEqual(address_space.read(0x5000, 0x10), chr(5) * 0x10)
+        self.assertEqual(address_space.read(0x1000, 0x10), chr(1) * 0x10)
+        self.assertEqual(address_space.reads, [5, 1])
+
+        # Reading on from chunk 1 is sequential, so the chunks after it are
+        # read ahead.
+        self.assertEqual(address_space.read(0x2000, 0x10000),
+                         data[0x2000:0x12000])
+        self.assertEqual(address_space.reads, [5, 1, 2, 7, 12, 17])
+
+    def testVolatileData(self):
+        address_space = CachingBufferAddressSpace(
+            data="a" * 0x2000, session=self.session)
+        address_space.volatile = True
+
+        self.assertEqual(address_space.read(0x10, 2), "aa")
+        address_space.data = "b" * 0x2000
+        self.assertEqual(address_space.read(0x10, 2), "bb")
+        self.assertEqual(len(self.session.page_cache), 0)
+
+    def testFileAddressSpace(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, "image.raw")
+            with open(filename, "wb") as fd:
+                fd.write("a" * 0x10000)
+
+            address_space = standard.FileAddressSpace(
+                filename=filename, session=self.session)
+            self.assertFalse(address_space.volatile)
+            self.assertEqual(address_space.read(0x10, 2), "aa")
+            self.assertTrue(len(self.session.page_cache))
+        finally:
+            shutil.rmtree(temp_dir)
+
+        # Devices are not cached.
+        self.session.page_cache.Flush()
+        address_space = standard.FileAddressSpace(
+            filename="/dev/zero", session=self.session)
+        self.assertTrue(address_space.volatile)
+        self.assertEqual(address_space.read(0x10, 2), "\x00\x00")
+        self.assertEqual(len(self.session.page_cache), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,172 @@
+# Rekall Memory Forensics
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""A binary container for Rekall profiles.
+
+JSON profiles must be parsed completely before any type can be used, although
+most sessions only ever use a small fraction of the structs in the kernel
+profile. The binary container stores every struct of the profile as a separate
+JSON encoded entry, followed by an index of where each entry lives. Loading the
+profile only requires parsing the index, and a struct is only decoded when the
+profile first compiles it.
+
+The layout of the container is:
+
+  header: magic, version, index offset and index length.
+  entries: The JSON encoded entries.
+  index: A JSON dict with "sections" mapping each top level section of the
+    profile (e.g. $METADATA, $CONSTANTS) to the (offset, length) of its entry,
+    "structs" mapping each struct in $STRUCTS to its entry, and "digest"
+    holding the sha1 of all the entries.
+
+Since the container is not compressed, it can be mapped into memory with mmap
+directly from the profile repository.
+"""
+
+__author__ = "Michael Cohen <scudette@gmail.com>"
+
+import hashlib
+import json
+import struct
+
+
+MAGIC = "RKLPROF\x00"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIQQ")
+
+
+def IsBinaryProfile(data):
+    """Returns True if data (a string or mmap) is a binary profile."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def Write(fd, data):
+    """Writes the profile data (a JSON profile dict) to fd as a binary profile.
+    """
+    entries = []
+    index = dict(sections={}, structs={})
+    offset = HEADER.size
+    digest = hashlib.sha1()
+
+    def _AddEntry(value):
+        encoded = json.dumps(value, sort_keys=True)
+        entries.append(encoded)
+        digest.update(encoded)
+
+        result = [offset, len(encoded)]
+        return result, offset + len(encoded)
+
+    for section, value in sorted(data.items()):
+        if section == "$STRUCTS":
+            for name, definition in sorted(value.items()):
+                index["structs"][name], offset = _AddEntry(definition)
+        else:
+            index["sections"][section], offset = _AddEntry(value)
+
+    index["digest"] = digest.hexdigest()
+    encoded_index = json.dumps(index, sort_keys=True)
+    fd.write(HEADER.pack(MAGIC, VERSION, offset, len(encoded_index)))
+    for entry in entries:
+        fd.write(entry)
+
+    fd.write(encoded_index)
+
+
+class BinaryProfile(object):
+    """Read only access to a binary profile.
+
+    The binary profile can be used in place of the profile's JSON dict, but
+    entries are only decoded when they are requested.
+    """
+
+    def __init__(self, data):
+        """Opens the binary profile.
+
+        Args:
+          data: A string or an mmap object containing the binary profile.
+
+        Raises:
+          ValueError if the data is not a valid binary profile.
+        """
+        self.data = data
+        if len(data) < HEADER.size or not IsBinaryProfile(data):
+            raise ValueError("Not a binary profile.")
+
+        _, version, index_offset, index_length = HEADER.unpack(
+            data[:HEADER.size])
+        if version != VERSION:
+            raise ValueError("Unsupported binary profile version %s" % version)
+
+        encoded_index = data[index_offset:index_offset + index_length]
+        index = json.loads(encoded_index)
+        self._sections = index["sections"]
+        self._structs = index["structs"]
+
+        # Identifies the contents of the profile without reading all of it.
+        self.digest = index.get("digest") or hashlib.sha1(
+            encoded_index).hexdigest()
+
+    def _Decode(self, entry):
+        offset, length = entry
+        return json.loads(self.data[offset:offset + length])
+
+    def ListStructs(self):
+        """Returns the names of all the structs in the profile."""
+        return self._structs.keys()
+
+    def HasStruct(self, name):
+        return name in self._structs
+
+    def GetStruct(self, name):
+        """Decodes the vtype definition of the struct, or returns None."""
+        entry = self._structs.get(name)
+        if entry is not None:
+            return self._Decode(entry)
+
+    def keys(self):
+        result = self._sections.keys()
+        if self._structs:
+            result.append("$STRUCTS")
+
+        return result
+
+    def get(self, section, default=None):
+        """Decodes an entire section of the profile (like dict.get())."""
+        if section == "$STRUCTS":
+            if not self._structs:
+                return default
+
+            return dict((name, self._Decode(entry))
+                        for name, entry in self._structs.iteritems())
+
+        entry = self._sections.get(section)
+        if entry is None:
+            return default
+
+        return self._Decode(entry)
+
+    def __contains__(self, section):
+        return section in self.keys()
+
+    def __getitem__(self, section):
+        result = self.get(section)
+        if result is None:
+            raise KeyError(section)
+
+        return result
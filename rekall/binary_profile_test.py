@@ -0,0 +1,134 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the binary profile container."""
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import binary_profile
+from rekall import io_manager
+from rekall import obj
+from rekall import session
+
+# Import and register all the plugins.
+from rekall import plugins  # pylint: disable=unused-import
+
+
+PROFILE = {
+    "$METADATA": dict(ProfileClass="Profile32Bits", Type="Profile"),
+    "$CONSTANTS": dict(foo=0x1000, bar=0x2000),
+    "$ENUMS": dict(colors={"1": "red", "2": "green"}),
+    "$STRUCTS": {
+        "_FOO": [8, {
+            "Bar": [0, ["unsigned int"]],
+            "Baz": [4, ["Pointer", dict(target="_BAR")]],
+            }],
+        "_BAR": [4, {
+            "Value": [0, ["unsigned int"]],
+            }],
+        },
+    }
+
+
+class BinaryProfileTest(unittest.TestCase):
+    """Test the binary profile container."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.temp_dir = tempfile.mkdtemp()
+
+        # Do not use the types compiled by other tests.
+        obj.COMPILED_TYPES.Flush()
+
+        # _FOO.Baz points back at _FOO.
+        self.address_space = addrspace.BufferAddressSpace(
+            data="\x34\x12\x00\x00\x00\x00\x00\x00", session=self.session)
+
+        with open(os.path.join(self.temp_dir, "test"), "wb") as fd:
+            binary_profile.Write(fd, PROFILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testRoundTrip(self):
+        fd = StringIO.StringIO()
+        binary_profile.Write(fd, PROFILE)
+
+        data = binary_profile.BinaryProfile(fd.getvalue())
+        self.assertEqual(sorted(data.keys()), sorted(PROFILE))
+        for section in PROFILE:
+            self.assertEqual(data.get(section), PROFILE[section])
+
+        self.assertEqual(data.GetStruct("_BAR"), PROFILE["$STRUCTS"]["_BAR"])
+        self.assertEqual(data.GetStruct("_BAZ"), None)
+
+    def testDigest(self):
+        def GetDigest(profile_data):
+            fd = StringIO.StringIO()
+            binary_profile.Write(fd, profile_data)
+            return binary_profile.BinaryProfile(fd.getvalue()).digest
+
+        other = dict(PROFILE, **{"$CONSTANTS": dict(foo=0x1000, bar=0x2001)})
+        self.assertEqual(GetDigest(PROFILE), GetDigest(dict(PROFILE)))
+        self.assertNotEqual(GetDigest(PROFILE), GetDigest(other))
+
+        # Profiles loaded from the same data share their compiled types.
+        manager = io_manager.DirectoryIOManager(self.temp_dir)
+        profiles = [obj.Profile.LoadProfileFromData(
+            manager.GetData("test"), session=self.session, name="test")
+                    for _ in range(2)]
+        for profile in profiles:
+            profile.Object("_FOO", offset=0, vm=self.address_space)
+
+        self.assertTrue(profiles[0].types is profiles[1].types)
+
+    def testLazyProfile(self):
+        manager = io_manager.DirectoryIOManager(self.temp_dir)
+        data = manager.GetData("test")
+        self.assertTrue(isinstance(data, binary_profile.BinaryProfile))
+
+        profile = obj.Profile.LoadProfileFromData(
+            data, session=self.session, name="test")
+
+        # Nothing is decoded until it is used.
+        self.assertEqual(profile._vtypes, {})
+        self.assertTrue(profile.has_type("_FOO"))
+
+        foo = profile.Object("_FOO", offset=0, vm=self.address_space)
+        self.assertEqual(foo.Bar, 0x1234)
+        self.assertEqual(foo.Baz.Value, 0x1234)
+        self.assertEqual(sorted(profile._vtypes), ["_BAR", "_FOO"])
+
+        self.assertEqual(profile.get_constant("bar"), 0x2000)
+        self.assertEqual(profile.get_constant_by_address(0x1000), "foo")
+        self.assertEqual(profile.get_enum("colors", "2"), "green")
+
+        # A copy also decodes what it needs.
+        profile = obj.Profile.LoadProfileFromData(
+            data, session=self.session, name="test").copy()
+        self.assertEqual(profile.get_constant("foo"), 0x1000)
+        self.assertEqual(sorted(profile.vtypes), ["_BAR", "_FOO"])
+
+
+if __name__ == "__main__":
+    unittest.main()
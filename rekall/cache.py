@@ -0,0 +1,148 @@
+# Rekall Memory Forensics
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""A persistent on disk cache for data derived from an image.
+
+Some data Rekall calculates is expensive to derive, but never changes for a
+given image (for example, the address ranges of the kernel address space). Such
+data is stored in a per image directory under the cache directory, so that
+subsequent sessions over the same image can reuse it.
+
+Images are identified by a fingerprint made from their size, modification time
+and a hash of their header. Images which are not regular files (e.g. live
+memory devices) are never cached.
+"""
+
+__author__ = "Michael Cohen <scudette@gmail.com>"
+
+import hashlib
+import logging
+import os
+import shutil
+
+from rekall import config
+from rekall import io_manager
+
+
+config.DeclareOption(
+    "--cache_dir", default=None,
+    help="Location of the persistent cache. Defaults to ~/.rekall_cache.")
+
+config.DeclareOption(
+    "--no_persistent_cache", default=False, action="store_true",
+    help="Do not use the persistent cache. This should be used when "
+    "analysing memory which may change (e.g. live memory).")
+
+config.DeclareOption(
+    "--flush_cache", default=False, action="store_true",
+    help="Remove everything stored in the persistent cache for the image "
+    "(e.g. the profile and DTB found by earlier sessions) before starting.")
+
+
+class PersistentCache(object):
+    """Stores data derived from the session's image on disk."""
+
+    # The number of bytes at the start of the image which are hashed into its
+    # fingerprint.
+    HEADER_SIZE = 64 * 1024
+
+    def __init__(self, session=None):
+        self.session = session
+        self._fingerprints = {}
+
+    def GetImageFingerprint(self, filename):
+        """Returns a string identifying the image, or None.
+
+        Only regular files can be fingerprinted, since there is no way to tell
+        if other files (e.g. devices) have changed.
+        """
+        if not filename or not os.path.isfile(filename):
+            return None
+
+        stat = os.stat(filename)
+        key = (filename, stat.st_size, stat.st_mtime)
+        try:
+            return self._fingerprints[key]
+        except KeyError:
+            pass
+
+        fingerprint = hashlib.sha1("%d:%d:" % (stat.st_size, stat.st_mtime))
+        with open(filename, "rb") as fd:
+            fingerprint.update(fd.read(self.HEADER_SIZE))
+
+        result = self._fingerprints[key] = fingerprint.hexdigest()
+        return result
+
+    def _GetCacheDirectory(self):
+        """Returns the cache directory of the current image, or None."""
+        if self.session.GetParameter("no_persistent_cache"):
+            return None
+
+        fingerprint = self.GetImageFingerprint(
+            self.session.GetParameter("filename"))
+        if fingerprint is None:
+            return None
+
+        cache_dir = self.session.GetParameter("cache_dir")
+        if not cache_dir:
+            home = config.GetHomeDir()
+            if not home:
+                return None
+
+            cache_dir = os.path.join(home, ".rekall_cache")
+
+        return os.path.join(cache_dir, fingerprint)
+
+    def _GetManager(self, mode="r"):
+        path = self._GetCacheDirectory()
+        if path is None:
+            return None
+
+        try:
+            return io_manager.DirectoryIOManager(path, mode=mode)
+        except IOError:
+            return None
+
+    def Get(self, name):
+        """Returns the data stored under name, or None if not cached."""
+        manager = self._GetManager()
+        if manager is None:
+            return None
+
+        try:
+            return manager.GetData(name)
+        except (IOError, ValueError):
+            return None
+
+    def Put(self, name, data):
+        """Stores the (json serializable) data under name."""
+        manager = self._GetManager(mode="w")
+        if manager is None:
+            return
+
+        try:
+            manager.StoreData(name, data)
+        except IOError as e:
+            logging.debug("Unable to write %s to the cache: %s", name, e)
+
+    def Flush(self):
+        """Removes everything cached for the current image."""
+        path = self._GetCacheDirectory()
+        if path and os.path.isdir(path):
+            logging.info("Flushing persistent cache %s", path)
+            shutil.rmtree(path, ignore_errors=True)
@@ -39,11 +39,13 @@ import StringIO
 import gzip
 import json
 import logging
+import mmap
 import os
 import urllib2
 import urlparse
 import zipfile
 
+from rekall import binary_profile
 from rekall import registry
 
 
@@ -100,13 +102,21 @@ class IOManager(object):
         wraps the Open() method above and add deserialization to retrieve the
         actual object.
 
+        Binary profiles (see binary_profile.py) are returned as a
+        BinaryProfile() instance, which decodes its members on demand.
+
         Returns None if the file is not found.
         """
         try:
-            return json.load(self.Open(name))
+            data = self.Open(name).read()
         except IOManagerError:
             return None
 
+        if binary_profile.IsBinaryProfile(data):
+            return binary_profile.BinaryProfile(data)
+
+        return json.loads(data)
+
     def StoreData(self, name, data, **options):
         """Stores the data in the named container member.
 
@@ -180,6 +190,18 @@ class DirectoryIOManager(IOManager):
         except IOError:
             return gzip.open(path + ".gz")
 
+    def GetData(self, name):
+        """Maps uncompressed binary profiles directly into memory."""
+        path = self._GetAbsolutePathName(name)
+        if os.path.isfile(path):
+            with open(path, "rb") as fd:
+                if binary_profile.IsBinaryProfile(
+                        fd.read(len(binary_profile.MAGIC))):
+                    return binary_profile.BinaryProfile(mmap.mmap(
+                        fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+        return super(DirectoryIOManager, self).GetData(name)
+
     def __str__(self):
         return "Directory:%s" % self.dump_dir
 
@@ -39,6 +39,7 @@ import struct
 
 import copy
 from rekall import addrspace
+from rekall import binary_profile
 from rekall import registry
 from rekall import utils
 
@@ -593,7 +594,16 @@ class NativeType(BaseObject, NumericProxyMixIn):
     def write(self, data):
         """Writes the data back into the address space"""
         output = struct.pack(self.format_string, data)
-        return self.obj_vm.write(self.obj_offset, output)
+        result = self.obj_vm.write(self.obj_offset, output)
+
+        # A value unpacked in advance by the parent struct is now out of date
+        # (See Struct._get_compiled_member()).
+        if result and self.value is not None:
+            self.value = None
+            if isinstance(self.obj_parent, Struct):
+                self.obj_parent._compiled_values = None
+
+        return result
 
     def proxied(self):
         return self.v()
@@ -1124,6 +1134,19 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
     Structs have members at various fixed relative offsets from our own base
     offset.
     """
+
+    # The profile sets these on the compiled struct classes (See
+    # Profile._compile_struct_layout()). The layout is a struct.Struct which
+    # unpacks all the fixed offset native members at once, and the fields dict
+    # maps the member names to (index in layout, offset, type_name,
+    # format_string).
+    _compiled_layout = None
+    _compiled_fields = {}
+
+    # The unpacked layout, read on first access. False if it can not be read,
+    # or if the address space's data may change and so must not be cached.
+    _compiled_values = None
+
     def __init__(self, members=None, struct_size=0, **kwargs):
         """ This must be instantiated with a dict of members. The keys
         are the offsets, the values are Curried Object classes that
@@ -1223,6 +1246,11 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
                 result = result.m(sub_attr)
             return result
 
+        if attr in self._compiled_fields:
+            result = self._get_compiled_member(attr)
+            if result is not None:
+                return result
+
         if attr in self.members:
             # Allow the element to be a callable rather than a list - this is
             # useful for aliasing member names
@@ -1251,6 +1279,49 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
 
         return result
 
+    def _get_compiled_member(self, attr):
+        """Returns the member from the compiled layout, or None.
+
+        The whole layout is read and unpacked once, the first time any of the
+        compiled members is accessed.
+        """
+        values = self._compiled_values
+        if values is None:
+            values = self._compiled_values = self._read_compiled_layout()
+
+        if values is False:
+            return
+
+        index, offset, type_name, format_string = self._compiled_fields[attr]
+        return NativeType(
+            type_name=type_name, format_string=format_string,
+            value=values[index],
+            offset=self.obj_offset + offset, vm=self.obj_vm, parent=self,
+            name=attr, profile=self.obj_profile, context=self.obj_context)
+
+    def _read_compiled_layout(self):
+        # Members of writeable or live address spaces read the address space
+        # each time, so they always reflect its current data.
+        if self.obj_vm.data_may_change():
+            return False
+
+        layout = self._compiled_layout
+        start = self.obj_offset
+        end = start + layout.size - 1
+
+        # Members in invalid pages must still be NoneObjects, so only use the
+        # layout if all of it is valid.
+        for address in [start, end] + range(
+                (start | 0xfff) + 1, end, 0x1000):
+            if not self.obj_vm.is_valid_address(address):
+                return False
+
+        data = self.obj_vm.read(start, layout.size)
+        if len(data) != layout.size:
+            return False
+
+        return layout.unpack(data)
+
     def __getattr__(self, attr):
         result = self.m(attr)
         if result == None:
@@ -1265,6 +1336,9 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
         if not hasattr(member, 'write') or not member.write(value):
             raise ValueError("Error writing value to member " + attr)
 
+        # The compiled layout must be read again.
+        self._compiled_values = None
+
     def walk_list(self, list_member, include_current=True):
         """Walk a single linked list in this struct.
 
@@ -1294,6 +1368,21 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
             yield item
 
 
+def ProfileObject(profile=None, **kwargs):
+    """Instantiates an object using the profile passed by the caller.
+
+    Compiled struct members use this rather than a bound profile.Object, so
+    that the compiled types can be shared between profiles.
+    """
+    return profile.Object(**kwargs)
+
+
+# Compiled types are shared between all the profiles with the same cache
+# key. The key records how the profile was built (see Profile._set_cache_key()),
+# and values are dicts of compiled types.
+COMPILED_TYPES = utils.FastStore(max_size=50)
+
+
 ## Profiles are the interface for creating/interpreting
 ## objects
 
@@ -1309,11 +1398,13 @@ class Profile(object):
 
     # These are the vtypes - they are just a dictionary describing the types
     # using the "vtype" language. This dictionary will be compiled into
-    # executable code and placed into self.types.
-    vtypes = None
+    # executable code and placed into self.types. (See the vtypes property).
+    _vtypes = None
 
-    # This hold the executable code compiled from the vtypes above.
-    types = None
+    # This hold the executable code compiled from the vtypes above (See the
+    # types property).
+    _types = None
+    _cache_key = None
 
     # This holds the entity generators indexed by the class of entity they
     # generate.
@@ -1323,7 +1414,21 @@ class Profile(object):
     __metaclass__ = registry.MetaclassRegistry
 
     # This is a dict of constants
-    constants = None
+    _constants = None
+    _constant_addresses = None
+
+    _enums = None
+    _reverse_enums = None
+
+    # A BinaryProfile() the profile was loaded from. Its sections are only
+    # decoded when they are first used.
+    _lazy_data = None
+
+    # The sections of _lazy_data which were not decoded yet.
+    _lazy_sections = frozenset()
+
+    # The BinaryProfile() to decode structs missing from _vtypes from.
+    _lazy_structs = None
 
     # This is a record of all the modification classes that were applied to this
     # profile.
@@ -1342,13 +1447,17 @@ class Profile(object):
     _metadata = None
 
     @classmethod
-    def LoadProfileFromData(cls, data, session=None, name=None):
+    def LoadProfileFromData(cls, data, session=None, name=None, source=None):
         """Creates a profile directly from a JSON object.
 
         Args:
           data: A data structure of an encoded profile. Described:
           http://docs.rekall.googlecode.com/git/development.html#_profile_serializations
 
+          source: Identifies where the data was loaded from (e.g. the container
+            and file name). Profiles loaded from the same source share their
+            compiled types. JSON profiles without a source do not share them.
+
         Returns:
           a Profile() instance.
 
@@ -1377,11 +1486,32 @@ class Profile(object):
             result = profile_cls(name=name, session=session,
                                  metadata=metadata)
 
-            result._SetupProfileFromData(data)  # pylint: disable=protected-access
+            # pylint: disable=protected-access
+            cache_key = result._cache_key
+            result._SetupProfileFromData(data)
+
+            # Profiles of the same name may hold different data (e.g. from
+            # different repositories). Binary profiles record a digest of
+            # their data.
+            digest = getattr(data, "digest", None)
+            if source is None and digest is None:
+                result._set_cache_key(None)
+            else:
+                result._set_cache_key(cache_key + (source, digest))
+
             return result
 
     def _SetupProfileFromData(self, data):
         """Sets up the current profile."""
+        if isinstance(data, binary_profile.BinaryProfile):
+            # Defer decoding everything until it is used.
+            self._lazy_data = self._lazy_structs = data
+            self._lazy_sections = set(
+                ["$CONSTANTS", "$ENUMS", "$REVENUMS"]).intersection(
+                    data.keys())
+            self.known_types.update(data.ListStructs())
+            return
+
         # The constants
         constants = data.get("$CONSTANTS")
         if constants:
@@ -1441,7 +1571,7 @@ class Profile(object):
             raise RuntimeError("Session must be specified.")
 
         self.overlays = []
-        self.vtypes = {}
+        self._vtypes = {}
         self.generators = {}
         self.constants = {}
         self.constant_addresses = utils.SortedCollection(key=lambda x: x[0])
@@ -1456,6 +1586,8 @@ class Profile(object):
 
         # This is the local cache of compiled expressions.
         self.flush_cache()
+        self._set_cache_key((self.__class__.__name__, self.name,
+                             repr(sorted(self._metadata.items()))))
 
         class dummy(object):
             profile = self
@@ -1474,10 +1606,51 @@ class Profile(object):
 
     def EnsureInitialized(self):
         if not self._initialized:
+            cache_key = self._cache_key
             self.Initialize(self)
+            if cache_key:
+                self._set_cache_key(cache_key + ("Initialize",))
 
     def flush_cache(self):
-        self.types = {}
+        # The profile was changed in an unknown way, so it can no longer share
+        # compiled types with other profiles.
+        self._cache_key = None
+        self._types = {}
+
+    def _set_cache_key(self, cache_key):
+        """Shares the compiled types with all profiles with the same key.
+
+        The key describes how the profile was built: The class, name and
+        metadata of the profile (and a digest of its data), followed by the
+        steps applied to it (e.g. Initialize or the name of a
+        ProfileModification). Profiles built with the same steps will compile
+        identical types.
+
+        The shared types are only looked up when they are first needed (See the
+        types property), so intermediate keys never enter COMPILED_TYPES.
+        """
+        self._cache_key = cache_key
+        if cache_key is not None:
+            self._types = None
+
+    @property
+    def types(self):
+        """The compiled types, shared with all profiles with our cache key."""
+        if self._types is None:
+            self._types = {}
+            if self._cache_key is None:
+                return self._types
+
+            try:
+                self._types = COMPILED_TYPES.Get(self._cache_key)
+            except KeyError:
+                COMPILED_TYPES.Put(self._cache_key, self._types)
+
+        return self._types
+
+    @types.setter
+    def types(self, value):
+        self._types = value
 
     def copy(self):
         """Makes a copy of this profile."""
@@ -1485,13 +1658,19 @@ class Profile(object):
 
         # pylint: disable=protected-access
         result = self.__class__(name=self.name, session=self.session)
-        result.vtypes = self.vtypes.copy()
+        result._vtypes = self._vtypes.copy()
         result.generators = self.generators.copy()
         result.overlays = self.overlays[:]
-        result.enums = self.enums.copy()
-        result.reverse_enums = self.reverse_enums.copy()
-        result.constants = self.constants.copy()
-        result.constant_addresses = self.constant_addresses.copy()
+        result._enums = self._enums.copy()
+        result._reverse_enums = self._reverse_enums.copy()
+        result._constants = self._constants.copy()
+        result._constant_addresses = self._constant_addresses.copy()
+
+        # The copy decodes the parts of the binary profile it needs itself.
+        result._lazy_data = self._lazy_data
+        result._lazy_sections = set(self._lazy_sections)
+        result._lazy_structs = self._lazy_structs
+
         result.applied_modifications = self.applied_modifications[:]
 
         # Object classes are shallow dicts.
@@ -1499,6 +1678,11 @@ class Profile(object):
         result._initialized = self._initialized
         result.known_types = self.known_types.copy()
         result._metadata = self._metadata.copy()
+
+        # The copy compiles the same types as we do. Changing either profile
+        # replaces its types dict, so it is safe to share it.
+        result._cache_key = self._cache_key
+        result._types = self._types
         # pylint: enable=protected-access
 
         return result
@@ -1537,8 +1721,100 @@ class Profile(object):
         self.EnsureInitialized()
         return tuple([self._metadata.get(x) for x in args])
 
+    @property
+    def vtypes(self):
+        """All the vtypes of this profile.
+
+        This decodes all the structs of a binary profile. Use _get_vtype() to
+        only decode a single struct.
+        """
+        if self._lazy_structs is not None:
+            for type_name in self._lazy_structs.ListStructs():
+                self._get_vtype(type_name)
+
+            self._lazy_structs = None
+
+        return self._vtypes
+
+    @vtypes.setter
+    def vtypes(self, value):
+        self._vtypes = value
+        self._lazy_structs = None
+
+    def _get_vtype(self, type_name, default=None):
+        """Returns the vtype definition of type_name, decoding it if needed."""
+        result = self._vtypes.get(type_name)
+        if result is None and self._lazy_structs is not None:
+            result = self._lazy_structs.GetStruct(type_name)
+            if result is not None:
+                self._vtypes[type_name] = result
+
+        if result is None:
+            return default
+
+        return result
+
+    def _load_lazy_section(self, section):
+        """Decodes a section of the binary profile on first use."""
+        if section not in self._lazy_sections:
+            return
+
+        self._lazy_sections.remove(section)
+        data = self._lazy_data.get(section)
+        if not data:
+            return
+
+        if section == "$CONSTANTS":
+            self._add_constants(data, constants_are_addresses=True)
+
+        elif section == "$ENUMS":
+            self.add_enums(**data)
+
+        elif section == "$REVENUMS":
+            self.add_reverse_enums(**data)
+
+    @property
+    def constants(self):
+        self._load_lazy_section("$CONSTANTS")
+        return self._constants
+
+    @constants.setter
+    def constants(self, value):
+        self._constants = value
+
+    @property
+    def constant_addresses(self):
+        self._load_lazy_section("$CONSTANTS")
+        return self._constant_addresses
+
+    @constant_addresses.setter
+    def constant_addresses(self, value):
+        self._constant_addresses = value
+
+    @property
+    def enums(self):
+        self._load_lazy_section("$ENUMS")
+        return self._enums
+
+    @enums.setter
+    def enums(self, value):
+        self._enums = value
+
+    @property
+    def reverse_enums(self):
+        self._load_lazy_section("$REVENUMS")
+        return self._reverse_enums
+
+    @reverse_enums.setter
+    def reverse_enums(self, value):
+        self._reverse_enums = value
+
     def has_type(self, type_name):
-        return type_name in self.vtypes
+        if type_name in self._vtypes:
+            return True
+
+        return (self._lazy_structs is not None and
+                self._lazy_structs.HasStruct(type_name))
 
     def has_class(self, class_name):
         return class_name in self.object_classes
@@ -1556,18 +1832,30 @@ class Profile(object):
     def add_constants(self, constants_are_addresses=False, **kwargs):
         """Add the kwargs as constants for this profile."""
         self.flush_cache()
+        self._add_constants(kwargs, constants_are_addresses)
 
-        for k, v in kwargs.iteritems():
-            self.constants[k] = v
-            if constants_are_addresses:
-                try:
-                    # We need to interpret the value as a pointer.
-                    address = Pointer.integer_to_address(v)
-                    if (address, 0) not in self.constant_addresses:
-                        self.constant_addresses.insert((address, k))
+    def _add_constants(self, constants, constants_are_addresses=False):
+        self.constants.update(constants)
+        if not constants_are_addresses:
+            return
 
-                except ValueError:
-                    pass
+        addresses = []
+        for k, v in constants.iteritems():
+            try:
+                # We need to interpret the value as a pointer.
+                addresses.append((Pointer.integer_to_address(v), k))
+            except ValueError:
+                pass
+
+        # Inserting is O(n) so it is much faster to sort all the addresses of
+        # a large symbol table once.
+        if len(addresses) > len(self.constant_addresses):
+            addresses.extend(self.constant_addresses)
+            self.constant_addresses = utils.SortedCollection(
+                addresses, key=lambda x: x[0])
+        else:
+            for item in addresses:
+                self.constant_addresses.insert(item)
 
     def add_reverse_enums(self, **kwargs):
         """Add the kwargs as a reverse enum for this profile."""
@@ -1595,15 +1883,15 @@ class Profile(object):
         ## definitions).
         for k, v in abstract_types.items():
             if isinstance(v, list):
-                self.vtypes[k] = v
+                self._vtypes[k] = v
 
             else:
-                original = self.vtypes.get(k, self.EMPTY_DESCRIPTOR)
+                original = self._get_vtype(k, self.EMPTY_DESCRIPTOR)
                 original[1].update(v[1])
                 if v[0]:
                     original[0] = v[0]
 
-                self.vtypes[k] = original
+                self._vtypes[k] = original
 
     def compile_type(self, type_name):
         """Compile the specific type and ensure it exists in the type cache.
@@ -1616,11 +1904,11 @@ class Profile(object):
         if type_name in self.types:
             return
 
-        original_type_descriptor = type_descriptor = copy.deepcopy(
-            self.vtypes.get(type_name, self.EMPTY_DESCRIPTOR))
+        original_type_descriptor = type_descriptor = self._copy_type_descriptor(
+            self._get_vtype(type_name, self.EMPTY_DESCRIPTOR))
 
         for overlay in self.overlays:
-            type_overlay = copy.deepcopy(overlay.get(type_name))
+            type_overlay = self._copy_type_descriptor(overlay.get(type_name))
             type_descriptor = self._apply_type_overlay(
                 type_descriptor, type_overlay)
 
@@ -1630,7 +1918,7 @@ class Profile(object):
         if isinstance(type_descriptor, str):
             self.compile_type(type_descriptor)
             self.types[type_name] = self.types[type_descriptor]
-            type_descriptor = self.vtypes[type_descriptor]
+            type_descriptor = self._get_vtype(type_descriptor)
 
         if type_descriptor == self.EMPTY_DESCRIPTOR:
             # Mark that this is a pure object - not described by a
@@ -1672,6 +1960,26 @@ class Profile(object):
             self.types[type_name] = self._make_struct_callable(
                 cls, type_name, members, size, callable_members)
 
+    @staticmethod
+    def _copy_type_descriptor(descriptor):
+        """Copies a type descriptor so _apply_type_overlay() can modify it.
+
+        Applying overlays only changes the descriptor's list, its fields dict
+        and the fields' lists, so there is no need for a (slow) deepcopy.
+        """
+        if (not isinstance(descriptor, list) or len(descriptor) != 2 or
+                not isinstance(descriptor[1], dict)):
+            return descriptor
+
+        fields = {}
+        for name, field in descriptor[1].iteritems():
+            if isinstance(field, list):
+                field = list(field)
+
+            fields[name] = field
+
+        return [descriptor[0], fields]
+
     def _make_struct_callable(self, cls, type_name, members, size,
                               callable_members):
         """Compile the structs class into a callable.
@@ -1732,11 +2040,76 @@ class Profile(object):
         # override the methods in cls depending on the members dict, without
         # altering the cls class permanently (This is a kind of metaclass
         # programming).
+        if issubclass(cls, Struct):
+            (properties["_compiled_layout"],
+             properties["_compiled_fields"]) = self._compile_struct_layout(
+                 members, size)
+
         derived_cls = type(str(type_name), (cls,), properties)
 
         return Curry(derived_cls,
                      type_name=type_name, members=members, struct_size=size)
 
+    # The struct format characters of the native types we unpack with the
+    # compiled struct layout.
+    COMPILED_FORMATS = "cbBhHiIlLqQ"
+
+    def _compile_struct_layout(self, members, size):
+        """Builds a struct.Struct to unpack the struct's native members at once.
+
+        Only little endian native types (e.g. "unsigned long") at fixed offsets
+        are included. Other members (pointers, nested structs, bit fields etc)
+        are created as usual when accessed.
+
+        Returns:
+          A tuple of (struct.Struct, fields dict) or (None, {}) if no member can
+          be compiled. See Struct._compiled_fields.
+        """
+        natives = []
+        for name, (offset, member_cls) in members.iteritems():
+            if callable(offset) or not isinstance(member_cls, Curry):
+                continue
+
+            # Members are curried calls to ProfileObject() with just a type name
+            # and a name.
+            kwargs = member_cls._kwargs  # pylint: disable=protected-access
+            if (member_cls._target is not ProfileObject or  # pylint: disable=protected-access
+                    set(kwargs) != set(["type_name", "name"])):
+                continue
+
+            type_name = kwargs["type_name"]
+            native_cls = self.object_classes.get(type_name)
+            if (not isinstance(native_cls, Curry) or
+                    native_cls._target is not NativeType or  # pylint: disable=protected-access
+                    self.has_type(type_name)):
+                continue
+
+            format_string = native_cls._kwargs.get("format_string")  # pylint: disable=protected-access
+            if (not format_string or len(format_string) != 2 or
+                    format_string[0] != "<" or
+                    format_string[1] not in self.COMPILED_FORMATS):
+                continue
+
+            natives.append((offset, name, type_name, format_string))
+
+        # Unions have overlapping members which can not be expressed in a
+        # single layout.
+        layout = "<"
+        fields = {}
+        end = 0
+        for offset, name, type_name, format_string in sorted(natives):
+            if offset < end:
+                continue
+
+            layout += "%dx%s" % (offset - end, format_string[1])
+            fields[name] = (len(fields), offset, type_name, format_string)
+            end = offset + struct.calcsize(format_string)
+
+        if not fields or (isinstance(size, (int, long)) and end > size):
+            return None, {}
+
+        return struct.Struct(layout), fields
+
     def legacy_field_descriptor(self, typeList):
         """Converts the list expression into a target, target_args notation.
 
@@ -1798,7 +2171,7 @@ class Profile(object):
         ## This is currently the recommended way to specify a type:
         ## e.g. [ 'Pointer', {target="int"}]
         if isinstance(target_args, dict):
-            return Curry(self.Object, type_name=target, name=name,
+            return Curry(ProfileObject, type_name=target, name=name,
                          **target_args)
 
         # This is of the deprecated form ['class_name', ['arg1', 'arg2']].
@@ -1814,7 +2187,7 @@ class Profile(object):
             logging.warning("Unable to find a type for %s, assuming int",
                             typeList)
 
-        return Curry(self.Object, type_name='int', name=name)
+        return Curry(ProfileObject, type_name='int', name=name)
 
     def _get_dummy_obj(self, name):
         """Make a dummy object on top of the dummy address space."""
@@ -2216,9 +2589,16 @@ class ProfileModification(object):
     def __new__(cls, profile):
         # Return a copy of the profile.
         result = profile.copy()
+        cache_key = result._cache_key  # pylint: disable=protected-access
 
         # Apply the modification.
         cls.modify(result)
+        result.applied_modifications.append(cls.__name__)
+
+        # Profiles with the same modifications can share compiled types.
+        if cache_key:
+            result._set_cache_key(  # pylint: disable=protected-access
+                cache_key + (cls.__name__,))
 
         return result
 
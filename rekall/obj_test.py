@@ -1,9 +1,11 @@
 import logging
 import unittest
 
+import struct
+
 from rekall import addrspace
-from rekall import conf
 from rekall import obj
+from rekall import session
 
 # Import and register all the plugins.
 from rekall import plugins
@@ -200,6 +202,196 @@ class ProfileTest(unittest.TestCase):
         self.assertEqual(test[100], None)
 
 
+class CompiledStructTest(unittest.TestCase):
+    """Test reading struct members through the compiled layout."""
+
+    VTYPES = {
+        'Test': [0x20, {
+            'a': [0x00, ['unsigned int']],
+            'b': [0x04, ['unsigned short']],
+            'c': [0x06, ['unsigned char']],
+            'bits': [0x07, ['BitField', dict(start_bit=0, end_bit=4,
+                                             native_type="unsigned char")]],
+            'ptr': [0x08, ['pointer', ['Inner']]],
+            'inner': [0x0c, ['Inner']],
+            'q': [0x10, ['unsigned long long']],
+            }],
+        'Inner': [0x04, {
+            'x': [0x00, ['unsigned int']],
+            }],
+        }
+
+    DATA = struct.pack("<IHBBIIQI", 0x11223344, 5, 7, 0xa3, 0x18, 0x42,
+                       0x0102030405060708, 0x99)
+
+    def setUp(self):
+        self.session = session.Session()
+        self.profile = obj.Profile.classes['Profile32Bits'](
+            session=self.session)
+        self.profile.add_types(self.VTYPES)
+
+    def GetTest(self, **kwargs):
+        address_space = addrspace.BufferAddressSpace(
+            data=self.DATA, session=self.session, **kwargs)
+        return self.profile.Object("Test", offset=0, vm=address_space)
+
+    def testCompiledRead(self):
+        test = self.GetTest()
+
+        # Only the native members are in the layout.
+        self.assertEqual(sorted(test._compiled_fields), ["a", "b", "c", "q"])
+
+        self.assertEqual(test.a, 0x11223344)
+        self.assertEqual(test.b, 5)
+        self.assertEqual(test.c.v(), 7)
+        self.assertEqual(test.q, 0x0102030405060708)
+        self.assertEqual(test.q.obj_offset, 0x10)
+        self.assertEqual(test.q.obj_parent, test)
+        self.assertTrue(isinstance(test.a, obj.NativeType))
+
+        # All the members came from one read.
+        self.assertEqual(len(test._compiled_values), 4)
+
+    def testOtherMembers(self):
+        test = self.GetTest()
+
+        self.assertEqual(test.bits, 3)
+        self.assertEqual(test.ptr, 0x18)
+        self.assertEqual(test.ptr.x, 0x99)
+        self.assertEqual(test.ptr.dereference().obj_offset, 0x18)
+        self.assertEqual(test.inner.x, 0x42)
+        self.assertEqual(test.inner.x.obj_offset, 0x0c)
+        self.assertEqual(test.m("inner.x"), 0x42)
+
+    def testWriteThenRead(self):
+        test = self.GetTest()
+        member = test.m("b")
+        self.assertEqual(member, 5)
+
+        self.assertTrue(member.write(9))
+        self.assertEqual(member.v(), 9)
+        self.assertEqual(test.b.v(), 9)
+        self.assertEqual(test.a, 0x11223344)
+
+        test.SetMember("a", 1)
+        self.assertEqual(test.a, 1)
+
+        # Bit fields are not in the layout so they always read the data.
+        test.obj_vm.write(7, "\x04")
+        self.assertEqual(test.bits, 4)
+
+    def testWriteableAddressSpace(self):
+        test = self.GetTest(write=True)
+        self.assertEqual(test.a, 0x11223344)
+
+        # Members of writeable address spaces are not cached.
+        test.obj_vm.write(0, struct.pack("<I", 2))
+        self.assertEqual(test.a, 2)
+        self.assertEqual(test._compiled_values, False)
+
+    def testVolatileAddressSpace(self):
+        test = self.GetTest()
+        test.obj_vm.volatile = True
+        member = test.m("a")
+
+        test.obj_vm.write(0, struct.pack("<I", 2))
+        self.assertEqual(member, 2)
+        self.assertEqual(test.a, 2)
+
+
+class AddFooFlags(obj.ProfileModification):
+    """A modification used to test the compiled types cache."""
+
+    @classmethod
+    def modify(cls, profile):
+        profile.add_overlay({
+            '_FOO': [None, {
+                'Flags': [0x04, ['unsigned short']],
+                }]})
+
+
+class CompiledTypesCacheTest(unittest.TestCase):
+    """Test sharing compiled types between profiles."""
+
+    def GetData(self, size=8):
+        return {
+            "$METADATA": dict(ProfileClass="Profile32Bits", Type="Profile"),
+            "$STRUCTS": {
+                "_FOO": [size, {
+                    "Bar": [0, ["unsigned int"]],
+                    }],
+                },
+            }
+
+    def setUp(self):
+        self.session = session.Session()
+        self.address_space = addrspace.BufferAddressSpace(
+            data="\x01\x00\x00\x00\x02\x00\x00\x00" * 4,
+            session=self.session)
+
+    def LoadProfile(self, data=None, source="test.json"):
+        profile = obj.Profile.LoadProfileFromData(
+            data or self.GetData(), session=self.session, name="test",
+            source=source)
+        profile.Object("_FOO", vm=self.address_space)
+
+        return profile
+
+    def testCopy(self):
+        profile = self.LoadProfile()
+        copy = profile.copy()
+        self.assertTrue(copy.types is profile.types)
+        self.assertTrue("_FOO" in copy.types)
+
+        # Profiles loaded from the same source also share the types.
+        self.assertTrue(self.LoadProfile().types is profile.types)
+
+        # We can not tell if data without a source is the same.
+        self.assertFalse(self.LoadProfile(source=None).types is profile.types)
+
+        # Copies do not add entries to the store.
+        key = obj.Profile.classes["Profile32Bits"](
+            name="test", session=self.session)._cache_key
+        self.assertFalse(key in obj.COMPILED_TYPES)
+
+    def testDifferentData(self):
+        profile = self.LoadProfile()
+        other = self.LoadProfile(self.GetData(size=16), source="other.json")
+
+        self.assertFalse(other.types is profile.types)
+        self.assertEqual(profile.get_obj_size("_FOO"), 8)
+        self.assertEqual(other.get_obj_size("_FOO"), 16)
+
+    def testProfileModification(self):
+        profile = self.LoadProfile()
+        modified = AddFooFlags(profile)
+        self.assertFalse(modified.types is profile.types)
+        self.assertEqual(
+            modified.Object("_FOO", vm=self.address_space).Flags, 2)
+        self.assertEqual(
+            profile.Object("_FOO", vm=self.address_space).m("Flags"), None)
+
+        # The same modification of the same profile shares the types.
+        self.assertTrue(AddFooFlags(self.LoadProfile()).types is
+                        modified.types)
+
+    def testInvalidation(self):
+        profile = self.LoadProfile()
+
+        copy = profile.copy()
+        copy.add_types({"_BAR": [4, {"Baz": [0, ["unsigned int"]]}]})
+        self.assertFalse(copy.types is profile.types)
+        self.assertEqual(copy.Object("_BAR", vm=self.address_space).Baz, 1)
+        self.assertFalse("_BAR" in profile.types)
+
+        copy = profile.copy()
+        copy.add_overlay({"_FOO": [None, {"Baz": [4, ["unsigned int"]]}]})
+        self.assertFalse(copy.types is profile.types)
+        self.assertEqual(copy.Object("_FOO", vm=self.address_space).Baz, 2)
+        self.assertEqual(
+            profile.Object("_FOO", vm=self.address_space).m("Baz"), None)
+
+
 class WinXPProfileTests(unittest.TestCase):
     """Tests for basic profile functionality for the WinXP profile."""
 
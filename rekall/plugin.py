@@ -22,13 +22,30 @@
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 
+import os
 import StringIO
 
 from rekall import config
+from rekall import processpool
 from rekall import registry
 from rekall.ui import renderer as rekall_renderer
 
 
+config.DeclareOption(
+    "--process_workers", group="Performance",
+    action=config.IntParser,
+    help="The number of processes used to render per process plugins in "
+    "parallel.")
+
+
+def _RenderItemInWorker(state, index):
+    plugin, renderer, items = state
+    fd = StringIO.StringIO()
+    plugin.render_item(renderer.copy_to(fd), items[index])
+
+    return fd.getvalue()
+
+
 class Error(Exception):
     """Raised for plugin errors."""
 
@@ -266,3 +283,61 @@ class VerbosityMixIn(object):
         super(VerbosityMixIn, self).__init__(**kwargs)
 
         self.verbosity = verbosity
+
+
+class ParallelRenderMixIn(object):
+    """A mixin for plugins which render each item (e.g. a process) on its own.
+
+    The plugin implements render_item() and calls render_items() from its
+    render() method. If the process_workers parameter is set, the items are
+    rendered by a pool of forked worker processes and their output is written
+    to the renderer in the original order, so the output is the same as when
+    rendering serially.
+
+    Note that render_item() must only write to the renderer it is given - any
+    other state it changes is lost when it runs in a worker.
+    """
+
+    def render_item(self, renderer, item):
+        """Renders the output for a single item."""
+        raise NotImplementedError()
+
+    def render_items(self, renderer, items):
+        """Calls render_item() for each item, possibly in parallel."""
+        workers = self.session.GetParameter("process_workers", 1)
+
+        # Parallel rendering needs a renderer whose output can be joined
+        # together. Workers never start their own pools.
+        if (workers > 1 and not processpool.InWorker() and
+                hasattr(os, "fork") and
+                getattr(renderer, "joinable_output", False)):
+            items = list(items)
+            if len(items) > 1:
+                return self._render_items_in_parallel(
+                    renderer, items, workers)
+
+        for item in items:
+            self.render_item(renderer, item)
+
+    def _render_items_in_parallel(self, renderer, items, workers):
+        """Renders the items in a pool of forked worker processes.
+
+        Each worker inherits a copy of this plugin, the renderer and the items
+        and reopens the image. Only the rendered text is sent back.
+        """
+        session = self.session
+        address_spaces = [getattr(self, "kernel_address_space", None),
+                          getattr(self, "physical_address_space", None),
+                          session.kernel_address_space,
+                          session.physical_address_space]
+
+        for index, output in processpool.RunInWorkers(
+                _RenderItemInWorker, range(len(items)),
+                min(workers, len(items)), state=(self, renderer, items),
+                session=session, address_spaces=address_spaces):
+            session.report_progress(
+                "Rendered %s/%s items (%s workers)" % (
+                    index + 1, len(items), workers))
+
+            for line in output.decode("utf8").splitlines(True):
+                renderer.write(line)
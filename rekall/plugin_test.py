@@ -0,0 +1,150 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the plugin base classes."""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import StringIO
+import time
+import unittest
+
+from rekall import addrspace
+from rekall import plugin
+from rekall import session
+from rekall.ui import renderer
+
+
+class ChecksumPlugin(plugin.ParallelRenderMixIn, plugin.Command):
+    """Renders a slow checksum of each page of an address space."""
+
+    __abstract = True
+
+    # Number of hashing rounds per page - this makes each item expensive.
+    ROUNDS = 200
+
+    def __init__(self, address_space=None, **kwargs):
+        super(ChecksumPlugin, self).__init__(**kwargs)
+        self.address_space = address_space
+
+    def render(self, renderer):
+        renderer.table_header([("Offset", "offset", "[addrpad]"),
+                               ("Pid", "pid", ">6"),
+                               ("Checksum", "checksum", "")])
+
+        self.render_items(renderer, range(
+            0, self.address_space.end(), 0x1000))
+
+    def render_item(self, renderer, offset):
+        data = self.address_space.read(offset, 0x1000)
+        checksum = ""
+        for _ in range(self.ROUNDS):
+            checksum = hashlib.sha1(checksum + data).digest()
+
+        renderer.table_row(offset, os.getpid(), checksum[:8].encode("hex"))
+        renderer.format(u"Page {0:#x} \u00e9\n", offset)
+
+
+class ParallelRenderTest(unittest.TestCase):
+    """Test rendering items in worker processes."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.address_space = addrspace.BufferAddressSpace(
+            data="".join(chr(i) * 0x1000 for i in range(64)),
+            session=self.session)
+
+    def Render(self, workers, renderer_cls=renderer.TextRenderer):
+        self.session.SetParameter("process_workers", workers)
+        fd = StringIO.StringIO()
+        ui_renderer = renderer_cls(session=self.session, fd=fd)
+        ui_renderer.start(plugin_name="checksum")
+        ChecksumPlugin(session=self.session,
+                       address_space=self.address_space).render(ui_renderer)
+        ui_renderer.end()
+
+        return fd.getvalue()
+
+    def SplitPids(self, output):
+        """Returns the output without the pid column and the pids seen."""
+        lines = []
+        pids = set()
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[1].isdigit():
+                pids.add(int(fields[1]))
+                fields[1] = "-"
+                line = " ".join(fields)
+
+            lines.append(line)
+
+        return lines, pids
+
+    def testParallelRender(self):
+        serial, serial_pids = self.SplitPids(self.Render(1))
+        parallel, parallel_pids = self.SplitPids(self.Render(3))
+
+        # The output is in the original order.
+        self.assertEqual(serial, parallel)
+        self.assertEqual(len(serial), 64 * 2 + 2)
+        self.assertTrue(u"Page 0x3f000 \u00e9" in
+                        parallel[-1].decode("utf8"))
+
+        self.assertEqual(serial_pids, set([os.getpid()]))
+        self.assertFalse(os.getpid() in parallel_pids)
+
+    def testJsonIsRenderedSerially(self):
+        result = json.loads(self.Render(3, renderer.JsonRenderer))
+        rows = [x for x in result["data"] if isinstance(x, dict)]
+
+        self.assertEqual(len(rows), 64)
+        self.assertEqual(set(x["pid"]["value"] for x in rows),
+                         set([os.getpid()]))
+
+    @unittest.skipUnless(os.environ.get("REKALL_BENCHMARK"),
+                         "Set REKALL_BENCHMARK to run benchmarks.")
+    def testBenchmark(self):
+        """Reports the speedup of rendering in parallel."""
+        cpus = multiprocessing.cpu_count()
+        ChecksumPlugin.ROUNDS = 1000
+        try:
+            start = time.time()
+            serial = self.Render(1)
+            serial_time = time.time() - start
+
+            workers = max(2, cpus)
+            start = time.time()
+            parallel = self.Render(workers)
+            parallel_time = time.time() - start
+        finally:
+            ChecksumPlugin.ROUNDS = 200
+
+        logging.info(
+            "Serial: %.2f sec, %d workers (%d cpus): %.2f sec (%.1fx)",
+            serial_time, workers, cpus, parallel_time,
+            serial_time / parallel_time)
+
+        self.assertEqual(self.SplitPids(serial)[0],
+                         self.SplitPids(parallel)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
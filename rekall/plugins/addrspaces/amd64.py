@@ -23,7 +23,6 @@
 """ This is based on Jesse Kornblum's patch to clean up the standard AS's.
 """
 import logging
-import struct
 
 from rekall import config
 from rekall.plugins.addrspaces import intel
@@ -98,14 +97,19 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
         '''
         return (pdpte & 0xfffffc0000000) | (vaddr & 0x3fffffff)
 
-    def vtop(self, vaddr):
+    def top_entry_layout(self, vaddr):
+        return (vaddr & 0xff8000000000) >> 36, "Q"
+
+    def page_walk(self, vaddr):
         '''
         Translates virtual addresses into physical offsets.
         The function returns either None (no valid mapping)
         or the offset in physical memory where the address maps.
         '''
         vaddr = long(vaddr)
-        pml4e = self.get_pml4e(vaddr)
+        return self.page_walk_from(vaddr, self.get_pml4e(vaddr))
+
+    def page_walk_from(self, vaddr, pml4e):
         if not self.entry_present(pml4e):
             # Add support for paged out PML4E
             return None
@@ -138,7 +142,9 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
         '''
         Return a list of lists of available memory pages.
         Each entry in the list is the starting virtual address
-        and the size of the memory page.
+        and the size of the memory page. Pages mapped by the same page
+        table which are also physically contiguous are returned as a single
+        run.
         '''
         # Pages that hold PDEs and PTEs are 0x1000 bytes each.
         # Each PDE and PTE is eight bytes. Thus there are 0x1000 / 8 = 0x200
@@ -148,9 +154,13 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
             pml4e_value = self.get_pml4e(vaddr)
             if not self.entry_present(pml4e_value):
                 continue
-            for pdpte in range(0, 0x200):
+            pdpt_table = self._read_page_table(
+                pml4e_value & 0xffffffffff000, "Q")
+            if pdpt_table is None:
+                continue
+
+            for pdpte, pdpte_value in enumerate(pdpt_table):
                 vaddr = (pml4e << 39) | (pdpte << 30)
-                pdpte_value = self.get_pdpte(vaddr, pml4e_value)
                 if not self.entry_present(pdpte_value):
                     continue
                 if self.page_size_flag(pdpte_value):
@@ -158,10 +168,15 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
                            self.get_one_gig_paddr(vaddr, pdpte_value),
                            0x40000000)
                     continue
+
+                pd_table = self._read_page_table(
+                    pdpte_value & 0xffffffffff000, "Q")
+                if pd_table is None:
+                    continue
+
                 tmp2 = vaddr
-                for pde in range(0, 0x200):
+                for pde, pde_value in enumerate(pd_table):
                     vaddr = tmp2 | (pde << 21)
-                    pde_value = self.get_pde(vaddr, pdpte_value)
                     if not self.entry_present(pde_value):
                         continue
                     if self.page_size_flag(pde_value):
@@ -170,22 +185,10 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
                                0x200000)
                         continue
 
-                    # This reads the entire PTE table at once - On
-                    # windows where IO is extremely expensive, its
-                    # about 10 times more efficient than reading it
-                    # one value at the time - and this loop is HOT!
-                    pte_table_addr = ((pde_value & 0xffffffffff000) |
-                                      ((vaddr & 0x1ff000) >> 9))
-
-                    data = self.base.read(pte_table_addr, 8 * 0x200)
-                    pte_table = struct.unpack("<" + "Q" * 0x200, data)
-
-                    for i, pte_value in enumerate(pte_table):
-                        if self.entry_present(pte_value):
-                            out_vaddr = vaddr | i << 12
-                            yield (out_vaddr,
-                                   self.get_phys_addr(out_vaddr, pte_value),
-                                   0x1000)
+                    for run in self._get_table_runs(
+                            pde_value & 0xffffffffff000, vaddr, "Q",
+                            0xffffffffff000):
+                        yield run
 
 
 class VTxPagedMemory(AMD64PagedMemory):
@@ -239,6 +242,13 @@ class VTxPagedMemory(AMD64PagedMemory):
         # translation.
         return entry and (entry & 0x7)
 
+    def entries_present(self, entries):
+        return entries & 0x7 != 0
+
+    def persistent_cache_key(self):
+        # Our page tables are found through the EPT, not the DTB.
+        return "address_ranges/%s@%#x" % (self._get_stack_name(), self.ept)
+
     def get_pml4e(self, vaddr):
         # PML4 for VT-x is in the EPT, not the DTB as AMD64PagedMemory does.
         ept_pml4e_paddr = ((self.ept & 0xffffffffff000) |
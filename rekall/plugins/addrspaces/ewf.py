@@ -26,6 +26,7 @@ import ctypes
 
 from ctypes import util
 from rekall import addrspace
+from rekall import utils
 from rekall.plugins.addrspaces import standard
 
 
@@ -43,6 +44,10 @@ if not resolved or not libewf._name:  # pylint: disable=protected-access
 
 class ewffile(object):
     """ A file like object to provide access to the ewf file """
+
+    # The default size of EWF chunks (64 sectors).
+    DEFAULT_CHUNK_SIZE = 32 * 1024
+
     def __init__(self, volumes):
         if isinstance(volumes, str):
             volumes = [volumes, ]
@@ -59,6 +64,20 @@ class ewffile(object):
         libewf.libewf_get_media_size(self.handle, size_p)
         self.size = size_p.contents.value
 
+        # The data in the file is compressed in chunks of this size.
+        self.chunk_size = self.DEFAULT_CHUNK_SIZE
+        try:
+            chunk_size_p = ctypes.pointer(ctypes.c_uint32(0))
+            if (libewf.libewf_get_chunk_size(self.handle, chunk_size_p) == 1
+                    and chunk_size_p.contents.value):
+                self.chunk_size = chunk_size_p.contents.value
+        except AttributeError:
+            # Older libewf versions do not export this.
+            pass
+
+        # Reads are usually of the same few sizes, so we reuse their buffers.
+        self._buffers = utils.FastStore(max_size=4)
+
     def seek(self, offset, whence=0):
         if whence == 0:
             self.readptr = offset
@@ -72,14 +91,31 @@ class ewffile(object):
     def tell(self):
         return self.readptr
 
+    def _get_buffer(self, length):
+        try:
+            return self._buffers.Get(length)
+        except KeyError:
+            buf = ctypes.create_string_buffer(length)
+            self._buffers.Put(length, buf)
+
+            return buf
+
     def read(self, length):
-        available_to_read = min(length, self.size - self.readptr)
-        buf = ctypes.create_string_buffer(available_to_read)
+        available_to_read = max(0, min(length, self.size - self.readptr))
+        buf = self._get_buffer(available_to_read)
 
         length = libewf.libewf_read_random(self.handle, buf,
                                            ctypes.c_ulong(available_to_read),
                                            ctypes.c_ulonglong(self.readptr))
 
+        # The buffer is reused, so clear whatever was not read this time.
+        length = max(0, length)
+        if length < available_to_read:
+            ctypes.memset(ctypes.addressof(buf) + length, 0,
+                          available_to_read - length)
+
+        self.readptr += available_to_read
+
         return buf.raw[:available_to_read]
 
     def close(self):
@@ -121,11 +157,18 @@ class EWFAddressSpace(addrspace.CachingAddressSpaceMixIn,
 
     Rekall Memory Forensics usually makes very small reads, and since there is
     no caching in the ewf library itself we also include the
-    CachingAddressSpaceMixIn to ensure we get reasonable performance here.
+    CachingAddressSpaceMixIn to ensure we get reasonable performance here. The
+    cached chunks are aligned with the EWF chunks, so each EWF chunk is only
+    decompressed once while it is cached (see the page_cache_mb parameter).
+    Sequential reads (e.g. scanning or copying the image) read ahead, so
+    libewf can decompress many chunks in a single call.
     """
     order = 20
     _md_image = True
 
+    # Read ahead 1MB with the default chunk size.
+    READ_AHEAD_CHUNKS = 32
+
     def __init__(self, base=None, filename=None, session=None, **kwargs):
         self.as_assert(base != None, "No base address space provided")
 
@@ -137,3 +180,5 @@ class EWFAddressSpace(addrspace.CachingAddressSpaceMixIn,
 
         super(EWFAddressSpace, self).__init__(
             fhandle=fhandle, session=session, base=base, **kwargs)
+
+        self.CHUNK_SIZE = fhandle.chunk_size
@@ -25,10 +25,14 @@
 # this code in Rekall Memory Forensics.
 
 """ A Hiber file Address Space """
+import array
+import bisect
+import struct
+
 from rekall import addrspace
 from rekall import obj
+from rekall import processpool
 from rekall.plugins.addrspaces import xpress
-import struct
 
 
 #pylint: disable-msg=C0111
@@ -208,6 +212,168 @@ class HibernationSupport(obj.ProfileModification):
                     profile.add_overlay(cls.win7_x64_vtypes)
 
 
+# An array type code which can hold any file offset.
+OFFSET_TYPECODE = "L" if array.array("L").itemsize >= 8 else "d"
+
+
+class HiberFileIndex(object):
+    """An index of where each page is stored in the hibernation file.
+
+    The hibernation file consists of tables of memory ranges, each followed by
+    the xpress compressed blocks holding the pages of those ranges. Each block
+    holds (up to) 16 pages. The pages of a table are stored in consecutive
+    slots of its blocks, so a range's pages can be located from the slot of its
+    first page:
+
+      block = slot / 16, position in block = slot % 16
+
+    Rather than storing the location of each page, the index stores the start
+    page, page count and first slot of each range, and the offset and size of
+    each block in arrays. This is small enough to keep in memory and store in
+    the persistent cache, even for very large hibernation files.
+    """
+
+    VERSION = 1
+
+    PAGES_PER_BLOCK = 0x10
+
+    def __init__(self):
+        # The ranges, sorted by start page.
+        self.range_starts = array.array("L")
+        self.range_counts = array.array("L")
+        self.range_slots = array.array("L")
+
+        self.block_offsets = array.array(OFFSET_TYPECODE)
+        self.block_sizes = array.array("L")
+
+        self.table_count = 0
+        self._last_range = 0
+
+    def add_block(self, offset, size):
+        self.block_offsets.append(offset)
+        self.block_sizes.append(size)
+
+    def add_range(self, start, count, slot):
+        self.range_starts.append(start)
+        self.range_counts.append(count)
+        self.range_slots.append(slot)
+
+    def sort(self):
+        """Sorts the ranges by their start page."""
+        order = sorted(range(len(self.range_starts)),
+                       key=self.range_starts.__getitem__)
+
+        for name in ("range_starts", "range_counts", "range_slots"):
+            old = getattr(self, name)
+            setattr(self, name, array.array(
+                old.typecode, [old[i] for i in order]))
+
+    @property
+    def page_count(self):
+        return sum(self.range_counts)
+
+    @property
+    def highest_page(self):
+        return max([start + count for start, count in zip(
+            self.range_starts, self.range_counts)] or [0])
+
+    def ranges(self):
+        """Yields (start page, page count, first slot) for each range."""
+        return zip(self.range_starts, self.range_counts, self.range_slots)
+
+    def blocks(self):
+        """Yields the blocks in the order they are stored in the file.
+
+        Yields:
+          Tuples of (block offset, block size, pages) where pages is a list of
+          (page, position in block) for the pages stored in the block.
+        """
+        current_block = None
+        pages = []
+        for start, count, slot in sorted(self.ranges(), key=lambda x: x[2]):
+            for i in xrange(count):
+                block, position = divmod(slot + i, self.PAGES_PER_BLOCK)
+                if block != current_block:
+                    if pages:
+                        yield (int(self.block_offsets[current_block]),
+                               self.block_sizes[current_block], pages)
+
+                    if block >= len(self.block_offsets):
+                        return
+
+                    current_block = block
+                    pages = []
+
+                pages.append((start + i, position))
+
+        if pages:
+            yield (int(self.block_offsets[current_block]),
+                   self.block_sizes[current_block], pages)
+
+    def lookup(self, page):
+        """Locates the page.
+
+        Returns:
+          A tuple of (block offset, block size, position in block) or None if
+          the page is not in the file.
+        """
+        i = self._last_range
+        starts = self.range_starts
+        if not (i < len(starts) and
+                starts[i] <= page < starts[i] + self.range_counts[i]):
+            i = bisect.bisect_right(starts, page) - 1
+            if i < 0 or page >= starts[i] + self.range_counts[i]:
+                return None
+
+            self._last_range = i
+
+        block, position = divmod(self.range_slots[i] + page - starts[i],
+                                 self.PAGES_PER_BLOCK)
+        if block >= len(self.block_offsets):
+            return None
+
+        return int(self.block_offsets[block]), self.block_sizes[block], position
+
+    def to_primitive(self):
+        """Returns a JSON serializable representation of the index."""
+        return dict(version=self.VERSION,
+                    table_count=self.table_count,
+                    ranges=[self.range_starts.tolist(),
+                            self.range_counts.tolist(),
+                            self.range_slots.tolist()],
+                    blocks=[[int(x) for x in self.block_offsets],
+                            self.block_sizes.tolist()])
+
+    @classmethod
+    def from_primitive(cls, data):
+        """Recreates the index from to_primitive()'s output, or None."""
+        if not data or data.get("version") != cls.VERSION:
+            return None
+
+        result = cls()
+        result.table_count = data["table_count"]
+        result.range_starts.extend(data["ranges"][0])
+        result.range_counts.extend(data["ranges"][1])
+        result.range_slots.extend(data["ranges"][2])
+        result.block_offsets.extend(data["blocks"][0])
+        result.block_sizes.extend(data["blocks"][1])
+
+        return result
+
+
+def _DecodeXpressBlock(data):
+    """Decompresses a block (this also runs in the conversion workers)."""
+    if len(data) == 0x10000:
+        return data
+
+    return xpress.xpress_decode(data)
+
+
+def _DecodeBlockInWorker(_, block):
+    _, data = block
+    return _DecodeXpressBlock(data)
+
+
 class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
     """ This is a hibernate address space for windows hibernation files.
 
@@ -227,13 +393,8 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         self.as_assert(self.base, "No base Address Space")
         self.as_assert(self.base.read(0, 4).lower() in ["hibr", "wake"])
         self.runs = []
-        self.PageDict = {}
-        self.HighestPage = 0
-        self.PageIndex = 0
-        self.AddressList = []
-        self.LookupCache = {}
-        self.PageCache = utils.FastStore(500)
-        self.MemRangeCnt = 0
+        self.PageCache = self.session.page_cache
+        self._cache_namespace = self.PageCache.NewNamespace()
         self.offset = 0
         self.entry_count = 0xFF
 
@@ -261,9 +422,9 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         ## need to search for it.
         self.dtb = self.ProcState.SpecialRegisters.Cr3.v()
 
-        # This is a lengthy process, it was cached, but it may be best to delay this
-        # until it's absolutely necessary and/or convert it into a generator...
-        self.build_page_cache()
+        # Building the index requires walking the entire file, so it is stored
+        # in the persistent cache.
+        self.index = self._load_index()
 
     def _get_first_table_page(self):
         if self.header:
@@ -273,123 +434,152 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
             if self.base.read(i * PAGE_SIZE, 8) == "\x81\x81xpress":
                 return i - 1
 
-    def build_page_cache(self):
-        XpressIndex = 0
-
-        XpressHeader = self.profile.Object("_IMAGE_XPRESS_HEADER",
-            offset=(self._get_first_table_page() + 1) * 4096,
-            vm=self.base)
-
-        XpressBlockSize = self.get_xpress_block_size(XpressHeader)
+    def _load_index(self):
+        key = "hiberfil_index/%s" % self._get_first_table_page()
+        index = HiberFileIndex.from_primitive(
+            self.session.persistent_cache.Get(key))
 
-        MemoryArrayOffset = self._get_first_table_page() * 4096
+        if index is None:
+            index = self.build_index()
+            self.session.persistent_cache.Put(key, index.to_primitive())
 
-        while MemoryArrayOffset:
-            MemoryArray = self.profile.Object(
-                '_PO_MEMORY_RANGE_ARRAY', MemoryArrayOffset, self.base)
+        return index
 
-            EntryCount = MemoryArray.MemArrayLink.EntryCount.v()
-            for i in MemoryArray.RangeTable:
-                start = i.StartPage.v()
-                end = i.EndPage.v()
-                LocalPageCnt = end - start
+    def build_index(self):
+        """Walks the hibernation file to build the index of its pages."""
+        index = HiberFileIndex()
 
-                if end > self.HighestPage:
-                    self.HighestPage = end
+        block_offset = (self._get_first_table_page() + 1) * 4096
+        block_size = self.get_xpress_block_size(
+            self.base.read(block_offset, 0x20))
+        index.add_block(block_offset, block_size)
 
-                self.AddressList.append((start * 0x1000,  # virtual address
-                                         start * 0x1000,  # physical address
-                                         LocalPageCnt * 0x1000))
+        table_offset = self._get_first_table_page() * 4096
+        while table_offset:
+            table = self.profile.Object(
+                '_PO_MEMORY_RANGE_ARRAY', table_offset, self.base)
 
-                for j in range(0, LocalPageCnt):
-                    if (XpressIndex and ((XpressIndex % 0x10) == 0)):
-                        XpressHeader, XpressBlockSize = \
-                                      self.next_xpress(XpressHeader, XpressBlockSize)
+            # The pages of this table start in the current block.
+            slot = (len(index.block_offsets) - 1) * index.PAGES_PER_BLOCK
+            page_count = 0
+            for memory_range in table.RangeTable:
+                start = memory_range.StartPage.v()
+                count = memory_range.EndPage.v() - start
+                index.add_range(start, count, slot + page_count)
+                page_count += count
 
-                    PageNumber = start + j
-                    XpressPage = XpressIndex % 0x10
-                    if XpressHeader.obj_offset not in self.PageDict:
-                        self.PageDict[XpressHeader.obj_offset] = [
-                            (PageNumber, XpressBlockSize, XpressPage)]
-                    else:
-                        self.PageDict[XpressHeader.obj_offset].append(
-                            (PageNumber, XpressBlockSize, XpressPage))
+            # Find the rest of the blocks holding the pages of this table.
+            blocks = -(-page_count // index.PAGES_PER_BLOCK)
+            for _ in range(1, blocks):
+                block_offset, block_size = self.next_xpress(
+                    block_offset, block_size)
+                if block_offset is None:
+                    break
 
-                    ## Update the lookup cache
-                    self.LookupCache[PageNumber] = (
-                        XpressHeader.obj_offset, XpressBlockSize, XpressPage)
+                index.add_block(block_offset, block_size)
 
-                    self.PageIndex += 1
-                    XpressIndex += 1
-
-            NextTable = MemoryArray.MemArrayLink.NextTable.v()
+            next_table = table.MemArrayLink.NextTable.v()
 
             # This entry count (EntryCount) should probably be calculated
-            if (NextTable and (EntryCount == self.entry_count)):
-                MemoryArrayOffset = NextTable * 0x1000
-                self.MemRangeCnt += 1
+            if (block_offset is not None and next_table and
+                    table.MemArrayLink.EntryCount.v() == self.entry_count):
+                table_offset = next_table * 0x1000
+                index.table_count += 1
 
-                XpressHeader, XpressBlockSize = self.next_xpress(
-                    XpressHeader, XpressBlockSize)
+                block_offset, block_size = self.next_xpress(
+                    block_offset, block_size)
 
                 # Make sure the xpress block is after the Memory Table
-                while (XpressHeader.obj_offset < MemoryArrayOffset):
-                    XpressHeader, XpressBlockSize = self.next_xpress(
-                        XpressHeader, 0)
+                while (block_offset is not None and
+                       block_offset < table_offset):
+                    block_offset, block_size = self.next_xpress(
+                        block_offset, 0)
+
+                if block_offset is None:
+                    break
+
+                index.add_block(block_offset, block_size)
 
-                XpressIndex = 0
             else:
-                MemoryArrayOffset = 0
+                table_offset = 0
+
+        index.sort()
+
+        return index
+
+    # The number of decoded blocks each conversion worker may have waiting to
+    # be written.
+    CONVERSION_BLOCKS_PER_WORKER = 8
+
+    def convert_to_raw(self, ofile, workers=1):
+        """Writes the decompressed pages into the raw image file ofile.
+
+        Args:
+          ofile: A file opened for writing.
+          workers: The number of processes which decompress blocks in parallel.
+
+        Yields:
+          The number of pages written so far, after each block.
+        """
+        if workers > 1:
+            blocks = self._decode_blocks_in_parallel(workers)
+        else:
+            blocks = ((pages, _DecodeXpressBlock(
+                self.base.read(offset + 0x20, size)))
+                      for offset, size, pages in self.index.blocks())
 
-    def convert_to_raw(self, ofile):
         page_count = 0
-        for _i, xb in enumerate(self.PageDict.keys()):
-            size = self.PageDict[xb][0][1]
-            data_z = self.base.read(xb + 0x20, size)
-            if size == 0x10000:
-                data_uz = data_z
-            else:
-                data_uz = xpress.xpress_decode(data_z)
-            for page, size, offset in self.PageDict[xb]:
+        for pages, data_uz in blocks:
+            for page, position in pages:
                 ofile.seek(page * 0x1000)
-                ofile.write(data_uz[offset * 0x1000:offset * 0x1000 + 0x1000])
-                page_count += 1
-            del data_z, data_uz
+                ofile.write(data_uz[position * 0x1000:(position + 1) * 0x1000])
+
+            page_count += len(pages)
             yield page_count
 
-    def next_xpress(self, XpressHeader, XpressBlockSize):
-        XpressHeaderOffset = int(XpressBlockSize) + XpressHeader.obj_offset + \
-            XpressHeader.size()
-
-        ## We only search this far
-        BLOCKSIZE = 1024
-        original_offset = XpressHeaderOffset
-        while 1:
-            data = self.base.read(XpressHeaderOffset, BLOCKSIZE)
-            Magic_offset = data.find("\x81\x81xpress")
-            if Magic_offset >= 0:
-                XpressHeaderOffset += Magic_offset
-                break
+    def _decode_blocks_in_parallel(self, workers):
+        """Decodes the blocks in a pool of worker processes.
 
-            else:
-                XpressHeaderOffset += len(data)
+        The blocks are read here and decoded by the workers. The decoded blocks
+        are yielded in file order, and at most CONVERSION_BLOCKS_PER_WORKER
+        blocks per worker are in flight, so memory use is bounded however
+        large the file is.
+
+        Yields:
+          Tuples of (pages, decoded data) for each block.
+        """
+        blocks = ((pages, self.base.read(offset + 0x20, size))
+                  for offset, size, pages in self.index.blocks())
 
-            ## Only search this far in advance
-            if XpressHeaderOffset - original_offset > 10240:
-                return None, None
+        for (pages, _), data_uz in processpool.RunInWorkers(
+                _DecodeBlockInWorker, blocks, workers,
+                items_per_worker=self.CONVERSION_BLOCKS_PER_WORKER):
+            yield pages, data_uz
+
+    # We only search this far for the next xpress block.
+    XPRESS_SEARCH_LENGTH = 10240 + 1024
+
+    def next_xpress(self, block_offset, block_size):
+        """Finds the xpress block after the block at block_offset.
+
+        Returns:
+          A tuple of (offset, size) of the next xpress block, or (None, None).
+        """
+        offset = block_offset + block_size + 0x20
 
-        XpressHeader = self.profile.Object(
-            "_IMAGE_XPRESS_HEADER", XpressHeaderOffset, self.base)
-        XpressBlockSize = self.get_xpress_block_size(XpressHeader)
+        data = self.base.read(offset, self.XPRESS_SEARCH_LENGTH + 0x20)
+        magic_offset = data.find("\x81\x81xpress", 0, self.XPRESS_SEARCH_LENGTH)
+        if magic_offset < 0:
+            return None, None
 
-        return XpressHeader, XpressBlockSize
+        return (offset + magic_offset, self.get_xpress_block_size(
+            data[magic_offset:magic_offset + 0x20]))
 
     def get_xpress_block_size(self, xpress_header):
-        u0B = xpress_header.u0B.v() << 24
-        u0A = xpress_header.u0A.v() << 16
-        u09 = xpress_header.u09.v() << 8
+        """Calculates the size of the block from the raw xpress header."""
+        u09, u0A, u0B = struct.unpack("<BBB", xpress_header[9:12])
 
-        Size = u0B + u0A + u09
+        Size = (u0B << 24) + (u0A << 16) + (u09 << 8)
         Size = Size >> 10
         Size = Size + 1
 
@@ -419,39 +609,33 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         return (self.ProcState.SpecialRegisters.Cr4.v() >> 5) & 1
 
     def get_number_of_memranges(self):
-        return self.MemRangeCnt
+        return self.index.table_count
 
     def get_number_of_pages(self):
-        return self.PageIndex
+        return self.index.page_count
 
     def get_addr(self, addr):
-        page = addr >> page_shift
-        if page in self.LookupCache:
-            (hoffset, size, pageoffset) = self.LookupCache[page]
-            return hoffset, size, pageoffset
-        return None, None, None
+        return self.index.lookup(addr >> page_shift) or (None, None, None)
 
     def get_block_offset(self, _xb, addr):
-        page = addr >> page_shift
-        if page in self.LookupCache:
-            (_hoffset, _size, pageoffset) = self.LookupCache[page]
-            return pageoffset
-        return None
+        return self.get_addr(addr)[2]
 
     def is_valid_address(self, addr):
         XpressHeaderOffset, _XpressBlockSize, _XpressPage = self.get_addr(addr)
         return XpressHeaderOffset != None
 
     def read_xpress(self, baddr, BlockSize):
-        data_uz = self.PageCache.Get(baddr)
-        if data_uz is None:
+        key = (self._cache_namespace, baddr)
+        try:
+            return self.PageCache.Get(key)
+        except KeyError:
             data_read = self.base.read(baddr, BlockSize)
             if BlockSize == 0x10000:
                 data_uz = data_read
             else:
                 data_uz = xpress.xpress_decode(data_read)
 
-                self.PageCache.Put(baddr, data_uz)
+                self.PageCache.Put(key, data_uz)
 
         return data_uz
 
@@ -511,15 +695,12 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         return longval
 
     def get_available_pages(self):
-        page_list = []
-        for _i, xb in enumerate(self.PageDict.keys()):
-            for page, _size, _offset in self.PageDict[xb]:
-                page_list.append([page * 0x1000, page * 0x1000, 0x1000])
-        return page_list
+        for start, count, _ in self.index.ranges():
+            yield [start * 0x1000, start * 0x1000, count * 0x1000]
 
     def get_address_range(self):
         """ This relates to the logical address range that is indexable """
-        size = self.HighestPage * 0x1000 + 0x1000
+        size = self.index.highest_page * 0x1000 + 0x1000
         return [0, size]
 
     def check_address_range(self, addr):
@@ -529,8 +710,9 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
     def get_available_addresses(self):
         """ This returns the ranges  of valid addresses """
-        for i in self.AddressList:
-            yield i
+        for start, count, _ in self.index.ranges():
+            if count:
+                yield (start * 0x1000, start * 0x1000, count * 0x1000)
 
     def close(self):
         self.base.close()
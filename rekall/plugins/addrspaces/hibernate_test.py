@@ -0,0 +1,228 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the hibernation file address space."""
+import json
+import random
+import StringIO
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall.plugins.addrspaces import hibernate
+from rekall.plugins.addrspaces import xpress
+
+
+PAGES = range(0x100, 0x100 + 20) + range(0x300, 0x300 + 5)
+
+
+def PageData(page):
+    return ("%04x" % page) * 0x400
+
+
+def XpressEncode(data):
+    """Compresses data in the xpress format.
+
+    This only looks for repeats of the last 16 bytes, which is enough to
+    exercise all the ways a match length can be encoded.
+    """
+    output = bytearray(4)
+    indicator_offset = indicator = 0
+    indicator_bit = 32
+    nibble_offset = None
+    position = 0
+
+    while position < len(data):
+        # Each 32 literals or matches are preceded by an indicator.
+        if indicator_bit == 0:
+            struct.pack_into("<I", output, indicator_offset, indicator)
+            indicator_offset = len(output)
+            output.extend("\x00" * 4)
+            indicator = 0
+            indicator_bit = 32
+
+        indicator_bit -= 1
+
+        length = period = 0
+        for candidate in range(1, min(position, 16) + 1):
+            end = position
+            while (end < len(data) and end - position < 0xffff + 3 and
+                   data[end] == data[end - candidate]):
+                end += 1
+
+            if end - position > length:
+                length, period = end - position, candidate
+
+        if length < 3:
+            output.append(ord(data[position]))
+            position += 1
+            continue
+
+        indicator |= 1 << indicator_bit
+        position += length
+
+        length -= 3
+        output.extend(struct.pack("<H", (period - 1) << 3 | min(length, 7)))
+        if length < 7:
+            continue
+
+        # Every other nibble is stored in the high half of the previous one.
+        length -= 7
+        if nibble_offset is None:
+            nibble_offset = len(output)
+            output.append(min(length, 15))
+        else:
+            output[nibble_offset] |= min(length, 15) << 4
+            nibble_offset = None
+
+        if length < 15:
+            continue
+
+        length -= 15
+        if length < 255:
+            output.append(length)
+        else:
+            output.append(255)
+            output.extend(struct.pack("<H", length + 15 + 7))
+
+    struct.pack_into("<I", output, indicator_offset, indicator)
+
+    return str(output)
+
+
+def BuildHiberFile(compress=False):
+    """Builds the memory range table and xpress blocks of a hiberfil.
+
+    The table at 0x1000 has two ranges: 20 pages from page 0x100 and 5 pages
+    from page 0x300. Their 25 pages are stored in two xpress blocks, at 0x2000
+    and 0x12020. The first block is uncompressed (0x10000 bytes), and so is the
+    second unless compress is set.
+    """
+    table = struct.pack("<IIII", 0, 0, 0, 2)
+    table += struct.pack("<IIII", 0, 0x100, 0x100 + 20, 0)
+    table += struct.pack("<IIII", 0, 0x300, 0x300 + 5, 0)
+
+    blocks = ""
+    for i in range(0, len(PAGES), 16):
+        data = "".join(
+            PageData(page) for page in PAGES[i:i + 16]).ljust(0x10000, "\x00")
+        if compress and i + 16 >= len(PAGES):
+            data = XpressEncode(data)
+
+        # The block size is encoded in bytes 9 to 11 of the header, and the
+        # block is padded to 8 bytes.
+        header = "\x81\x81xpress\x00" + struct.pack(
+            "<I", (len(data) - 1) << 2)[:3]
+        blocks += header.ljust(0x20, "\x00") + data.ljust(
+            (len(data) + 7) & ~7, "\x00")
+
+    return "\x00" * 0x1000 + table.ljust(0x1000, "\x00") + blocks
+
+
+class XpressTest(unittest.TestCase):
+    """Test decompressing xpress data."""
+
+    def CheckDecode(self, data):
+        self.assertEqual(
+            xpress.xpress_decode(XpressEncode(data), output_size=0x100), data)
+
+    def testDecode(self):
+        # Matches of all lengths, which are encoded in 3 bits, a nibble (either
+        # half of a shared byte), a byte and a short.
+        for length in range(1, 300) + [0x1000, 0x10002, 0x20000]:
+            self.CheckDecode("abcd" + "x" * length + "abcd" + "ab" * length)
+
+        # Mostly literals.
+        rand = random.Random(1)
+        self.CheckDecode("".join(
+            chr(rand.randint(0, 3) * 0x40) for _ in range(0x1000)))
+
+
+class HiberFileIndexTest(unittest.TestCase):
+    """Test the index of the pages in the hibernation file."""
+
+    def setUp(self):
+        self.session = session.Session()
+        profile = obj.Profile.classes["Profile32Bits"](session=self.session)
+
+        # Only build the index, without parsing the rest of the file.
+        self.address_space = hibernate.WindowsHiberFileSpace.__new__(
+            hibernate.WindowsHiberFileSpace)
+        self.address_space.session = self.session
+        self.address_space.header = None
+        self.address_space.entry_count = 0xff
+        self.address_space.profile = hibernate.HibernationSupport(profile)
+        self.address_space.base = addrspace.BufferAddressSpace(
+            data=BuildHiberFile(), session=self.session)
+
+    def CheckIndex(self, index):
+        self.assertEqual(index.page_count, 25)
+        self.assertEqual(index.highest_page, 0x305)
+        self.assertEqual(index.lookup(0x100), (0x2000, 0x10000, 0))
+        self.assertEqual(index.lookup(0x100 + 17), (0x12020, 0x10000, 1))
+        self.assertEqual(index.lookup(0x300 + 2), (0x12020, 0x10000, 6))
+        self.assertEqual(index.lookup(0x200), None)
+        self.assertEqual(index.lookup(0x305), None)
+
+    def testBuildIndex(self):
+        index = self.address_space.build_index()
+        self.CheckIndex(index)
+
+        # The index must survive a trip through the persistent cache.
+        data = json.loads(json.dumps(index.to_primitive()))
+        self.CheckIndex(hibernate.HiberFileIndex.from_primitive(data))
+
+    def testConvertToRaw(self):
+        self.address_space.index = self.address_space.build_index()
+
+        for workers in (1, 2):
+            raw = StringIO.StringIO()
+            self.assertEqual(
+                list(self.address_space.convert_to_raw(raw, workers=workers)),
+                [16, 25])
+
+            for page in PAGES:
+                raw.seek(page * 0x1000)
+                self.assertEqual(raw.read(0x1000), PageData(page))
+
+    def testConvertCompressedToRaw(self):
+        self.address_space.base = addrspace.BufferAddressSpace(
+            data=BuildHiberFile(compress=True), session=self.session)
+        self.address_space.index = self.address_space.build_index()
+
+        # The second block is compressed.
+        offset, size, _ = self.address_space.index.lookup(0x300)
+        self.assertEqual(offset, 0x12020)
+        self.assertLess(size, 0x1000)
+
+        for workers in (1, 2):
+            raw = StringIO.StringIO()
+            self.assertEqual(
+                list(self.address_space.convert_to_raw(raw, workers=workers)),
+                [16, 25])
+
+            for page in PAGES:
+                raw.seek(page * 0x1000)
+                self.assertEqual(raw.read(0x1000), PageData(page))
+
+
+if __name__ == "__main__":
+    unittest.main()
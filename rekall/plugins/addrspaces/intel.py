@@ -26,7 +26,20 @@
 import struct
 
 from rekall import addrspace
+from rekall import config
 from rekall import obj
+from rekall import utils
+
+# NumPy is optional - when available page tables are enumerated in bulk.
+numpy = utils.ConditionalImport("numpy")
+
+
+config.DeclareOption(
+    "--tlb_size", group="Performance",
+    action=config.IntParser,
+    help="The number of page translations each paged address space "
+    "remembers. Set to 0 to disable translation caching (e.g. when analysing "
+    "live memory).")
 
 
 class IA32PagedMemory(addrspace.PagedReader):
@@ -55,6 +68,12 @@ class IA32PagedMemory(addrspace.PagedReader):
 
     _md_arch = "I386"
 
+    # The default number of virtual pages whose translation we remember.
+    TLB_SIZE = 4096
+
+    # The number of page table pages (PD, PT etc) we keep decoded in memory.
+    PAGE_TABLE_CACHE_SIZE = 512
+
     def __init__(self, name=None, dtb=None, **kwargs):
         """Instantiate an Intel 32 bit Address space over the layered AS.
 
@@ -75,6 +94,169 @@ class IA32PagedMemory(addrspace.PagedReader):
                        " plugin to search for the dtb.")
         self.name = (name or 'Kernel AS') + "@%#x" % self.dtb
 
+        # This is a software TLB: It maps virtual page addresses to physical
+        # page addresses (or None for invalid pages). Page table pages are
+        # also cached in their decoded form so that a TLB miss usually does
+        # not need to touch the base address space at all.
+        self.tlb_size = self.session.GetParameter("tlb_size", self.TLB_SIZE)
+
+        # The page tables of live memory change under us, so translations can
+        # not be cached.
+        if self.base.data_may_change():
+            self.tlb_size = 0
+
+        self.tlb_hits = 0
+        self.tlb_misses = 0
+        self._tlb = utils.FastStore(max_size=self.tlb_size)
+        self._page_tables = utils.FastStore(
+            max_size=self.tlb_size and self.PAGE_TABLE_CACHE_SIZE)
+
+    def _get_stack_name(self):
+        """Names the stack of address spaces we are part of."""
+        stack = []
+        address_space = self
+        while True:
+            stack.append(address_space.__class__.__name__)
+            if address_space.base is address_space:
+                break
+
+            address_space = address_space.base
+
+        return "_".join(reversed(stack))
+
+    def persistent_cache_key(self):
+        # The address ranges depend on the entire stack of address spaces.
+        return "address_ranges/%s@%#x" % (self._get_stack_name(), self.dtb)
+
+    def flush_tlb(self):
+        """Invalidate all cached translations and page table pages.
+
+        Call this when the underlying memory may have changed (e.g. when
+        analysing live memory).
+        """
+        self._tlb.Flush()
+        self._page_tables.Flush()
+
+    def _get_page_table(self, table_addr, entry_format):
+        """Returns the decoded page table page at table_addr or None.
+
+        Args:
+          table_addr: The physical address of the page table page.
+          entry_format: The struct format of each entry ("I" or "Q").
+        """
+        key = (table_addr, entry_format)
+        try:
+            return self._page_tables.Get(key)
+        except KeyError:
+            pass
+
+        table = self._read_page_table(table_addr, entry_format)
+        if table is not None:
+            self._page_tables.Put(key, table)
+
+        return table
+
+    def _read_page_table_data(self, table_addr):
+        """Reads the raw page table page at table_addr or returns None."""
+        try:
+            data = self.base.read(table_addr, 0x1000)
+        except IOError:
+            return None
+
+        if len(data) != 0x1000:
+            return None
+
+        return data
+
+    def _read_page_table(self, table_addr, entry_format):
+        """Reads and decodes the page table page at table_addr (uncached)."""
+        data = self._read_page_table_data(table_addr)
+        if data is None:
+            return None
+
+        return struct.unpack(
+            "<" + entry_format * (0x1000 / struct.calcsize(entry_format)),
+            data)
+
+    def _get_table_runs(self, table_addr, vaddr, entry_format, frame_mask):
+        """Enumerates a page table which maps 4kb pages.
+
+        This reads the entire page table at once - On windows where IO is
+        extremely expensive, its about 10 times more efficient than reading it
+        one value at the time - and this loop is HOT!
+
+        Args:
+          table_addr: The physical address of the page table.
+          vaddr: The virtual address mapped by the first entry in the table.
+          entry_format: The struct format of each entry ("I" or "Q").
+          frame_mask: The mask selecting the page frame from an entry.
+
+        Yields:
+          (virtual address, physical address, length) tuples. Pages which are
+          contiguous in both the virtual and physical address spaces are
+          merged into a single run.
+        """
+        data = self._read_page_table_data(table_addr)
+        if data is None:
+            return
+
+        if numpy is not None:
+            runs = self._get_table_runs_numpy(
+                data, vaddr, entry_format, frame_mask)
+        else:
+            runs = self._get_table_runs_python(
+                data, vaddr, entry_format, frame_mask)
+
+        for run in runs:
+            yield run
+
+    def _get_table_runs_python(self, data, vaddr, entry_format, frame_mask):
+        table = struct.unpack(
+            "<" + entry_format * (0x1000 / struct.calcsize(entry_format)),
+            data)
+
+        run_vaddr = run_paddr = run_length = 0
+        for i, entry in enumerate(table):
+            if not self.entry_present(entry):
+                continue
+
+            page_vaddr = vaddr | i << 12
+            page_paddr = entry & frame_mask
+            if (run_length and page_vaddr == run_vaddr + run_length and
+                    page_paddr == run_paddr + run_length):
+                run_length += 0x1000
+                continue
+
+            if run_length:
+                yield run_vaddr, run_paddr, run_length
+
+            run_vaddr, run_paddr, run_length = page_vaddr, page_paddr, 0x1000
+
+        if run_length:
+            yield run_vaddr, run_paddr, run_length
+
+    def _get_table_runs_numpy(self, data, vaddr, entry_format, frame_mask):
+        entries = numpy.frombuffer(
+            data, dtype=dict(I="<u4", Q="<u8")[entry_format])
+
+        indexes = numpy.flatnonzero(self.entries_present(entries))
+        if not len(indexes):
+            return
+
+        frames = entries[indexes] & frame_mask
+
+        # A new run starts wherever either the virtual or physical pages are
+        # not contiguous with the previous page.
+        breaks = numpy.flatnonzero(
+            (numpy.diff(indexes) != 1) | (numpy.diff(frames) != 0x1000)) + 1
+
+        starts = [0] + breaks.tolist()
+        ends = breaks.tolist() + [len(indexes)]
+        for start, end in zip(starts, ends):
+            yield (vaddr | int(indexes[start]) << 12,
+                   int(frames[start]),
+                   (end - start) * 0x1000)
+
     def entry_present(self, entry):
         '''
         Returns whether or not the 'P' (Present) flag is on
@@ -91,6 +273,11 @@ class IA32PagedMemory(addrspace.PagedReader):
 
         return False
 
+    def entries_present(self, entries):
+        """A vectorised version of entry_present() over a numpy array."""
+        return ((entries & 1 != 0) |
+                ((entries & (1 << 11) != 0) & (entries & (1 << 10) == 0)))
+
     def page_size_flag(self, entry):
         '''
         Returns whether or not the 'PS' (Page Size) flag is on
@@ -150,12 +337,58 @@ class IA32PagedMemory(addrspace.PagedReader):
 
 
     def vtop(self, vaddr):
+        """Translates virtual addresses into physical offsets.
+
+        The translation for each virtual page is remembered in the TLB, so
+        repeated accesses to the same page do not need to walk the page tables.
+
+        Returns:
+          None if there is no valid mapping, or the offset in physical memory
+          where the address maps.
+        """
+        vaddr = int(vaddr)
+        page_offset = vaddr & 0xfff
+        page = vaddr ^ page_offset
+
+        try:
+            paddr = self._tlb.Get(page)
+            self.tlb_hits += 1
+        except KeyError:
+            self.tlb_misses += 1
+            paddr = self.page_walk(page)
+            if paddr is not None:
+                paddr = int(paddr)
+
+            self._tlb.Put(page, paddr)
+
+        if paddr is None:
+            return None
+
+        return paddr | page_offset
+
+    def top_entry_layout(self, vaddr):
+        """Describes the top level paging entry which maps vaddr.
+
+        Returns:
+          A tuple of (offset of the entry in the page at the DTB, struct format
+          of the entry).
+        """
+        return (vaddr & 0xffc00000) >> 20, "I"
+
+    def page_walk(self, vaddr):
         '''
-        Translates virtual addresses into physical offsets.
-        The function should return either None (no valid mapping)
+        Translates virtual addresses into physical offsets by walking the page
+        tables. The function should return either None (no valid mapping)
         or the offset in physical memory where the address maps.
         '''
-        pde_value = self.get_pde(vaddr)
+        return self.page_walk_from(vaddr, self.get_pde(vaddr))
+
+    def page_walk_from(self, vaddr, pde_value):
+        """Completes the page walk of vaddr from its top level entry.
+
+        The rest of the walk does not depend on the DTB, so this can check the
+        entries found in many candidate DTBs (see top_entry_layout()).
+        """
         if not self.entry_present(pde_value):
             # Add support for paged out PDE
             # (insert buffalo here!)
@@ -176,6 +409,11 @@ class IA32PagedMemory(addrspace.PagedReader):
         Returns an unsigned 32-bit integer from the address addr in
         physical memory. If unable to read from that location, returns None.
         '''
+        if self.tlb_size and not addr & 3:
+            table = self._get_page_table(addr & ~0xfff, "I")
+            if table is not None:
+                return table[(addr & 0xfff) >> 2]
+
         try:
             string = self.base.read(addr, 4)
         except IOError:
@@ -196,9 +434,12 @@ class IA32PagedMemory(addrspace.PagedReader):
         # Pages that hold PDEs and PTEs are 0x1000 bytes each.
         # Each PDE and PTE is four bytes. Thus there are 0x1000 / 4 = 0x400
         # PDEs and PTEs we must test
-        for pde in range(0, 0x400):
+        pd_table = self._read_page_table(self.dtb & 0xfffff000, "I")
+        if pd_table is None:
+            return
+
+        for pde, pde_value in enumerate(pd_table):
             vaddr = pde << 22
-            pde_value = self.get_pde(vaddr)
             if not self.entry_present(pde_value):
                 continue
 
@@ -208,21 +449,9 @@ class IA32PagedMemory(addrspace.PagedReader):
                        0x400000)
                 continue
 
-            # This reads the entire PTE table at once - On
-            # windows where IO is extremely expensive, its
-            # about 10 times more efficient than reading it
-            # one value at the time - and this loop is HOT!
-            pte_table_addr = ((pde_value & 0xfffff000) |
-                              ((vaddr & 0x3ff000) >> 10))
-
-            data = self.base.read(pte_table_addr, 4 * 0x400)
-            pte_table = struct.unpack("<" + "I" * 0x400, data)
-
-            for i, pte_value in enumerate(pte_table):
-                if self.entry_present(pte_value):
-                    yield (vaddr | i << 12,
-                           self.get_phys_addr(vaddr | i << 12, pte_value),
-                           0x1000)
+            for run in self._get_table_runs(
+                    pde_value & 0xfffff000, vaddr, "I", 0xfffff000):
+                yield run
 
     def __str__(self):
         return "%s@0x%08X (%s)" % (self.__class__.__name__, self.dtb, self.name)
@@ -314,13 +543,18 @@ class IA32PagedMemoryPae(IA32PagedMemory):
         return (pte & 0xffffffffff000) | (vaddr & 0xfff)
 
 
-    def vtop(self, vaddr):
+    def top_entry_layout(self, vaddr):
+        return (vaddr & 0xc0000000) >> 27, "Q"
+
+    def page_walk(self, vaddr):
         '''
         Translates virtual addresses into physical offsets.
         The function returns either None (no valid mapping)
         or the offset in physical memory where the address maps.
         '''
-        pdpte = self.get_pdpte(vaddr)
+        return self.page_walk_from(vaddr, self.get_pdpte(vaddr))
+
+    def page_walk_from(self, vaddr, pdpte):
         if not self.entry_present(pdpte):
             # Add support for paged out PDPTE
             # Insert buffalo here!
@@ -346,6 +580,11 @@ class IA32PagedMemoryPae(IA32PagedMemory):
         Returns an unsigned 64-bit integer from the address addr in
         physical memory. If unable to read from that location, returns None.
         '''
+        if self.tlb_size and not addr & 7:
+            table = self._get_page_table(addr & ~0xfff, "Q")
+            if table is not None:
+                return table[(addr & 0xfff) >> 3]
+
         try:
             string = self.base.read(addr, 8)
         except IOError:
@@ -367,9 +606,13 @@ class IA32PagedMemoryPae(IA32PagedMemory):
             if not self.entry_present(pdpte_value):
                 continue
 
-            for pde in range(0, 0x200):
+            pd_table = self._read_page_table(
+                pdpte_value & 0xffffffffff000, "Q")
+            if pd_table is None:
+                continue
+
+            for pde, pde_value in enumerate(pd_table):
                 vaddr = pdpte << 30 | (pde << 21)
-                pde_value = self.get_pde(vaddr, pdpte_value)
                 if not self.entry_present(pde_value):
                     continue
                 if self.page_size_flag(pde_value):
@@ -378,18 +621,7 @@ class IA32PagedMemoryPae(IA32PagedMemory):
                            0x200000)
                     continue
 
-                # This reads the entire PTE table at once - On
-                # windows where IO is extremely expensive, its
-                # about 10 times more efficient than reading it
-                # one value at the time - and this loop is HOT!
-                pte_table_addr = ((pde_value & 0xffffffffff000) |
-                                  ((vaddr & 0x1ff000) >> 9))
-
-                data = self.base.read(pte_table_addr, 8 * 0x200)
-                pte_table = struct.unpack("<" + "Q" * 0x200, data)
-
-                for i, pte_value in enumerate(pte_table):
-                    if self.entry_present(pte_value):
-                        yield (vaddr | i << 12,
-                               self.get_phys_addr(vaddr | i << 12, pte_value),
-                               0x1000)
+                for run in self._get_table_runs(
+                        pde_value & 0xffffffffff000, vaddr, "Q",
+                        0xffffffffff000):
+                    yield run
@@ -0,0 +1,152 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the intel paged address spaces."""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall.plugins.addrspaces import intel
+
+
+def BuildPhysicalMemory():
+    """Builds a tiny physical memory image with a non PAE page table.
+
+    The page directory is at 0x1000, a single page table at 0x2000 maps
+    virtual pages 0x1000 and 0x2000 to physical pages 0x3000 and 0x4000, and
+    virtual page 0x4000 to physical page 0x3000.
+    """
+    data = ["\x00" * 0x1000] * 5
+
+    # PDE 0 points to the page table at 0x2000.
+    data[1] = struct.pack("<I", 0x2000 | 1) + "\x00" * 0xffc
+
+    # PTEs 1, 2 and 4.
+    data[2] = struct.pack(
+        "<5I", 0, 0x3000 | 1, 0x4000 | 1, 0, 0x3000 | 1).ljust(0x1000, "\x00")
+    data[3] = "hello world".ljust(0x1000, "\x00")
+
+    return "".join(data)
+
+
+class IA32PagedMemoryTest(unittest.TestCase):
+    """Test the IA32 address space translation."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.physical_as = addrspace.BufferAddressSpace(
+            data=BuildPhysicalMemory(), session=self.session)
+
+    def testVtop(self):
+        address_space = intel.IA32PagedMemory(
+            base=self.physical_as, dtb=0x1000, session=self.session)
+
+        self.assertEqual(address_space.vtop(0x1004), 0x3004)
+        self.assertEqual(address_space.vtop(0x5000), None)
+        self.assertEqual(address_space.read(0x1000, 5), "hello")
+
+    def testTLB(self):
+        address_space = intel.IA32PagedMemory(
+            base=self.physical_as, dtb=0x1000, session=self.session)
+
+        address_space.vtop(0x1000)
+        address_space.vtop(0x1ff0)
+        address_space.vtop(0x5000)
+        address_space.vtop(0x5004)
+
+        self.assertEqual(address_space.tlb_misses, 2)
+        self.assertEqual(address_space.tlb_hits, 2)
+
+        # Change the page table under the address space.
+        self.physical_as.write(0x2004, struct.pack("<I", 0x2000 | 1))
+
+        # The stale translation remains until the TLB is flushed.
+        self.assertEqual(address_space.vtop(0x1004), 0x3004)
+        address_space.flush_tlb()
+        self.assertEqual(address_space.vtop(0x1004), 0x2004)
+
+    def testGetAvailableAddresses(self):
+        address_space = intel.IA32PagedMemory(
+            base=self.physical_as, dtb=0x1000, session=self.session)
+
+        expected = [(0x1000, 0x3000, 0x2000), (0x4000, 0x3000, 0x1000)]
+        self.assertEqual(list(address_space.get_available_addresses()),
+                         expected)
+
+        # The pure python implementation must produce the same runs.
+        numpy = intel.numpy
+        try:
+            intel.numpy = None
+            self.assertEqual(list(address_space.get_available_addresses()),
+                             expected)
+        finally:
+            intel.numpy = numpy
+
+    def testPersistentAddressRanges(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            image = os.path.join(temp_dir, "image.raw")
+            with open(image, "wb") as fd:
+                fd.write(self.physical_as.data)
+
+            self.session.SetParameter("filename", image)
+            self.session.SetParameter("cache_dir", temp_dir)
+
+            address_space = intel.IA32PagedMemory(
+                base=self.physical_as, dtb=0x1000, session=self.session)
+            expected = list(address_space.get_address_ranges())
+
+            # A new address space must not need to enumerate the page tables.
+            address_space = intel.IA32PagedMemory(
+                base=self.physical_as, dtb=0x1000, session=self.session)
+            address_space.get_available_addresses = None
+
+            self.assertEqual(list(address_space.get_address_ranges()),
+                             expected)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testDisabledTLB(self):
+        self.session.SetParameter("tlb_size", 0)
+        address_space = intel.IA32PagedMemory(
+            base=self.physical_as, dtb=0x1000, session=self.session)
+
+        address_space.vtop(0x1000)
+        self.physical_as.write(0x2004, struct.pack("<I", 0x2000 | 1))
+        self.assertEqual(address_space.vtop(0x1004), 0x2004)
+        self.assertEqual(address_space.tlb_hits, 0)
+
+    def testVolatileMemory(self):
+        self.physical_as.volatile = True
+        address_space = intel.IA32PagedMemory(
+            base=self.physical_as, dtb=0x1000, session=self.session)
+        self.assertEqual(address_space.tlb_size, 0)
+
+        self.assertEqual(address_space.vtop(0x1004), 0x3004)
+        self.physical_as.write(0x2004, struct.pack("<I", 0x4000 | 1))
+        self.assertEqual(address_space.vtop(0x1004), 0x4004)
+        self.assertEqual(address_space.tlb_hits, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -80,6 +80,27 @@ class MmapFileAddressSpace(addrspace.BaseAddressSpace):
 
         return result + "\x00" * (length - len(result))
 
+    def read_many(self, requests):
+        # Slicing the map is cheap, so there is nothing to gain from sorting
+        # or coalescing the requests.
+        results = []
+        for addr, length in requests:
+            data = self.map[addr:addr+length] if addr is not None else ""
+            if len(data) < length:
+                data += "\x00" * (length - len(data))
+
+            results.append(data)
+
+        return results
+
+    def get_buffer(self, addr, length):
+        # Return a window into the mapping, avoiding a copy. Only the end of
+        # the file needs to be padded.
+        if addr is not None and 0 <= addr and addr + length <= self.fsize:
+            return buffer(self.map, addr, length)
+
+        return self.read(addr, length)
+
     def get_available_addresses(self):
         # TODO: Explain why this is always fsize - 1?
         yield (0, 0, self.fsize - 1)
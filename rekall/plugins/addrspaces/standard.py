@@ -80,7 +80,7 @@ class FDAddressSpace(addrspace.BaseAddressSpace):
                 self.fname == other.fname)
 
 
-class FileAddressSpace(FDAddressSpace):
+class FileAddressSpace(addrspace.CachingAddressSpaceMixIn, FDAddressSpace):
     """ This is a direct file AS.
 
     For this AS to be instantiated, we need
@@ -91,6 +91,9 @@ class FileAddressSpace(FDAddressSpace):
 
     3) base == None (we dont operate on anyone else so we need to be
     right at the bottom of the AS stack.)
+
+    Reads are cached in the session's page cache, unless the file is a device
+    (e.g. /dev/pmem or /proc/kcore) whose data may change.
     """
 
     __name = "file"
@@ -122,6 +125,12 @@ class FileAddressSpace(FDAddressSpace):
         super(FileAddressSpace, self).__init__(
             fhandle=fhandle, session=session, base=base, **kwargs)
 
+        # Only regular files hold a fixed image.
+        self.volatile = not os.path.isfile(self.fname)
+
+    def reopen(self):
+        self.fhandle = open(self.fname, self.mode)
+
 
 class WriteableAddressSpaceMixIn(object):
     """This address space can be used to create new files.
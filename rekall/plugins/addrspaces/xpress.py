@@ -35,11 +35,16 @@
 from struct import unpack
 from struct import error as StructError
 
-def recombine(outbuf):
-    return "".join(outbuf[k] for k in sorted(outbuf.keys()))
+# The size of an uncompressed xpress block of a hibernation file.
+XPRESS_BLOCK_SIZE = 0x10000
 
-def xpress_decode(inputBuffer):
-    outputBuffer = {}
+def xpress_decode(inputBuffer, output_size=XPRESS_BLOCK_SIZE):
+    """Decodes the xpress compressed inputBuffer.
+
+    The output is written into a preallocated bytearray of output_size bytes,
+    which is extended if the data decompresses to more than that.
+    """
+    outputBuffer = bytearray(output_size)
     outputIndex = 0
     inputIndex = 0
     indicatorBit = 0
@@ -55,7 +60,7 @@ def xpress_decode(inputBuffer):
             try:
                 indicator = unpack("<L", inputBuffer[inputIndex:inputIndex + 4])[0]
             except StructError:
-                return recombine(outputBuffer)
+                break
 
             inputIndex += 4
             indicatorBit = 32
@@ -66,10 +71,14 @@ def xpress_decode(inputBuffer):
         # check whether the 4th bit of the value in indicator is set
         if not (indicator & (1 << indicatorBit)):
             try:
-                outputBuffer[outputIndex] = inputBuffer[inputIndex]
+                literal = ord(inputBuffer[inputIndex])
             except IndexError:
-                return recombine(outputBuffer)
+                break
+
+            if outputIndex >= len(outputBuffer):
+                outputBuffer.extend(bytearray(len(outputBuffer) or 1))
 
+            outputBuffer[outputIndex] = literal
             inputIndex += 1
             outputIndex += 1
         else:
@@ -86,7 +95,7 @@ def xpress_decode(inputBuffer):
             try:
                 length = unpack("<H", inputBuffer[inputIndex:inputIndex + 2])[0]
             except StructError:
-                return recombine(outputBuffer)
+                break
 
             inputIndex += 2
             offset = length / 8
@@ -110,22 +119,34 @@ def xpress_decode(inputBuffer):
                         try:
                             length = unpack("<H", inputBuffer[inputIndex:inputIndex + 2])[0]
                         except StructError:
-                            return recombine(outputBuffer)
+                            break
                         inputIndex = inputIndex + 2
                         length = length - (15 + 7)
                     length = length + 15
                 length = length + 7
             length = length + 3
 
-            while length != 0:
-                try:
-                    outputBuffer[outputIndex] = outputBuffer[outputIndex - offset - 1]
-                except KeyError:
-                    return recombine(outputBuffer)
-                outputIndex += 1
-                length -= 1
+            # The match refers to data before the start of the output.
+            source = outputIndex - offset - 1
+            if source < 0:
+                break
+
+            if outputIndex + length > len(outputBuffer):
+                outputBuffer.extend(bytearray(max(length, len(outputBuffer))))
+
+            # When the match overlaps the output it repeats the last
+            # (offset + 1) bytes.
+            period = offset + 1
+            if period >= length:
+                match = outputBuffer[source:source + length]
+            else:
+                match = (outputBuffer[source:outputIndex] *
+                         (length / period + 1))[:length]
+
+            outputBuffer[outputIndex:outputIndex + length] = match
+            outputIndex += length
 
-    return recombine(outputBuffer)
+    return str(outputBuffer[:outputIndex])
 
 try:
     import pyxpress #pylint: disable-msg=F0401
@@ -538,7 +538,7 @@ class OutputFileMixin(object):
         if out_file is None:
             raise RuntimeError("An output must be provided.")
 
-        self.output = open(out_file, mode="w")
+        self.output = open(out_file, mode="wb")
 
 
 class DirectoryDumperMixin(object):
@@ -619,6 +619,30 @@ class Null(plugin.Command):
         _ = renderer
 
 
+class PageCacheStats(plugin.Command):
+    """Show how well the session's page cache performs.
+
+    All the address spaces of the session share the page cache. Its size can
+    be changed with the page_cache_mb parameter.
+    """
+
+    __name = "page_cache_stats"
+
+    def render(self, renderer):
+        page_cache = self.session.page_cache
+
+        renderer.table_header([("Statistic", "statistic", "20"),
+                               ("Value", "value", ">15")])
+
+        renderer.table_row("Budget (MB)", page_cache.max_bytes / 1024 / 1024)
+        renderer.table_row("Used (bytes)", page_cache.size)
+        renderer.table_row("Entries", len(page_cache))
+        renderer.table_row("Hits", page_cache.hits)
+        renderer.table_row("Misses", page_cache.misses)
+        renderer.table_row("Hit ratio", "%.2f%%" % (
+            page_cache.hit_ratio() * 100))
+
+
 class LoadPlugins(plugin.Command):
     """Load user provided plugins.
 
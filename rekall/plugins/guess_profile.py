@@ -22,10 +22,12 @@
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 # pylint: disable=protected-access
-import re
 import logging
+import re
 
 from rekall import config
+from rekall import obj
+from rekall import processpool
 from rekall import scan
 from rekall import kb
 from rekall.plugins.darwin import common as darwin_common
@@ -74,6 +76,16 @@ class ProfileScanner(scan.BaseScanner):
 config.DeclareOption("--no_autodetect", default=False, action="store_true",
                      help="Should profiles be autodetected.")
 
+config.DeclareOption(
+    "--autodetect_workers", group="Performance",
+    action=config.IntParser,
+    help="The number of processes used to verify candidate profiles in "
+    "parallel during autodetection.")
+
+
+def _VerifyProfileInWorker(hook, candidate):
+    return hook.VerifyProfile(*candidate[:2])
+
 
 class KernelASHook(kb.ParameterHook):
     """A ParameterHook for default_address_space.
@@ -110,24 +122,25 @@ class ProfileHook(kb.ParameterHook):
         r"Linux version (\d+\.\d+\.\d+-\d+-[^ ]+)")
 
 
-    def VerifyDarwinProfile(self, profile_name):
-        try:
-            # Try to load this profile from the repository.
-            self.session.profile = self.session.LoadProfile(profile_name)
-        except ValueError:
-            return
+    # The find_dtb implementation which verifies each kind of profile.
+    FIND_DTB = {
+        "Darwin": darwin_common.DarwinFindDTB,
+        "Linux": linux_common.LinuxFindDTB,
+        "Windows": win_common.WinFindDTB,
+        }
 
-        return self.ApplyFindDTB(darwin_common.DarwinFindDTB,
-                                 self.session.profile)
+    # The number of candidates each worker may have pending verification.
+    CANDIDATES_PER_WORKER = 2
 
-    def VerifyLinuxProfile(self, profile_name):
-        try:
-            # Try to load this profile from the repository.
-            profile = self.session.LoadProfile(profile_name)
-        except ValueError:
-            return
+    # These parameters are calculated using the session's profile (e.g. the
+    # KASLR slide), so they are discarded when the profile changes.
+    PROFILE_PARAMETERS = ("kaslr_shift", "vm_kernel_slide")
 
-        return self.ApplyFindDTB(linux_common.LinuxFindDTB, profile)
+    def VerifyDarwinProfile(self, profile_name):
+        return self.VerifyAndApplyProfile("Darwin", profile_name)
+
+    def VerifyLinuxProfile(self, profile_name):
+        return self.VerifyAndApplyProfile("Linux", profile_name)
 
     def VerifyWinProfile(self, profile_name):
         """Check that this profile works with this image.
@@ -136,6 +149,38 @@ class ProfileHook(kb.ParameterHook):
         trouble distinguishing profiles which are fairly close (e.g. Win7
         versions).
         """
+        return self.VerifyAndApplyProfile("Windows", profile_name)
+
+    def VerifyAndApplyProfile(self, kind, profile_name):
+        dtb = self.VerifyProfile(kind, profile_name)
+        if dtb is not None:
+            return self.ApplyProfile(kind, profile_name, dtb)
+
+    def SetProfile(self, profile):
+        """Sets the session's profile.
+
+        The parameters calculated for a different profile are discarded.
+        """
+        current = self.session.profile
+        if not (isinstance(current, obj.Profile) and
+                isinstance(profile, obj.Profile) and
+                current.name == profile.name):
+            self.session.InvalidateParameters(*self.PROFILE_PARAMETERS)
+
+        self.session.profile = profile
+
+    def VerifyProfile(self, kind, profile_name):
+        """Checks if the profile works with this image.
+
+        The candidate is the session's profile while it is verified, so that
+        the parameters which depend on the profile (e.g. the KASLR slide) are
+        calculated for it. If the candidate does not work, the previous profile
+        is restored and these parameters are discarded again.
+
+        Returns:
+          The DTB found with this profile, or None if the profile does not
+          work.
+        """
         logging.debug("Verifying profile %s", profile_name)
 
         try:
@@ -144,16 +189,47 @@ class ProfileHook(kb.ParameterHook):
         except ValueError:
             return
 
-        return self.ApplyFindDTB(win_common.WinFindDTB, profile)
+        if not profile:
+            return
+
+        previous_profile = self.session.profile
+        self.SetProfile(profile)
 
-    def ApplyFindDTB(self, find_dtb_cls, profile):
+        dtb = None
+        try:
+            find_dtb_plugin = self.FIND_DTB[kind](
+                session=self.session, profile=profile)
+
+            for address_space in find_dtb_plugin.address_space_hits():
+                dtb = address_space.dtb
+                return dtb
+
+        finally:
+            if dtb is None:
+                self.SetProfile(previous_profile)
+
+    def ApplyProfile(self, kind, profile_name, dtb):
+        """Sets up the session with a verified profile and its DTB."""
+        profile = self.session.LoadProfile(profile_name)
+        return self.ApplyFindDTB(self.FIND_DTB[kind], profile, dtb=dtb)
+
+    def ApplyFindDTB(self, find_dtb_cls, profile, dtb=None):
         # Try to load the dtb with this profile. If it works, this is likely
         # correct.
-        self.session.profile = profile
+        self.SetProfile(profile)
 
         find_dtb_plugin = find_dtb_cls(session=self.session)
 
-        for address_space in find_dtb_plugin.address_space_hits():
+        # If the DTB was already verified we just need its address space.
+        if dtb is not None:
+            hits = [find_dtb_plugin.CreateAS(dtb)]
+        else:
+            hits = find_dtb_plugin.address_space_hits()
+
+        for address_space in hits:
+            if address_space is None:
+                continue
+
             # Might as well cache the results of this plugin so we dont need to
             # run it twice.
             self.session.kernel_address_space = address_space
@@ -164,37 +240,39 @@ class ProfileHook(kb.ParameterHook):
 
             return profile
 
-    def ScanProfiles(self):
+    def GetCandidates(self):
+        """Scans the image for profiles which might match it.
+
+        Each profile is only produced once, however many times its signature
+        appears in the image. The image is scanned from the start, so the
+        kernel (which is usually loaded low in physical memory) is normally
+        found early.
+
+        Yields:
+          Tuples of (kind, profile_name, description).
+        """
         pe_profile = self.session.LoadProfile("pe")
 
         address_space = self.session.physical_address_space
+        seen = set()
+
         for hit in ProfileScanner(address_space=address_space,
                                   session=self.session).scan():
+            candidates = []
             rsds = pe_profile.CV_RSDS_HEADER(offset=hit, vm=address_space)
             if (rsds.Signature.is_valid() and
                 str(rsds.Filename) in self.KERNEL_NAMES):
-                profile = self.VerifyWinProfile(
-                    "nt/GUID/%s" % rsds.GUID_AGE)
-
-                if profile:
-                    logging.info(
-                        "Detected %s with GUID %s", rsds.Filename,
-                        rsds.GUID_AGE)
-
-                    return profile
+                candidates.append((
+                    "Windows", "nt/GUID/%s" % rsds.GUID_AGE,
+                    "%s with GUID %s" % (rsds.Filename, rsds.GUID_AGE)))
 
             else:
                 guess = address_space.read(hit-100, 300)
                 m = self.DARWIN_TEMPLATE.search(guess)
                 if m:
                     version = PROFILE_STRINGS.get(m.group(1), "")
-                    profile_name = "OSX/%s_AMD" % version
-                    profile = self.VerifyDarwinProfile(profile_name)
-                    if profile:
-                        logging.info(
-                            "Detected %s: %s", profile_name, m.group(0))
-
-                        return profile
+                    candidates.append((
+                        "Darwin", "OSX/%s_AMD" % version, m.group(0)))
 
                 m = self.LINUX_TEMPLATE.search(guess)
                 if m:
@@ -203,14 +281,51 @@ class ProfileHook(kb.ParameterHook):
                     if "Ubuntu" in guess:
                         distribution = "Ubuntu"
 
-                    profile_name = "%s/%s" % (distribution, m.group(1))
-                    profile = self.VerifyLinuxProfile(profile_name)
-                    if profile:
-                        logging.info(
-                            "Detected %s: %s", profile_name, m.group(0))
+                    candidates.append((
+                        "Linux", "%s/%s" % (distribution, m.group(1)),
+                        m.group(0)))
 
-                        return profile
+            for candidate in candidates:
+                if candidate[1] not in seen:
+                    seen.add(candidate[1])
+                    yield candidate
 
+    def ScanProfiles(self):
+        workers = self.session.GetParameter("autodetect_workers", 1)
+        if workers > 1:
+            verified = self._VerifyCandidatesInParallel(
+                self.GetCandidates(), workers)
+        else:
+            verified = ((candidate, self.VerifyProfile(*candidate[:2]))
+                        for candidate in self.GetCandidates())
+
+        for (kind, profile_name, description), dtb in verified:
+            if dtb is None:
+                continue
+
+            profile = self.ApplyProfile(kind, profile_name, dtb)
+            if profile:
+                logging.info("Detected %s: %s", profile_name, description)
+                return profile
+
+    def _VerifyCandidatesInParallel(self, candidates, workers):
+        """Verifies the candidates in a pool of forked worker processes.
+
+        The image is still scanned for candidates here while the workers
+        verify the earlier ones. Results are yielded in the order of the
+        candidates, so the same profile is detected as when verifying one at a
+        time. Once the caller stops at a verified profile, the remaining
+        verifications are cancelled by terminating the pool.
+
+        Yields:
+          Tuples of (candidate, dtb), where dtb is None if the candidate did
+          not verify.
+        """
+        return processpool.RunInWorkers(
+            _VerifyProfileInWorker, candidates, workers, state=self,
+            session=self.session,
+            address_spaces=[self.session.physical_address_space],
+            items_per_worker=self.CANDIDATES_PER_WORKER)
 
     def calculate(self):
         """Try to find the correct profile by scanning for PDB files."""
@@ -222,4 +337,7 @@ class ProfileHook(kb.ParameterHook):
 
         # Only do something only if we are allowed to autodetect profiles.
         if not self.session.GetParameter("no_autodetect"):
-            return self.ScanProfiles()
+            # Parameters calculated for candidates which are rejected must not
+            # be kept, so they are only saved once a profile is applied.
+            with self.session.DeferParameterSaves():
+                return self.ScanProfiles()
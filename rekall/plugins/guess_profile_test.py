@@ -0,0 +1,187 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for profile autodetection."""
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall.plugins import guess_profile
+
+
+def Image(size, **data):
+    """Returns an image of size bytes with data at the given offsets."""
+    image = bytearray(size)
+    for offset, value in data.values():
+        image[offset:offset + len(value)] = value
+
+    return str(image)
+
+
+class ProfileHookTest(unittest.TestCase):
+    """Test the verification of candidate profiles."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.session.physical_address_space = addrspace.BufferAddressSpace(
+            data="", session=self.session)
+
+        self.hook = guess_profile.ProfileHook(self.session)
+
+        # Only the Linux profiles work with this image.
+        self.hook.VerifyProfile = lambda kind, name: (
+            0x1000 if kind == "Linux" else None)
+
+        self.candidates = [("Windows", "nt/GUID/%s" % i, "") for i in range(10)]
+        self.candidates.insert(5, ("Linux", "Ubuntu/1", ""))
+        self.candidates.append(("Linux", "Ubuntu/2", ""))
+
+    def testVerifyCandidatesInParallel(self):
+        self.consumed = 0
+
+        def Candidates():
+            for candidate in self.candidates:
+                self.consumed += 1
+                yield candidate
+
+        # The first verified candidate is found, without scanning for the
+        # rest of the candidates.
+        for candidate, dtb in self.hook._VerifyCandidatesInParallel(
+                Candidates(), 2):
+            if dtb is not None:
+                break
+
+        self.assertEqual(candidate[1], "Ubuntu/1")
+        self.assertEqual(dtb, 0x1000)
+        self.assertTrue(self.consumed < len(self.candidates))
+
+
+
+class VerifyProfileTest(unittest.TestCase):
+    """Verify Linux and Darwin candidates with KASLR against small images."""
+
+    # Linux (I386): PAGE_OFFSET is 0xc0000000.
+    LINUX_CONSTANTS = dict(
+        _text=0xc0100000, phys_startup_32=0x100000,
+        linux_proc_banner=0xc0002000, swapper_pg_dir=0xc0004000)
+
+    LINUX_SHIFT = 0x10000
+
+    # Darwin (AMD64): Kernel addresses map to the low 4gb of physical memory.
+    KERNEL = 0xffffff8000000000
+    DARWIN_CONSTANTS = dict(
+        _BootPML4=KERNEL + 0x201000, _lowGlo=KERNEL + 0x202000,
+        _version=KERNEL + 0x203000, _IdlePML4=KERNEL + 0x204000,
+        _kernel_pmap_store=KERNEL + 0x205000)
+
+    DARWIN_STRUCTS = {
+        "pmap": [8, {
+            "pm_cr3": [0, ["unsigned long long"]],
+            }],
+        }
+
+    DARWIN_SLIDE = 0x400000
+    DARWIN_DTB = 0x10000
+
+    def setUp(self):
+        self.session = session.Session()
+        self.hook = guess_profile.ProfileHook(self.session)
+
+    def AddProfile(self, name, profile_class, arch, constants, structs=None):
+        self.session.profile_cache[name] = obj.Profile.LoadProfileFromData({
+            "$METADATA": dict(ProfileClass=profile_class, Type="Profile",
+                              arch=arch),
+            "$CONSTANTS": constants,
+            "$STRUCTS": structs or {},
+            }, session=self.session, name=name)
+
+    def SetImage(self, data):
+        self.session.physical_address_space = addrspace.BufferAddressSpace(
+            data=data, session=self.session)
+
+    def testLinux(self):
+        self.AddProfile("Linux/test", "Linux32", "I386", self.LINUX_CONSTANTS)
+
+        # The banner is at its physical offset plus the shift.
+        self.SetImage(Image(0x20000, banner=(
+            0x2000 + self.LINUX_SHIFT, "%s version %s")))
+
+        self.assertEqual(self.hook.VerifyProfile("Linux", "Linux/test"),
+                         0x4000 + self.LINUX_SHIFT)
+
+        self.assertEqual(self.session.GetParameter("kaslr_shift"),
+                         self.LINUX_SHIFT)
+
+        # Another profile calculates its own shift.
+        constants = self.LINUX_CONSTANTS.copy()
+        constants["linux_proc_banner"] += 0x1000
+        self.AddProfile("Linux/other", "Linux32", "I386", constants)
+
+        self.assertEqual(self.hook.VerifyProfile("Linux", "Linux/other"),
+                         0x4000 + self.LINUX_SHIFT - 0x1000)
+
+    def GetDarwinImage(self):
+        slide = self.DARWIN_SLIDE
+        version = "Darwin Kernel Version 12.5.0"
+
+        # The page tables map the slid kernel with a 2mb page.
+        virtual_address = self.KERNEL + 0x200000 + slide
+        pml4 = self.DARWIN_DTB
+        pdpt = pml4 + 0x1000
+        pd = pdpt + 0x1000
+
+        return Image(
+            0x800000,
+            catfish=(0x202000 + slide, "Catfish \x00\x00"),
+            version=(0x203000 + slide, version),
+            idlepml4=(0x204000 + slide, struct.pack("<I", pml4)),
+            pml4e=(pml4 + ((virtual_address >> 39) & 0x1ff) * 8,
+                   struct.pack("<Q", pdpt | 0x3)),
+            pdpte=(pdpt + ((virtual_address >> 30) & 0x1ff) * 8,
+                   struct.pack("<Q", pd | 0x3)),
+            pde=(pd + ((virtual_address >> 21) & 0x1ff) * 8,
+                 struct.pack("<Q", (0x200000 + slide) | 0x83)))
+
+    def testDarwin(self):
+        self.SetImage(self.GetDarwinImage())
+
+        # This profile does not find the version string, so it does not
+        # work with this image.
+        constants = self.DARWIN_CONSTANTS.copy()
+        constants["_version"] += 0x100
+        self.AddProfile("OSX/bad", "Darwin64", "AMD64", constants,
+                        self.DARWIN_STRUCTS)
+        self.AddProfile("OSX/good", "Darwin64", "AMD64",
+                        self.DARWIN_CONSTANTS, self.DARWIN_STRUCTS)
+
+        self.assertEqual(self.hook.VerifyProfile("Darwin", "OSX/bad"), None)
+        self.assertEqual(self.session.profile, None)
+
+        # The slide calculated for the bad profile is not used for this one.
+        self.assertEqual(self.hook.VerifyProfile("Darwin", "OSX/good"),
+                         self.DARWIN_DTB)
+
+        self.assertEqual(self.session.GetParameter("vm_kernel_slide"),
+                         self.DARWIN_SLIDE)
+
+
+if __name__ == "__main__":
+    unittest.main()
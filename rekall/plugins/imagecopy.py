@@ -21,16 +21,108 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 #
 
+import hashlib
+import json
 import os
 
+from rekall import config
 from rekall import plugin
+from rekall import processpool
+
+
+PAGE_SIZE = 0x1000
+
+# All zero pages are not written to the output image.
+ZERO_PAGE = "\x00" * PAGE_SIZE
+
+# Holes are hashed from this buffer.
+ZERO_BLOCK = ZERO_PAGE * 0x100
+
+
+def _ReadBlock(address_space, offset, length):
+    """Reads a block and splits it into the runs of pages which are not zero.
+
+    Returns:
+      A list of (offset, data) tuples. Pages which are all zero are dropped, so
+      a block which is entirely zero costs nothing to pass between processes.
+    """
+    data = address_space.read(offset, length)
+    runs = []
+    run_start = None
+
+    for i in xrange(0, len(data), PAGE_SIZE):
+        page = data[i:i + PAGE_SIZE]
+        if page == ZERO_PAGE[:len(page)]:
+            if run_start is not None:
+                runs.append((offset + run_start, data[run_start:i]))
+                run_start = None
+
+        elif run_start is None:
+            run_start = i
+
+    if run_start is not None:
+        runs.append((offset + run_start, data[run_start:]))
+
+    return runs
+
+
+def _ReadBlockInWorker(address_space, block):
+    return _ReadBlock(address_space, *block)
+
+
+class ImageHasher(object):
+    """Computes the hashes of the output image while it is written.
+
+    The image is written sparsely, so the data is not all seen in one stream.
+    The holes are hashed as zeros, so the hashes are the same as those of the
+    complete raw image on disk.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.hashes = [("MD5", hashlib.md5()), ("SHA256", hashlib.sha256())]
+
+    def pad(self, offset):
+        """Hashes zeros up to offset."""
+        while self.offset < offset:
+            to_pad = min(offset - self.offset, len(ZERO_BLOCK))
+            self._update(buffer(ZERO_BLOCK, 0, to_pad))
+
+    def update(self, offset, data):
+        self.pad(offset)
+        self._update(data)
+
+    def _update(self, data):
+        for _, hasher in self.hashes:
+            hasher.update(data)
+
+        self.offset += len(data)
+
+    def hexdigests(self):
+        return [(name, hasher.hexdigest()) for name, hasher in self.hashes]
 
 
 class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
-    """Copies a physical address space out as a raw DD image"""
+    """Copies a physical address space out as a raw DD image.
+
+    The image is written as a sparse file: pages which are all zero (and the
+    gaps between the address ranges) are left as holes. The MD5 and SHA256 of
+    the image are computed while it is written, and an interrupted copy can be
+    resumed with --resume.
+
+    Address spaces which are able to convert themselves to a raw image (e.g.
+    hibernation files, which decompress each block only once) are converted
+    instead. The conversion can not be resumed.
+    """
 
     __name = "imagecopy"
 
+    # The size of each read from the address space.
+    BLOCKSIZE = 1024 * 1024 * 5
+
+    # The number of blocks each reader process may read ahead of the writer.
+    BLOCKS_PER_WORKER = 4
+
     @classmethod
     def args(cls, parser):
         super(ImageCopy, cls).args(parser)
@@ -38,7 +130,16 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
         parser.add_argument("-O", "--output-image", default=None,
                             help="Filename to write output image.")
 
-    def __init__(self, output_image=None, address_space=None, **kwargs):
+        parser.add_argument("--resume", default=False, action="store_true",
+                            help="Resume an interrupted copy to the output "
+                            "image.")
+
+        parser.add_argument("--workers", default=1, action=config.IntParser,
+                            help="The number of processes which read (or "
+                            "decompress) the image in parallel.")
+
+    def __init__(self, output_image=None, address_space=None, resume=False,
+                 workers=1, **kwargs):
         """Dumps the address_space into the output file.
 
         Args:
@@ -46,9 +147,18 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
 
           address_space: The address space to dump. If not specified, we use the
           physical address space.
+
+          resume: If set, continue a copy which was interrupted, from the point
+          recorded in its progress file.
+
+          workers: The number of processes which read the address space in
+          parallel. This helps when reading is expensive (e.g. decompressing a
+          hibernation file or an EWF image).
         """
         super(ImageCopy, self).__init__(**kwargs)
         self.output_image = output_image
+        self.resume = resume
+        self.workers = workers or 1
         if address_space is None:
             # Use the physical address space.
             if self.session.physical_address_space is None:
@@ -69,31 +179,152 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
 
         return "{0:0.2f} TB".format(value)
 
+    def _blocks(self, start=0):
+        """Generates the (offset, length) of the blocks to copy from start."""
+        for range_offset, _, range_length in (
+                self.address_space.get_address_ranges(start=start)):
+            range_end = range_offset + range_length
+
+            for offset in xrange(range_offset, range_end, self.BLOCKSIZE):
+                yield offset, min(self.BLOCKSIZE, range_end - offset)
+
+    def _read_blocks(self, blocks):
+        """Reads the blocks.
+
+        Yields:
+          Tuples of (offset, length, runs) in order, where runs are the non
+          zero runs from _ReadBlock().
+        """
+        if self.workers <= 1:
+            for offset, length in blocks:
+                yield offset, length, _ReadBlock(
+                    self.address_space, offset, length)
+
+            return
+
+        for result in self._read_blocks_in_parallel(blocks):
+            yield result
+
+    def _read_blocks_in_parallel(self, blocks):
+        """Reads the blocks in a pool of forked reader processes.
+
+        At most BLOCKS_PER_WORKER blocks per worker are in flight, so memory
+        use is bounded however large the image is.
+        """
+        for (offset, length), runs in processpool.RunInWorkers(
+                _ReadBlockInWorker, blocks, self.workers,
+                state=self.address_space, session=self.session,
+                address_spaces=[self.address_space],
+                items_per_worker=self.BLOCKS_PER_WORKER):
+            yield offset, length, runs
+
+    def copy(self, fd, hasher, start=0, progress_path=None):
+        """Copies the address space into fd.
+
+        Args:
+          fd: The output file. It must not contain any data after start.
+          hasher: An ImageHasher which has already seen the image up to start.
+          start: The offset to start copying from.
+          progress_path: If set, the offset up to which the image is complete
+            is stored in this file after every block.
+
+        Yields:
+          The offset copied so far, after each block.
+        """
+        end = start
+        for offset, length, runs in self._read_blocks(self._blocks(start)):
+            for run_offset, data in runs:
+                fd.seek(run_offset)
+                fd.write(data)
+                hasher.update(run_offset, data)
+
+            end = offset + length
+            if progress_path:
+                fd.flush()
+                self._save_progress(progress_path, end)
+
+            yield end
+
+        # Extending the file leaves the trailing zero pages as a hole.
+        fd.truncate(end)
+        hasher.pad(end)
+
+    def convert(self, fd, renderer):
+        """Converts the address space with its convert_to_raw() method.
+
+        Returns:
+          An ImageHasher of the output image, which is hashed once it is
+          complete (the pages are not written in order).
+        """
+        for page_count in self.address_space.convert_to_raw(
+                fd, workers=self.workers):
+            renderer.RenderProgress("Converted %s pages" % page_count)
+
+        fd.seek(0, 2)
+        return self._rehash(fd, fd.tell(), renderer)
+
+    def _save_progress(self, progress_path, offset):
+        with open(progress_path, "wb") as progress_fd:
+            json.dump(dict(offset=offset), progress_fd)
+
+    def _rehash(self, fd, end, renderer):
+        """Hashes the part of the output image which is already written."""
+        hasher = ImageHasher()
+        if not end:
+            return hasher
+
+        fd.seek(0)
+        while hasher.offset < end:
+            data = fd.read(min(self.BLOCKSIZE, end - hasher.offset))
+            if not data:
+                break
+
+            hasher.update(hasher.offset, data)
+            renderer.RenderProgress(
+                "Hashing offset %s" % self.human_readable(hasher.offset))
+
+        hasher.pad(end)
+        return hasher
+
     def render(self, renderer):
         """Renders the file to disk"""
         if self.output_image is None:
             raise plugin.PluginError("Please provide an output-image filename")
 
-        if (os.path.exists(self.output_image) and
-            os.path.getsize(self.output_image) > 1):
-            raise plugin.PluginError("Refusing to overwrite an existing file, "
-                                     "please remove it before continuing")
+        progress_path = self.output_image + ".progress"
+        start = 0
 
-        blocksize = 1024 * 1024 * 5
-        with open(self.output_image, "wb") as fd:
-            for _ in self.address_space.get_available_addresses():
-                range_offset, phys_range_offset, range_length = _
-                renderer.format("Range {0:#x} - {1:#x}\n",
-                                range_offset, range_length)
+        if self.resume and os.path.exists(progress_path):
+            with open(progress_path, "rb") as progress_fd:
+                start = json.load(progress_fd)["offset"]
 
-                range_end = range_offset + range_length
+            renderer.format("Resuming copy from offset {0:#x}\n", start)
+
+        elif (os.path.exists(self.output_image) and
+              os.path.getsize(self.output_image) > 1):
+            raise plugin.PluginError("Refusing to overwrite an existing file, "
+                                     "please remove it before continuing")
 
-                for offset in range(range_offset, range_end, blocksize):
-                    to_read = min(blocksize, range_end - offset)
-                    data = self.address_space.read(offset, to_read)
+        with open(self.output_image, "r+b" if start else "w+b") as fd:
+            if not start and hasattr(self.address_space, "convert_to_raw"):
+                hasher = self.convert(fd, renderer)
 
-                    fd.seek(offset)
-                    fd.write(data)
+            else:
+                # Anything written after the last completed block is discarded.
+                fd.truncate(start)
+                hasher = self._rehash(fd, start, renderer)
 
+                for offset in self.copy(fd, hasher, start=start,
+                                        progress_path=progress_path):
                     renderer.RenderProgress(
                         "Writing offset %s" % self.human_readable(offset))
+
+        # The copy is complete.
+        if os.path.exists(progress_path):
+            os.unlink(progress_path)
+
+        renderer.format("Wrote {0} ({1:#x} bytes)\n",
+                        self.human_readable(hasher.offset), hasher.offset)
+
+        for name, digest in hasher.hexdigests():
+            renderer.format("{0}: {1}\n", name, digest)
@@ -0,0 +1,170 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the imagecopy plugin."""
+import hashlib
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall.ui import renderer
+from rekall.plugins import imagecopy
+
+
+def BuildAddressSpace(session):
+    """Builds an image with two ranges: 0 - 0x4000 and 0x10000 - 0x13000.
+
+    The second page of each range is all zeros.
+    """
+    data = "".join(
+        ("%04x" % page) * 0x400 if page not in (1, 5) else "\x00" * 0x1000
+        for page in range(7))
+
+    address_space = addrspace.RunBasedAddressSpace(
+        base=addrspace.BufferAddressSpace(data=data, session=session),
+        session=session)
+    address_space.runs.insert((0, 0, 0x4000))
+    address_space.runs.insert((0x10000, 0x4000, 0x3000))
+
+    return address_space
+
+
+class ConvertingAddressSpace(addrspace.RunBasedAddressSpace):
+    """An address space which converts itself to a raw image."""
+
+    __abstract = True
+
+    def __init__(self, **kwargs):
+        super(ConvertingAddressSpace, self).__init__(**kwargs)
+        self.conversions = []
+
+    def convert_to_raw(self, ofile, workers=1):
+        self.conversions.append(workers)
+
+        # Pages are written out of order.
+        pages = 0
+        for offset, _, length in reversed(list(self.runs)):
+            ofile.seek(offset)
+            ofile.write(self.read(offset, length))
+            pages += length / 0x1000
+            yield pages
+
+
+class ImageCopyTest(unittest.TestCase):
+    """Test the imagecopy plugin."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.address_space = BuildAddressSpace(self.session)
+        self.temp_dir = tempfile.mkdtemp()
+
+        # The expected raw image.
+        self.expected = "\x00" * 0x13000
+        for offset, _, length in self.address_space.get_available_addresses():
+            self.expected = (
+                self.expected[:offset] +
+                self.address_space.read(offset, length) +
+                self.expected[offset + length:])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def ImageCopy(self, **kwargs):
+        plugin = imagecopy.ImageCopy(
+            session=self.session, address_space=self.address_space,
+            physical_address_space=self.address_space, **kwargs)
+        plugin.BLOCKSIZE = 0x2000
+
+        return plugin
+
+    def CheckImage(self, path, hasher):
+        with open(path, "rb") as fd:
+            self.assertEqual(fd.read(), self.expected)
+
+        self.assertEqual(hasher.hexdigests(), [
+            ("MD5", hashlib.md5(self.expected).hexdigest()),
+            ("SHA256", hashlib.sha256(self.expected).hexdigest())])
+
+    def testReadBlock(self):
+        runs = imagecopy._ReadBlock(self.address_space, 0x10000, 0x3000)
+        self.assertEqual([(x, len(y)) for x, y in runs],
+                         [(0x10000, 0x1000), (0x12000, 0x1000)])
+
+    def testCopy(self):
+        for workers in (1, 2):
+            path = os.path.join(self.temp_dir, "image%s" % workers)
+            hasher = imagecopy.ImageHasher()
+            with open(path, "wb") as fd:
+                self.assertEqual(
+                    list(self.ImageCopy(workers=workers).copy(fd, hasher)),
+                    [0x2000, 0x4000, 0x12000, 0x13000])
+
+            self.CheckImage(path, hasher)
+
+    def testResume(self):
+        path = os.path.join(self.temp_dir, "image")
+        progress_path = path + ".progress"
+
+        # Interrupt the copy after the first range.
+        with open(path, "wb") as fd:
+            copier = self.ImageCopy().copy(
+                fd, imagecopy.ImageHasher(), progress_path=progress_path)
+            self.assertEqual(copier.next(), 0x2000)
+            self.assertEqual(copier.next(), 0x4000)
+
+            # Some data of the next block was written before the interruption.
+            fd.seek(0x10000)
+            fd.write("x" * 0x100)
+
+        output = StringIO.StringIO()
+        self.ImageCopy(output_image=path, resume=True).render(
+            renderer.TextRenderer(session=self.session, fd=output))
+        self.assertTrue(hashlib.md5(self.expected).hexdigest() in
+                        output.getvalue())
+
+        self.assertFalse(os.path.exists(progress_path))
+        with open(path, "rb") as fd:
+            self.assertEqual(fd.read(), self.expected)
+
+    def testConvert(self):
+        address_space = ConvertingAddressSpace(
+            base=self.address_space.base, session=self.session)
+        for run in self.address_space.runs:
+            address_space.runs.insert(run)
+
+        self.address_space = address_space
+
+        path = os.path.join(self.temp_dir, "image")
+        output = StringIO.StringIO()
+        self.ImageCopy(output_image=path, workers=3).render(
+            renderer.TextRenderer(session=self.session, fd=output))
+
+        self.assertEqual(address_space.conversions, [3])
+        self.assertTrue(hashlib.sha256(self.expected).hexdigest() in
+                        output.getvalue())
+        with open(path, "rb") as fd:
+            self.assertEqual(fd.read(), self.expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
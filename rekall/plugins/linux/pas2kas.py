@@ -97,7 +97,7 @@ class LinPas2Vas(common.LinProcessFilter):
         # This lookup map is sorted by the physical address. We then use
         # bisect to efficiently look up the physical page.
         tmp_lookup_map = []
-        for va, pa, length in virtual_address_space.get_available_addresses():
+        for va, pa, length in virtual_address_space.get_address_ranges():
             tmp_lookup_map.append((pa, length, va, task))
 
         tmp_lookup_map.sort()
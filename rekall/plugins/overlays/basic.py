@@ -382,24 +382,84 @@ class ListMixIn(object):
 
         return item
 
-    def find_all_lists(self, seen):
-        """Follows all the list entries starting from lst.
+    def _get_link_reader(self):
+        """Returns a function which reads the links of a list entry at once.
 
-        We basically convert the list to a tree and recursively search it for
-        new nodes. From each node we follow the Flink and then the Blink. When
-        we see a node we already have, we backtrack. This allows us to find
-        nodes which do not satisfy the relation (Due to smear):
+        The function takes the offset of a list entry and returns the
+        addresses its forward and backward links point to. This is only
+        possible when both links are plain pointers to list entries of our own
+        type, otherwise None is returned.
+        """
+        links = [self.m(self._forward), self.m(self._backward)]
+        for link in links:
+            if (not isinstance(link, obj.Pointer) or
+                    link.target != self.obj_type or link.target_args):
+                return None
+
+        # pylint: disable=protected-access
+        format_string = links[0]._proxy.format_string
+        if (format_string != links[1]._proxy.format_string or
+                format_string[0] not in "<>="):
+            return None
+
+        size = struct.calcsize(format_string)
+        (start, first), (end, _) = sorted(
+            (link.obj_offset - self.obj_offset, i)
+            for i, link in enumerate(links))
+
+        if end - start < size:
+            return None
+
+        layout = struct.Struct("%s%s%dx%s" % (
+            format_string[0], format_string[1], end - start - size,
+            format_string[1]))
+        vm = self.obj_vm
+
+        def _ReadLinks(offset):
+            data = vm.read(offset + start, layout.size)
+            if len(data) != layout.size:
+                return 0, 0
+
+            values = layout.unpack(data)
+            if first:
+                values = values[::-1]
+
+            return (obj.Pointer.integer_to_address(values[0]),
+                    obj.Pointer.integer_to_address(values[1]))
+
+        return _ReadLinks
+
+    def walk_all_lists(self):
+        """Yields all the list entries reachable from this one.
+
+        We basically convert the list to a tree and search it for new nodes.
+        From each node we follow the Flink and then the Blink. When we see a
+        node we already have, we backtrack. This allows us to find nodes which
+        do not satisfy the relation (Due to smear):
 
         x.Flink.Blink = x
 
+        Entries are yielded as soon as they are found. Nodes are remembered by
+        their address space and offset, so the search is linear in the number
+        of entries.
+
         Reference:
         http://en.wikipedia.org/wiki/Depth-first_search
         """
-        stack = [self]
-        while stack:
-            item = stack.pop()
-            if item not in seen:
-                seen.append(item)
+        seen = set()
+        read_links = self._get_link_reader()
+
+        if read_links is None:
+            stack = [self]
+            while stack:
+                item = stack.pop()
+                key = (item.obj_vm,
+                       obj.Pointer.integer_to_address(item.obj_offset))
+                if key in seen:
+                    continue
+
+                seen.add(key)
+                yield item
 
                 Blink = item.m(self._backward).dereference()
                 if Blink.is_valid():
@@ -409,13 +469,50 @@ class ListMixIn(object):
                 if Flink.is_valid():
                     stack.append(Flink)
 
-    def list_of_type(self, type, member):
-        result = []
-        self.find_all_lists(result)
+            return
+
+        # All the entries are in our address space, and we only need to read
+        # the links of each entry.
+        vm = self.obj_vm
+        head = obj.Pointer.integer_to_address(self.obj_offset)
+        stack = [head]
+        while stack:
+            offset = stack.pop()
+            if offset in seen:
+                continue
+
+            seen.add(offset)
+            if offset == head:
+                yield self
+            else:
+                yield self.obj_profile.Object(
+                    type_name=self.obj_type, offset=offset, vm=vm,
+                    parent=self.obj_parent, name=self.obj_name,
+                    context=self.obj_context)
 
+            flink, blink = read_links(offset)
+            if vm.is_valid_address(blink):
+                stack.append(blink)
+
+            if vm.is_valid_address(flink):
+                stack.append(flink)
+
+    def find_all_lists(self, seen=None):
+        """Returns all the list entries reachable from this one.
+
+        See walk_all_lists() for details. The entries are appended to the seen
+        list if it is given.
+        """
+        if seen is None:
+            seen = []
+
+        seen.extend(self.walk_all_lists())
+        return seen
+
+    def list_of_type(self, type, member):
         # We traverse all the _LIST_ENTRYs we can find, and cast them all back
         # to the required member.
-        for lst in result:
+        for lst in self.walk_all_lists():
             # Skip ourselves in this (list_of_type is usually invoked on a list
             # head).
             if lst.obj_offset == self.obj_offset:
@@ -0,0 +1,92 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the basic overlays."""
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall.plugins.overlays import basic
+
+
+def BuildProfile(session):
+    profile = obj.Profile.classes["Profile32Bits"](session=session)
+    profile.add_types({
+        '_LIST_ENTRY': [8, {
+            'Flink': [0, ['Pointer', dict(target='_LIST_ENTRY')]],
+            'Blink': [4, ['Pointer', dict(target='_LIST_ENTRY')]],
+            }],
+        '_TASK': [12, {
+            'Pid': [0, ['unsigned int']],
+            'Links': [4, ['_LIST_ENTRY']],
+            }],
+        })
+    profile.add_classes(_LIST_ENTRY=basic._LIST_ENTRY)
+
+    return profile
+
+
+class ListMixInTest(unittest.TestCase):
+    """Test the list traversal."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.profile = BuildProfile(self.session)
+
+        # A list head at 0x1000 followed by tasks every 0x10 bytes. The links of
+        # the last task are smeared, but the task is still reachable from the
+        # Blink of the head.
+        self.count = 1000
+        data = ["\x00" * 0x1000]
+        links = [0x1000] + [0x2004 + 0x10 * i for i in range(self.count)]
+        data.append(struct.pack(
+            "<II", links[1], links[-1]).ljust(0x1000, "\x00"))
+
+        for i in range(1, self.count + 1):
+            flink = links[(i + 1) % len(links)]
+            blink = links[i - 1]
+            if i == self.count:
+                flink = blink = 0
+
+            data.append(struct.pack("<IIII", i, flink, blink, 0))
+
+        self.address_space = addrspace.BufferAddressSpace(
+            data="".join(data), session=self.session)
+
+    def ListPids(self):
+        head = self.profile._LIST_ENTRY(offset=0x1000, vm=self.address_space)
+        return [x.Pid.v() for x in head.list_of_type("_TASK", "Links")]
+
+    def testListOfType(self):
+        pids = self.ListPids()
+        self.assertEqual(sorted(pids), range(1, self.count + 1))
+
+        # Following the links one by one must find the same entries.
+        read_links = basic.ListMixIn._get_link_reader
+        try:
+            basic.ListMixIn._get_link_reader = lambda self: None
+            self.assertEqual(self.ListPids(), pids)
+        finally:
+            basic.ListMixIn._get_link_reader = read_links
+
+
+if __name__ == "__main__":
+    unittest.main()
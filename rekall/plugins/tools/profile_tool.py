@@ -90,6 +90,7 @@ import re
 import StringIO
 import yaml
 
+from rekall import binary_profile
 from rekall import builtin_profiles
 from rekall import io_manager
 from rekall import plugin
@@ -108,11 +109,13 @@ class ProfileConverter(object):
     __metaclass__ = registry.MetaclassRegistry
     __abstract = True
 
-    def __init__(self, input, output, profile_class=None, session=None):
+    def __init__(self, input, output, profile_class=None, session=None,
+                 binary=False):
         self.input = input
         self.output = output
         self.session = session
         self.profile_class = profile_class
+        self.binary = binary
 
     def SelectFile(self, regex):
         """Reads the content of the first file which matches regex."""
@@ -134,8 +137,10 @@ class ProfileConverter(object):
         return result
 
     def WriteProfile(self, profile_file):
-        self.output.write(utils.PPrint(profile_file))
-
+        if self.binary:
+            binary_profile.Write(self.output, profile_file)
+        else:
+            self.output.write(utils.PPrint(profile_file))
 
     def Convert(self):
         raise RuntimeError("Unknown profile format.")
@@ -333,6 +338,33 @@ class WindowsConverter(ProfileConverter):
         self.WriteProfile(profile_file)
 
 
+class RekallConverter(ProfileConverter):
+    """Converts an existing Rekall JSON profile (e.g. to a binary profile).
+
+    This converter must be manually specified.
+    """
+
+    def Convert(self):
+        if self.input.endswith(".gz"):
+            fd = gzip.open(self.input)
+        else:
+            fd = open(self.input, "rb")
+
+        with fd:
+            data = fd.read()
+
+        if binary_profile.IsBinaryProfile(data):
+            data = binary_profile.BinaryProfile(data)
+            profile_file = dict((x, data.get(x)) for x in data.keys())
+        else:
+            profile_file = json.loads(data)
+
+        if "$METADATA" not in profile_file:
+            raise RuntimeError("%s is not a Rekall profile." % self.input)
+
+        self.WriteProfile(profile_file)
+
+
 class ConvertProfile(core.OutputFileMixin, plugin.Command):
     """Convert a profile from another program to the Rekall format.
 
@@ -341,6 +373,10 @@ class ConvertProfile(core.OutputFileMixin, plugin.Command):
 
     - Linux debug compiled kernel module (see tool/linux/README)
     - OSX Dwarfdump outputs.
+    - Existing Rekall profiles (--converter RekallConverter).
+
+    With --binary the profile is written as a binary profile, which loads much
+    faster since its structs are only decoded when used.
     """
 
     __name = "convert_profile"
@@ -358,24 +394,30 @@ class ConvertProfile(core.OutputFileMixin, plugin.Command):
             help="The name of the converter to use. "
             "If not specified autoguess.")
 
+        parser.add_argument(
+            "--binary", default=False, action="store_true",
+            help="Write the profile in the binary profile format.")
+
         parser.add_argument("source",
                             help="Filename of profile to read.")
 
         super(ConvertProfile, cls).args(parser)
 
     def __init__(self, source=None, out_file=None,
-                 profile_class=None, converter=None, **kwargs):
+                 profile_class=None, converter=None, binary=False, **kwargs):
         super(ConvertProfile, self).__init__(out_file=out_file, **kwargs)
         self.profile_class = profile_class
         self.converter = converter
         self.source = source
+        self.binary = binary
 
     def ConvertProfile(self, input, output):
         """Converts the input profile to a new standard profile in output."""
         # First detect what kind of profile the input profile is.
         for converter in (LinuxConverter, OSXConverter):
             try:
-                converter(input, output, session=self.session).Convert()
+                converter(input, output, session=self.session,
+                          binary=self.binary).Convert()
                 logging.info("Converted %s to %s", input, output.name)
                 return
             except RuntimeError:
@@ -391,7 +433,8 @@ class ConvertProfile(core.OutputFileMixin, plugin.Command):
                 raise IOError("Unknown converter %s" % self.converter)
 
             return cls(self.source, self.output,
-                       profile_class=self.profile_class).Convert()
+                       profile_class=self.profile_class,
+                       binary=self.binary).Convert()
 
         try:
             input = io_manager.Factory(self.source, mode="r")
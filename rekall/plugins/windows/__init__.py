@@ -22,6 +22,7 @@ from rekall.plugins.windows import network
 #from rekall.plugins.windows import patcher
 from rekall.plugins.windows import pas2kas
 from rekall.plugins.windows import pfn
+from rekall.plugins.windows import poolscan
 from rekall.plugins.windows import procdump
 from rekall.plugins.windows import procinfo
 from rekall.plugins.windows import pstree
@@ -24,9 +24,12 @@
 
 # pylint: disable=protected-access
 
+import ahocorasick
 import logging
 import re
+import struct
 
+from rekall import addrspace
 from rekall import config
 from rekall import scan
 from rekall import obj
@@ -37,6 +40,9 @@ from rekall import utils
 from rekall.plugins import core
 
 
+numpy = utils.ConditionalImport("numpy")
+
+
 # We require both a physical AS set and a valid profile for
 # AbstractWindowsCommandPlugins.
 
@@ -208,8 +214,55 @@ class MultiPoolTagCheck(scan.MultiStringFinderCheck):
              buffer_as, offset + self.tag_offset)
 
 
-class CheckPoolSize(scan.ScannerCheck):
+class PoolHeaderCheck(scan.ScannerCheck):
+    """A check which only depends on some fields of the _POOL_HEADER.
+
+    The PoolScanner decodes these fields for all the pool tag hits in a buffer
+    at once, and calls check_fields() without building a _POOL_HEADER.
+    """
+
+    # The names of the _POOL_HEADER fields passed to check_fields().
+    fields = []
+
+    def check(self, buffer_as, offset):
+        pool_hdr = self.profile._POOL_HEADER(
+            vm=buffer_as, offset=offset)
+
+        return self.check_fields(*[pool_hdr.m(x).v() for x in self.fields])
+
+    def check_fields(self, *values):
+        raise NotImplementedError()
+
+    def get_field_layout(self, name):
+        """Returns how to decode the _POOL_HEADER field from raw data.
+
+        Returns:
+          A tuple of (offset, format_string, start_bit, end_bit).
+
+        Raises:
+          ValueError if the field is not an integer or a bit field.
+        """
+        pool_hdr = self.profile._POOL_HEADER(
+            vm=addrspace.BufferAddressSpace(
+                data="\x00" * self.profile.get_obj_size("_POOL_HEADER"),
+                session=self.profile.session))
+
+        field = pool_hdr.m(name)
+        start_bit, end_bit = 0, None
+        if isinstance(field, obj.BitField):
+            start_bit, end_bit = field.start_bit, field.end_bit
+            field = field._proxy
+
+        if not isinstance(field, obj.NativeType) or field.value is not None:
+            raise ValueError("Unable to decode _POOL_HEADER.%s" % name)
+
+        return field.obj_offset, field.format_string, start_bit, end_bit
+
+
+class CheckPoolSize(PoolHeaderCheck):
     """ Check pool block size """
+    fields = ["BlockSize"]
+
     def __init__(self, condition=None, min_size=None, **kwargs):
         super(CheckPoolSize, self).__init__(**kwargs)
         self.condition = condition
@@ -220,59 +273,313 @@ class CheckPoolSize(scan.ScannerCheck):
         if self.condition is None:
             raise RuntimeError("No pool size provided")
 
-    def check(self, buffer_as, offset):
-        pool_hdr = self.profile._POOL_HEADER(
-            vm=buffer_as, offset=offset)
-
-        block_size = pool_hdr.BlockSize.v()
-
+    def check_fields(self, block_size):
         return self.condition(block_size * self.pool_align)
 
 
-class CheckPoolType(scan.ScannerCheck):
+class CheckPoolType(PoolHeaderCheck):
     """ Check the pool type """
+    fields = ["PoolType"]
+
     def __init__(self, paged=False, non_paged=False, free=False, **kwargs):
         super(CheckPoolType, self).__init__(**kwargs)
         self.non_paged = non_paged
         self.paged = paged
         self.free = free
 
+        # Maps PoolType values to the result of the check. The meaning of the
+        # pool type differs between windows versions, so it is taken from the
+        # profile's _POOL_HEADER.
+        self.results = {}
+
     def check(self, buffer_as, offset):
-        pool_hdr = self.profile._POOL_HEADER(
-            vm=buffer_as, offset=offset)
+        return self.check_header(self.profile._POOL_HEADER(
+            vm=buffer_as, offset=offset))
+
+    def check_header(self, pool_hdr):
+        return bool((self.non_paged and pool_hdr.NonPagedPool) or
+                    (self.free and pool_hdr.FreePool) or
+                    (self.paged and pool_hdr.PagedPool))
+
+    def check_fields(self, pool_type):
+        try:
+            return self.results[pool_type]
+        except KeyError:
+            pass
 
-        return ((self.non_paged and pool_hdr.NonPagedPool) or
-                (self.free and pool_hdr.FreePool) or
-                (self.paged and pool_hdr.PagedPool))
+        # Check a template _POOL_HEADER with this pool type.
+        offset, format_string, start_bit, _ = self.get_field_layout(
+            "PoolType")
+        data = bytearray(self.profile.get_obj_size("_POOL_HEADER"))
+        struct.pack_into(format_string, data, offset, pool_type << start_bit)
 
+        result = self.results[pool_type] = self.check_header(
+            self.profile._POOL_HEADER(vm=addrspace.BufferAddressSpace(
+                data=str(data), session=self.profile.session)))
 
-class CheckPoolIndex(scan.ScannerCheck):
+        return result
+
+
+class CheckPoolIndex(PoolHeaderCheck):
     """ Checks the pool index """
+    fields = ["PoolIndex"]
+
     def __init__(self, value=0, **kwargs):
         super(CheckPoolIndex, self).__init__(**kwargs)
         self.value = value
 
-    def check(self, buffer_as, offset):
-        pool_hdr = self.profile._POOL_HEADER(
-            vm=buffer_as, offset=offset)
-
-        return pool_hdr.PoolIndex == self.value
+    def check_fields(self, pool_index):
+        return pool_index == self.value
 
 
 class PoolScanner(scan.BaseScanner):
-    """A scanner for pool allocations."""
+    """A scanner for pool allocations.
+
+    When the first check is a pool tag check, we first find all the tags in the
+    buffer. The _POOL_HEADER fields needed by the PoolHeaderChecks are then
+    decoded for all these hits at once, and the other checks are only run on
+    the hits which pass.
+    """
 
     # These objects are allocated in the pool allocation.
     allocation = ['_POOL_HEADER']
 
+    # The offsets of the _POOL_HEADERs found by an earlier scan of the entire
+    # address space (e.g. by the poolscan plugin), or None.
+    hits = None
+
+    def build_constraints(self):
+        super(PoolScanner, self).build_constraints()
+
+        self.tag_check = None
+        if self.constraints and isinstance(
+                self.constraints[0], (PoolTagCheck, MultiPoolTagCheck)):
+            self.tag_check = self.constraints[0]
+
+        self.header_checks = []
+        self.other_checks = []
+
+        # Maps field names to (offset, format_string, start_bit, end_bit).
+        self.header_fields = {}
+        for check in self.constraints[1:]:
+            if isinstance(check, PoolHeaderCheck):
+                try:
+                    for field in check.fields:
+                        if field not in self.header_fields:
+                            self.header_fields[field] = check.get_field_layout(
+                                field)
+
+                    self.header_checks.append(check)
+                    continue
+                except ValueError:
+                    pass
+
+            self.other_checks.append(check)
+
+    def scan_buffer(self, buffer_as, chunk_offset, chunk_size):
+        if self.tag_check is None:
+            hits = super(PoolScanner, self).scan_buffer(
+                buffer_as, chunk_offset, chunk_size)
+        else:
+            hits = self.filter_hits(buffer_as, list(
+                self.find_tags(buffer_as, chunk_offset, chunk_size)))
+
+        for hit in hits:
+            yield hit
+
+    def find_tags(self, buffer_as, chunk_offset, chunk_size):
+        """Yields the offsets of the pool headers in the chunk with our tag."""
+        chunk_end = chunk_offset + chunk_size
+        tag_offset = self.tag_check.tag_offset
+
+        if isinstance(self.tag_check, PoolTagCheck):
+            needle = self.tag_check.needle
+            offset = buffer_as.find(needle, chunk_offset + tag_offset)
+            while offset != -1 and offset - tag_offset < chunk_end:
+                yield offset - tag_offset
+                offset = buffer_as.find(needle, offset + 1)
+
+        else:
+            data = buffer_as.data
+            match = self.tag_check.tree.search(
+                data, buffer_as.get_buffer_offset(chunk_offset + tag_offset))
+            while match:
+                hit = buffer_as.base_offset + match[0] - tag_offset
+                if hit >= chunk_end:
+                    break
+
+                yield hit
+                match = self.tag_check.tree.search(data, match[0] + 1)
+
+    def filter_hits(self, buffer_as, hits):
+        """Yields the hits which pass all the checks after the tag check.
+
+        Args:
+          buffer_as: The BufferAddressSpace containing the hits.
+          hits: A list of _POOL_HEADER offsets in increasing order, whose tag
+            has already been checked.
+        """
+        fields = self.decode_fields(buffer_as, hits)
+        for i, hit in enumerate(hits):
+            for check in self.header_checks:
+                values = [fields[x][i] for x in check.fields]
+                if None in values or not check.check_fields(*values):
+                    break
+            else:
+                for check in self.other_checks:
+                    if not check.check(buffer_as, hit):
+                        break
+                else:
+                    yield hit
+
+    def decode_fields(self, buffer_as, hits):
+        """Decodes the header fields for all the hits at once.
+
+        Returns:
+          A dict mapping the field names to a list of values, one for each
+          hit. The value is None if the field is outside the buffer.
+        """
+        positions = [hit - buffer_as.base_offset for hit in hits]
+        result = {}
+        for name, (offset, format_string, start_bit,
+                   end_bit) in self.header_fields.iteritems():
+            if numpy and format_string.lstrip("<=") in ("B", "H", "I", "Q"):
+                result[name] = self._decode_field_numpy(
+                    buffer_as.data, positions, offset,
+                    struct.calcsize(format_string), start_bit, end_bit)
+            else:
+                result[name] = self._decode_field_python(
+                    buffer_as.data, positions, offset, format_string,
+                    start_bit, end_bit)
+
+        return result
+
+    def _decode_field_python(self, data, positions, offset, format_string,
+                             start_bit, end_bit):
+        size = struct.calcsize(format_string)
+        result = []
+        for position in positions:
+            position += offset
+            if position + size > len(data):
+                result.append(None)
+                continue
+
+            value = struct.unpack_from(format_string, data, position)[0]
+            if end_bit is not None:
+                value &= (1 << end_bit) - 1
+
+            result.append(value >> start_bit)
+
+        return result
+
+    def _decode_field_numpy(self, data, positions, offset, size, start_bit,
+                            end_bit):
+        """Decodes an unsigned little endian field for all positions."""
+        array = numpy.frombuffer(data, dtype=numpy.uint8)
+        positions = numpy.array(positions, dtype=numpy.int64) + offset
+
+        # The positions are sorted, so only the last few can be outside the
+        # buffer.
+        readable = positions[positions + size <= len(array)]
+        values = numpy.zeros(len(readable), dtype=numpy.uint64)
+        for i in range(size):
+            values |= (array[readable + i].astype(numpy.uint64) <<
+                       numpy.uint64(8 * i))
+
+        if end_bit is not None and end_bit < 64:
+            values &= numpy.uint64((1 << end_bit) - 1)
+
+        values >>= numpy.uint64(start_bit)
+
+        return values.tolist() + [None] * (len(positions) - len(readable))
+
     def scan(self, offset=0, maxlen=None):
-        """Yields instances of _POOL_HEADER which potentially match."""
+        """Yields instances of _POOL_HEADER which potentially match.
 
-        maxlen = maxlen or self.profile.get_constant("MaxPointer")
-        for hit in super(PoolScanner, self).scan(offset=offset, maxlen=maxlen):
+        If the entire address space was already scanned for this scanner, those
+        hits are used instead of scanning again.
+        """
+        hits = self.hits
+        if hits is None or offset != 0 or maxlen is not None:
+            maxlen = maxlen or self.profile.get_constant("MaxPointer")
+            hits = super(PoolScanner, self).scan(offset=offset, maxlen=maxlen)
+
+        for hit in hits:
             yield self.profile._POOL_HEADER(vm=self.address_space, offset=hit)
 
 
+class PoolScannerGroup(scan.ScannerGroup):
+    """Runs a group of pool scanners in a single pass.
+
+    Rather than each scanner searching for its own pool tag, the tags of all
+    the scanners are searched for at once. The remaining checks of a scanner are
+    then only run where its tag was found. Scanners which do not start with a
+    pool tag check are run over the buffer as usual.
+    """
+
+    def build_constraints(self):
+        super(PoolScannerGroup, self).build_constraints()
+
+        # Maps each pool tag to a list of (name, tag_offset).
+        self.tags = {}
+        self.untagged_scanners = {}
+        self.tree = ahocorasick.KeywordTree()
+        for name, scanner in self.scanners.items():
+            check = getattr(scanner, "tag_check", None)
+            if isinstance(check, PoolTagCheck):
+                tags = [check.needle]
+            elif isinstance(check, MultiPoolTagCheck):
+                tags = set(check.needles)
+            else:
+                self.untagged_scanners[name] = scanner
+                continue
+
+            for tag in tags:
+                if tag not in self.tags:
+                    self.tags[tag] = []
+                    self.tree.add(tag)
+
+                self.tags[tag].append((name, check.tag_offset))
+
+        if self.tags:
+            self.tree.make()
+            self.max_tag_offset = max(
+                x[1] for targets in self.tags.values() for x in targets)
+
+    def scan_buffer(self, buffer_as, chunk_offset, chunk_size):
+        for name, scanner in self.untagged_scanners.items():
+            for hit in scanner.scan_buffer(buffer_as, chunk_offset, chunk_size):
+                yield name, hit
+
+        if not self.tags:
+            return
+
+        # Collect the tag hits in the chunk for each scanner.
+        candidates = dict((name, []) for name in self.scanners)
+        data = buffer_as.data
+        chunk_end = chunk_offset + chunk_size
+        match = self.tree.search(data, 0)
+        while match:
+            start, end = match
+            tag_address = buffer_as.base_offset + start
+            if tag_address - self.max_tag_offset >= chunk_end:
+                break
+
+            for name, tag_offset in self.tags[data[start:end]]:
+                hit = tag_address - tag_offset
+
+                # Hits outside the chunk belong to the neighbouring chunks.
+                if chunk_offset <= hit < chunk_end:
+                    candidates[name].append(hit)
+
+            match = self.tree.search(data, start + 1)
+
+        for name, hits in candidates.iteritems():
+            if hits:
+                for hit in self.scanners[name].filter_hits(buffer_as, hits):
+                    yield name, hit
+
+
 class PoolScannerPlugin(plugin.KernelASMixin, AbstractWindowsCommandPlugin):
     """A base class for all pool scanner plugins."""
     __abstract = True
@@ -300,6 +607,25 @@ class PoolScannerPlugin(plugin.KernelASMixin, AbstractWindowsCommandPlugin):
         else:
             self.address_space = address_space or self.physical_address_space
 
+        # Maps PoolScanner class names to the hits the poolscan plugin found
+        # for them while it renders this plugin.
+        self.pool_scan_hits = {}
+
+    def pool_scanners(self):
+        """Returns the list of PoolScanner instances this plugin uses.
+
+        The poolscan plugin scans for the scanners of several plugins at once.
+        """
+        return []
+
+    def get_pool_scanners(self):
+        """Returns our pool scanners, with any hits we were given."""
+        scanners = self.pool_scanners()
+        for scanner in scanners:
+            scanner.hits = self.pool_scan_hits.get(scanner.__class__.__name__)
+
+        return scanners
+
 
 class KDBGHook(kb.ParameterHook):
     """A Hook to calculate the KDBG when needed."""
@@ -421,8 +747,14 @@ class WindowsCommandPlugin(KDBGMixin, AbstractWindowsCommandPlugin):
     __abstract = True
 
 
-class WinProcessFilter(WindowsCommandPlugin):
-    """A class for filtering processes."""
+class WinProcessFilter(plugin.ParallelRenderMixIn, WindowsCommandPlugin):
+    """A class for filtering processes.
+
+    Plugins which render each process independently can implement
+    render_item(renderer, task) and call
+    self.render_items(renderer, self.filter_processes()) so the processes may
+    be rendered in parallel (see the process_workers parameter).
+    """
 
     __abstract = True
 
@@ -0,0 +1,164 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the pool scanner."""
+import random
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import constants
+from rekall import obj
+from rekall import session
+from rekall.plugins.overlays.windows import common as overlays_common
+from rekall.plugins.overlays.windows import win7
+from rekall.plugins.windows import common
+
+
+class PoolScanTag(common.PoolScanner):
+    checks = [('PoolTagCheck', dict(tag="Test")),
+              ('CheckPoolSize', dict(min_size=0x40)),
+              ('CheckPoolType', dict(non_paged=True, free=True)),
+              ('CheckPoolIndex', dict(value=0)),
+              ]
+
+
+class PagedPoolScanTag(common.PoolScanner):
+    checks = [('PoolTagCheck', dict(tag="Test")),
+              ('CheckPoolType', dict(paged=True)),
+              ]
+
+
+def BuildProfile(session, pool_header=overlays_common._POOL_HEADER):
+    profile = obj.Profile.classes["Profile32Bits"](session=session)
+    profile.add_types({
+        '_POOL_HEADER': [8, {
+            'PreviousSize': [0, ['BitField', dict(
+                start_bit=0, end_bit=9, target='unsigned short')]],
+            'PoolIndex': [0, ['BitField', dict(
+                start_bit=9, end_bit=16, target='unsigned short')]],
+            'BlockSize': [2, ['BitField', dict(
+                start_bit=0, end_bit=9, target='unsigned short')]],
+            'PoolType': [2, ['BitField', dict(
+                start_bit=9, end_bit=16, target='unsigned short')]],
+            'PoolTag': [4, ['unsigned long']],
+            }]})
+    profile.add_constants(PoolAlignment=8)
+    profile.add_classes(_POOL_HEADER=pool_header)
+
+    return profile
+
+
+class PoolScannerTest(unittest.TestCase):
+    """Test the PoolScanner prefilter."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.profile = BuildProfile(self.session)
+
+        # Pool headers with random fields at random offsets.
+        rand = random.Random(1)
+        data = "x" * 0x10000
+        for _ in range(500):
+            offset = rand.randrange(0, len(data) - 8)
+            header = struct.pack(
+                "<HH", rand.randrange(4) << 9,
+                rand.randrange(16) | rand.randrange(4) << 9) + "Test"
+            data = data[:offset] + header + data[offset + 8:]
+
+        self.address_space = addrspace.BufferAddressSpace(
+            data=data, session=self.session)
+
+        self.blocksize = constants.SCAN_BLOCKSIZE
+        constants.SCAN_BLOCKSIZE = 4096
+
+    def tearDown(self):
+        constants.SCAN_BLOCKSIZE = self.blocksize
+
+    def Scan(self, scanner_cls=PoolScanTag):
+        scanner = scanner_cls(address_space=self.address_space,
+                              profile=self.profile, session=self.session)
+        return [x.obj_offset for x in scanner.scan(
+            maxlen=len(self.address_space.data))]
+
+    def testPrefilter(self):
+        # Check every offset using the checks themselves.
+        scanner = PoolScanTag(address_space=self.address_space,
+                              profile=self.profile, session=self.session)
+        scanner.build_constraints()
+        self.assertEqual(len(scanner.header_checks), 3)
+        expected = [x for x in range(len(self.address_space.data))
+                    if scanner.check_addr(x, self.address_space) is not None]
+
+        self.assertTrue(expected)
+        self.assertEqual(self.Scan(), expected)
+
+        # The pure python implementation must find the same hits.
+        numpy = common.numpy
+        try:
+            common.numpy = None
+            self.assertEqual(self.Scan(), expected)
+        finally:
+            common.numpy = numpy
+
+    def testPrecomputedHits(self):
+        expected = self.Scan()
+
+        scanner = PoolScanTag(address_space=self.address_space,
+                              profile=self.profile, session=self.session)
+        scanner.hits = expected[:2]
+        self.assertEqual([x.obj_offset for x in scanner.scan()], expected[:2])
+
+        # The hits are only used for a scan of the entire address space.
+        self.assertEqual([x.obj_offset for x in scanner.scan(
+            maxlen=len(self.address_space.data))], expected)
+
+        # Other scanners are not affected.
+        self.assertEqual(self.Scan(), expected)
+
+    def CheckPoolTypes(self, expected_parity):
+        scanner = PagedPoolScanTag(address_space=self.address_space,
+                                   profile=self.profile, session=self.session)
+        scanner.build_constraints()
+        self.assertEqual(len(scanner.header_checks), 1)
+
+        hits = self.Scan(PagedPoolScanTag)
+        self.assertTrue(hits)
+        self.assertEqual(hits, [
+            x for x in range(len(self.address_space.data))
+            if scanner.check_addr(x, self.address_space) is not None])
+
+        for hit in hits:
+            pool_type = self.profile._POOL_HEADER(
+                vm=self.address_space, offset=hit).PoolType.v()
+            self.assertTrue(pool_type > 0)
+            self.assertEqual(pool_type % 2, expected_parity)
+
+    def testPoolTypeXP(self):
+        # On XP paged pool types are even.
+        self.CheckPoolTypes(0)
+
+    def testPoolTypeWin7(self):
+        # On Win7 paged pool types are odd.
+        self.profile = BuildProfile(self.session, win7._POOL_HEADER)
+        self.CheckPoolTypes(1)
+
+
+if __name__ == "__main__":
+    unittest.main()
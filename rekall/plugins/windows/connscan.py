@@ -53,16 +53,18 @@ class ConnScan(tcpip_vtypes.TcpipPluginMixin,
         return (super(ConnScan, cls).is_active(session) and
                 session.profile.metadata("major") == "5")
 
+    def pool_scanners(self):
+        return [PoolScanConnFast(
+            session=self.session, profile=self.tcpip_profile,
+            address_space=self.address_space)]
+
     def generate_hits(self):
         """Search the physical address space for _TCPT_OBJECTs.
 
         Yields:
           _TCPT_OBJECT instantiated on the physical address space.
         """
-        scanner = PoolScanConnFast(
-            session=self.session, profile=self.tcpip_profile,
-            address_space=self.address_space)
-
+        [scanner] = self.get_pool_scanners()
         for pool_obj in scanner.scan():
             # The struct is allocated out of the pool (i.e. its not an object).
             yield self.tcpip_profile._TCPT_OBJECT(
@@ -58,11 +58,16 @@ class FileScan(common.PoolScannerPlugin):
 
     allocation = ['_POOL_HEADER', '_OBJECT_HEADER', '_FILE_OBJECT']
 
+    # The PoolScanner we use to find the objects.
+    scanner_class = PoolScanFile
+
+    def pool_scanners(self):
+        return [self.scanner_class(profile=self.profile, session=self.session,
+                                   address_space=self.address_space)]
+
     def generate_hits(self):
         """Generate possible hits."""
-        scanner = PoolScanFile(profile=self.profile, session=self.session,
-                               address_space=self.address_space)
-
+        [scanner] = self.get_pool_scanners()
         for pool_obj in scanner.scan():
             object_obj = pool_obj.get_object("_OBJECT_HEADER", self.allocation)
 
@@ -139,12 +144,11 @@ class DriverScan(FileScan):
     allocation = ['_POOL_HEADER', '_OBJECT_HEADER', '_DRIVER_OBJECT',
                   '_DRIVER_EXTENSION']
 
+    scanner_class = PoolScanDriver
+
     def generate_hits(self):
         """Generate possible hits."""
-        scanner = PoolScanDriver(session=self.session,
-                                 profile=self.profile,
-                                 address_space=self.address_space)
-
+        [scanner] = self.get_pool_scanners()
         for pool_obj in scanner.scan():
             object_obj = pool_obj.get_object("_OBJECT_HEADER", self.allocation)
             if object_obj.get_object_type(
@@ -209,10 +213,11 @@ class SymLinkScan(FileScan):
 
     allocation = ['_POOL_HEADER', '_OBJECT_HEADER', '_OBJECT_SYMBOLIC_LINK']
 
+    scanner_class = PoolScanSymlink
+
     def generate_hits(self):
         """Generate possible hits."""
-        scanner = PoolScanSymlink(profile=self.profile, session=self.session,
-                                  address_space=self.address_space)
+        [scanner] = self.get_pool_scanners()
         for pool_obj in scanner.scan():
             object_obj = pool_obj.get_object("_OBJECT_HEADER", self.allocation)
             if object_obj.get_object_type(
@@ -273,6 +278,8 @@ class MutantScan(FileScan):
 
     allocation = ['_POOL_HEADER', '_OBJECT_HEADER', '_KMUTANT']
 
+    scanner_class = PoolScanMutant
+
     def __init__(self, silent=False, **kwargs):
         """Scan for mutant objects _KMUTANT.
 
@@ -283,9 +290,7 @@ class MutantScan(FileScan):
         self.silent = silent
 
     def generate_hits(self):
-        scanner = PoolScanMutant(profile=self.profile, session=self.session,
-                                 address_space=self.address_space)
-
+        [scanner] = self.get_pool_scanners()
         for pool_obj in scanner.scan():
             object_obj = pool_obj.get_object("_OBJECT_HEADER", self.allocation)
             if object_obj.get_object_type(
@@ -406,13 +411,15 @@ class PSScan(common.KDBGMixin, common.PoolScannerPlugin):
 
     __name = "psscan"
 
+    def pool_scanners(self):
+        return [PoolScanProcess(session=self.session,
+                                profile=self.profile,
+                                address_space=self.address_space)]
+
     def scan_processes(self):
         """Generate possible hits."""
         # Just grab the AS and scan it using our scanner
-        scanner = PoolScanProcess(session=self.session,
-                                  profile=self.profile,
-                                  address_space=self.address_space)
-
+        [scanner] = self.get_pool_scanners()
         return scanner.scan()
 
     def render(self, renderer):
@@ -102,24 +102,26 @@ class Handles(common.WinProcessFilter):
                                ("Details", "details", "")
                                ])
 
-        for task in self.filter_processes():
-            for count, (handle, object_type, name) in enumerate(
-                self.enumerate_handles(task)):
+        self.render_items(renderer, self.filter_processes())
 
-                self.session.report_progress("%s: %s handles" % (
-                        task.ImageFileName, count))
+    def render_item(self, renderer, task):
+        for count, (handle, object_type, name) in enumerate(
+            self.enumerate_handles(task)):
 
-                if self.object_list and object_type not in self.object_list:
+            self.session.report_progress("%s: %s handles" % (
+                    task.ImageFileName, count))
+
+            if self.object_list and object_type not in self.object_list:
+                continue
+
+            if self.silent:
+                if len(utils.SmartUnicode(name).replace("'", "")) == 0:
                     continue
 
-                if self.silent:
-                    if len(utils.SmartUnicode(name).replace("'", "")) == 0:
-                        continue
-
-                offset = handle.Body.obj_offset
-                renderer.table_row(
-                    offset,
-                    task.UniqueProcessId,
-                    handle.HandleValue,
-                    handle.GrantedAccess,
-                    object_type, name)
+            offset = handle.Body.obj_offset
+            renderer.table_row(
+                offset,
+                task.UniqueProcessId,
+                handle.HandleValue,
+                handle.GrantedAccess,
+                object_type, name)
@@ -312,36 +312,37 @@ class ImpScan(common.WinProcessFilter):
 
             yield iat, func_pointer, module, func_name
 
-    def render(self, renderer):
-        table_header = [("IAT", 'iat', "[addrpad]"),
-                        ("Call", 'call', "[addrpad]"),
-                        ("Module", 'moduole', "20"),
-                        ("Function", 'function', ""),
-                        ]
+    TABLE_HEADER = [("IAT", 'iat', "[addrpad]"),
+                    ("Call", 'call', "[addrpad]"),
+                    ("Module", 'moduole', "20"),
+                    ("Function", 'function', ""),
+                    ]
 
+    def render(self, renderer):
         if self.idc:
             renderer = IDCRenderer(renderer)
 
         if self.kernel:
             renderer.format("Kernel Imports\n")
 
-            renderer.table_header(table_header)
+            renderer.table_header(self.TABLE_HEADER)
             for iat, func, mod, func_name in self.find_kernel_import():
                 mod_name, func_name = self._original_import(
                     mod.BaseDllName, func_name)
 
                 renderer.table_row(iat, func, mod_name, func_name)
         else:
-            for task in self.filter_processes():
-                renderer.section()
-                renderer.format("Process {0} PID {1}\n", task.ImageFileName,
-                                task.UniqueProcessId)
-                renderer.table_header(table_header)
-
-                for iat, func, mod, func_name in self.find_process_imports(
-                    task):
-                    mod_name, func_name = self._original_import(
-                        mod.BaseDllName, func_name)
-                    renderer.table_row(iat, func, mod_name, func_name)
+            self.render_items(renderer, self.filter_processes())
 
         renderer.end()
+
+    def render_item(self, renderer, task):
+        renderer.section()
+        renderer.format("Process {0} PID {1}\n", task.ImageFileName,
+                        task.UniqueProcessId)
+        renderer.table_header(self.TABLE_HEADER)
+
+        for iat, func, mod, func_name in self.find_process_imports(task):
+            mod_name, func_name = self._original_import(
+                mod.BaseDllName, func_name)
+            renderer.table_row(iat, func, mod_name, func_name)
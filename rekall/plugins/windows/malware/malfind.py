@@ -88,38 +88,40 @@ class Malfind(common.WinProcessFilter):
         return False
 
     def render(self, renderer):
-        for task in self.filter_processes():
-            task_as = task.get_process_address_space()
-            if not task_as:
-                continue
+        self.render_items(renderer, self.filter_processes())
 
-            for vad in task.RealVadRoot.traverse():
-                self.session.report_progress("Checking %r of pid %s",
-                                             vad, task.UniqueProcessId)
+    def render_item(self, renderer, task):
+        task_as = task.get_process_address_space()
+        if not task_as:
+            return
+
+        for vad in task.RealVadRoot.traverse():
+            self.session.report_progress("Checking %r of pid %s",
+                                         vad, task.UniqueProcessId)
 
-                if self._injection_filter(vad, task_as):
-                    renderer.section()
-                    renderer.format("Process: {0} Pid: {1} Address: {2:#x}\n",
-                                    task.ImageFileName, task.UniqueProcessId,
-                                    vad.Start)
+            if self._injection_filter(vad, task_as):
+                renderer.section()
+                renderer.format("Process: {0} Pid: {1} Address: {2:#x}\n",
+                                task.ImageFileName, task.UniqueProcessId,
+                                vad.Start)
 
-                    renderer.format("Vad Tag: {0} Protection: {1}\n",
-                                    vad.Tag, vad.u.VadFlags.ProtectionEnum)
+                renderer.format("Vad Tag: {0} Protection: {1}\n",
+                                vad.Tag, vad.u.VadFlags.ProtectionEnum)
 
-                    renderer.format("Flags: {0}\n", vad.u.VadFlags)
-                    renderer.format("\n")
+                renderer.format("Flags: {0}\n", vad.u.VadFlags)
+                renderer.format("\n")
 
-                    dumper = self.session.plugins.dump(
-                        address_space=task_as, suppress_headers=True,
-                        offset=vad.Start, rows=4)
-                    dumper.render(renderer)
+                dumper = self.session.plugins.dump(
+                    address_space=task_as, suppress_headers=True,
+                    offset=vad.Start, rows=4)
+                dumper.render(renderer)
 
-                    renderer.format("\n")
+                renderer.format("\n")
 
-                    disassembler = self.session.plugins.dis(
-                        address_space=task_as, suppress_headers=True,
-                        offset=vad.Start, length=0x40)
-                    disassembler.render(renderer)
+                disassembler = self.session.plugins.dis(
+                    address_space=task_as, suppress_headers=True,
+                    offset=vad.Start, length=0x40)
+                disassembler.render(renderer)
 
 
 class LdrModules(common.WinProcessFilter):
@@ -166,44 +168,46 @@ class LdrModules(common.WinProcessFilter):
                                ("MappedPath", "mapped_filename", "")
                                ])
 
-        for task in self.filter_processes():
-            # Build a dictionary for all three PEB lists where the
-            # keys are base address and module objects are the values
-            inloadorder = dict((mod.DllBase.v(), mod)
-                                for mod in task.get_load_modules())
-
-            ininitorder = dict((mod.DllBase.v(), mod)
-                                for mod in task.get_init_modules())
-
-            inmemorder  = dict((mod.DllBase.v(), mod)
-                                for mod in task.get_mem_modules())
-
-            # Build a similar dictionary for the mapped files
-            mapped_files = dict((vad.Start, name)
-                                for vad, name in self.list_mapped_files(task))
-
-            # For each base address with a mapped file, print info on
-            # the other PEB lists to spot discrepancies.
-            for base in mapped_files.keys():
-                # Report if the mapped files are in the PEB lists
-                renderer.table_row(task.UniqueProcessId,
-                                   task.ImageFileName,
-                                   base,
-                                   base in inloadorder,
-                                   base in ininitorder,
-                                   base in inmemorder,
-                                   mapped_files[base])
-
-                if self.verbose:
-                    for mod_list, name in ([inloadorder, "Load"],
-                                           [ininitorder, "Init"],
-                                           [inmemorder, "Mem"]):
-
-                        if base in mod_list:
-                            load_mod = mod_list[base]
-                            renderer.format("  {0} Path: {1} : {2}\n",
-                                            name, load_mod.FullDllName,
-                                            load_mod.BaseDllName)
+        self.render_items(renderer, self.filter_processes())
+
+    def render_item(self, renderer, task):
+        # Build a dictionary for all three PEB lists where the
+        # keys are base address and module objects are the values
+        inloadorder = dict((mod.DllBase.v(), mod)
+                            for mod in task.get_load_modules())
+
+        ininitorder = dict((mod.DllBase.v(), mod)
+                            for mod in task.get_init_modules())
+
+        inmemorder  = dict((mod.DllBase.v(), mod)
+                            for mod in task.get_mem_modules())
+
+        # Build a similar dictionary for the mapped files
+        mapped_files = dict((vad.Start, name)
+                            for vad, name in self.list_mapped_files(task))
+
+        # For each base address with a mapped file, print info on
+        # the other PEB lists to spot discrepancies.
+        for base in mapped_files.keys():
+            # Report if the mapped files are in the PEB lists
+            renderer.table_row(task.UniqueProcessId,
+                               task.ImageFileName,
+                               base,
+                               base in inloadorder,
+                               base in ininitorder,
+                               base in inmemorder,
+                               mapped_files[base])
+
+            if self.verbose:
+                for mod_list, name in ([inloadorder, "Load"],
+                                       [ininitorder, "Init"],
+                                       [inmemorder, "Mem"]):
+
+                    if base in mod_list:
+                        load_mod = mod_list[base]
+                        renderer.format("  {0} Path: {1} : {2}\n",
+                                        name, load_mod.FullDllName,
+                                        load_mod.BaseDllName)
 
 
 class TestLdrModules(testlib.SimpleTestCase):
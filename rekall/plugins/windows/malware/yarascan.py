@@ -57,7 +57,8 @@ class BaseYaraASScanner(scan.BaseScanner):
         Yields:
           a tuple of (offset, rule_name, name, value)
         """
-        matches = self.rules.match(data=buffer_as.data)
+        # The yara bindings need a string, not a buffer object.
+        matches = self.rules.match(data=str(buffer_as.data))
         # yara-cpython bindings from pip.
         if type(matches) is dict:
             for source, matches in matches.items():
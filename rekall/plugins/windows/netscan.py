@@ -107,12 +107,16 @@ class WinNetscan(tcpip_vtypes.TcpipPluginMixin,
         return (super(WinNetscan, cls).is_active(session) and
                 session.profile.get_constant('RtlEnumerateEntryHashTable'))
 
-    def generate_hits(self):
-        scanner = PoolScanTcpListener(
-            profile=self.tcpip_profile, session=self.session,
-            address_space=self.address_space)
+    def pool_scanners(self):
+        return [scanner_cls(profile=self.tcpip_profile, session=self.session,
+                            address_space=self.address_space)
+                for scanner_cls in (PoolScanTcpListener, PoolScanTcpEndpoint,
+                                    PoolScanUdpEndpoint)]
 
-        for pool_obj in scanner.scan():
+    def generate_hits(self):
+        (listener_scanner, endpoint_scanner,
+         udp_scanner) = self.get_pool_scanners()
+        for pool_obj in listener_scanner.scan():
             pool_header_end = pool_obj.obj_offset + pool_obj.size()
             tcpentry = self.tcpip_profile._TCP_LISTENER(
                 vm=self.address_space, offset=pool_header_end)
@@ -130,11 +134,7 @@ class WinNetscan(tcpip_vtypes.TcpipPluginMixin,
                        tcpentry.Port, raddr, 0, "LISTENING")
 
         # Scan for TCP endpoints also known as connections
-        scanner = PoolScanTcpEndpoint(
-            profile=self.tcpip_profile, session=self.session,
-            address_space=self.address_space)
-
-        for pool_obj in scanner.scan():
+        for pool_obj in endpoint_scanner.scan():
             pool_header_end = pool_obj.obj_offset + pool_obj.size()
             tcpentry = self.tcpip_profile._TCP_ENDPOINT(
                 vm=self.address_space, offset=pool_header_end)
@@ -163,11 +163,7 @@ class WinNetscan(tcpip_vtypes.TcpipPluginMixin,
                    remote_addr, tcpentry.RemotePort, tcpentry.State)
 
         # Scan for UDP endpoints
-        scanner = PoolScanUdpEndpoint(
-            profile=self.tcpip_profile, session=self.session,
-            address_space=self.address_space)
-
-        for pool_obj in scanner.scan():
+        for pool_obj in udp_scanner.scan():
             pool_header_end = pool_obj.obj_offset + pool_obj.size()
             udpentry = self.tcpip_profile._UDP_ENDPOINT(
                 vm=self.address_space, offset=pool_header_end)
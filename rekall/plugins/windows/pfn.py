@@ -26,13 +26,25 @@
 
 # pylint: disable=protected-access
 
+import array
+import base64
+import struct
+import zlib
+
+from rekall import addrspace
 from rekall import config
+from rekall import kb
 from rekall import testlib
 from rekall import obj
 from rekall import plugin
+from rekall import utils
 from rekall.plugins.windows import common
 from rekall.plugins.overlays import basic
 
+
+numpy = utils.ConditionalImport("numpy")
+
+
 class ValueEnumeration(basic.Enumeration):
     """An enumeration which receives its value from a callable."""
 
@@ -88,6 +100,215 @@ class PFNModification(obj.ProfileModification):
                 })
 
 
+class PFNDatabaseIndex(object):
+    """An index of the fields of every _MMPFN record which ptov needs.
+
+    Walking the PFN database with _MMPFN objects is slow, since every field
+    access instantiates several objects. The index reads the database once and
+    keeps, for each page frame, the frame of the page table which maps it
+    (u4.PteFrame), the offset of the PTE in that page (PteAddress & 0xFFF) and
+    its page location (u3.e1.PageLocation) in arrays. ptov queries are then
+    answered with a few array lookups.
+
+    Frame numbers are kept in 32 bits, which covers 16TB of physical memory.
+    """
+
+    VERSION = 1
+
+    PAGE_BITS = 12
+
+    # The PageLocation of pages in use (see PFNModification).
+    ACTIVE_AND_VALID = 6
+
+    # The number of records read from the database at once.
+    RECORDS_PER_READ = 0x4000
+
+    # The fields we index: (_MMPFN field, attribute holding the values, array
+    # typecode, mask of the value).
+    FIELDS = [("u4.PteFrame", "pte_frames", "I", 0xFFFFFFFF),
+              ("PteAddress", "pte_offsets", "H", 0xFFF),
+              ("u3.e1.PageLocation", "types", "B", 0xFF)]
+
+    def __init__(self):
+        for _, attribute, typecode, _ in self.FIELDS:
+            setattr(self, attribute, array.array(typecode))
+
+        # Where the database was read from.
+        self.database_offset = 0
+
+    def __len__(self):
+        return len(self.types)
+
+    @classmethod
+    def build(cls, profile, address_space, offset, count, session=None):
+        """Reads the PFN database into a new index.
+
+        Args:
+          profile: The profile defining _MMPFN.
+          address_space: The (kernel) address space the database is in.
+          offset: The address of the database.
+          count: The number of page frames to index.
+          session: If provided, progress is reported to it.
+        """
+        result = cls()
+        result.database_offset = offset
+
+        record_size = profile.get_obj_size("_MMPFN")
+        layouts = [(cls._get_field_layout(profile, field), attribute, mask)
+                   for field, attribute, _, mask in cls.FIELDS]
+
+        for pfn in xrange(0, count, cls.RECORDS_PER_READ):
+            if session:
+                session.report_progress(
+                    "Indexing PFN database: %s frames of %s", pfn, count)
+
+            records = min(cls.RECORDS_PER_READ, count - pfn)
+            data = address_space.read(
+                offset + pfn * record_size, records * record_size).ljust(
+                    records * record_size, "\x00")
+
+            for layout, attribute, mask in layouts:
+                if numpy:
+                    values = cls._decode_field_numpy(
+                        data, records, record_size, mask, *layout)
+                else:
+                    values = cls._decode_field_python(
+                        data, records, record_size, mask, *layout)
+
+                getattr(result, attribute).extend(values)
+
+        return result
+
+    @classmethod
+    def _get_field_layout(cls, profile, name):
+        """Returns (offset, format_string, start_bit, end_bit) of a field.
+
+        Raises:
+          ValueError if the field is not an integer, pointer or bit field.
+        """
+        field = profile._MMPFN(vm=addrspace.BufferAddressSpace(
+            data="\x00" * profile.get_obj_size("_MMPFN"),
+            session=profile.session))
+
+        for member in name.split("."):
+            field = field.m(member)
+
+        start_bit, end_bit = 0, None
+        if isinstance(field, obj.BitField):
+            start_bit, end_bit = field.start_bit, field.end_bit
+            field = field._proxy
+
+        elif isinstance(field, obj.Pointer):
+            field = field._proxy
+
+        if not isinstance(field, obj.NativeType) or field.value is not None:
+            raise ValueError("Unable to decode _MMPFN.%s" % name)
+
+        return field.obj_offset, field.format_string, start_bit, end_bit
+
+    @staticmethod
+    def _decode_field_python(data, count, record_size, mask, offset,
+                             format_string, start_bit, end_bit):
+        unpacker = struct.Struct(format_string)
+        if end_bit is not None:
+            mask &= (1 << (end_bit - start_bit)) - 1
+
+        return [(unpacker.unpack_from(data, i * record_size + offset)[0]
+                 >> start_bit) & mask
+                for i in xrange(count)]
+
+    @staticmethod
+    def _decode_field_numpy(data, count, record_size, mask, offset,
+                            format_string, start_bit, end_bit):
+        size = struct.calcsize(format_string)
+        values = numpy.ndarray(
+            shape=(count,), dtype="<u%d" % size, buffer=data, offset=offset,
+            strides=(record_size,)).astype(numpy.uint64)
+
+        if end_bit is not None:
+            mask &= (1 << (end_bit - start_bit)) - 1
+
+        return ((values >> numpy.uint64(start_bit)) &
+                numpy.uint64(mask)).tolist()
+
+    def ptov(self, physical_address, levels):
+        """Converts the physical address to a virtual address.
+
+        Args:
+          physical_address: The physical address to convert.
+          levels: A list of (name, shift, mask, error) for each paging
+            structure, from the PTE up (see PtoV).
+
+        Returns:
+          The same as PtoV.ptov().
+        """
+        result = physical_address & 0xFFF
+        frame = physical_address >> self.PAGE_BITS
+        structures = []
+
+        for name, shift, mask, error in levels:
+            if (frame >= len(self.types) or
+                    self.types[frame] != self.ACTIVE_AND_VALID):
+                return obj.NoneObject(error), []
+
+            containing_page = self.pte_frames[frame]
+            address = ((containing_page << self.PAGE_BITS) |
+                       self.pte_offsets[frame])
+
+            result |= (address << shift) & mask
+            structures.append((name, address))
+            frame = containing_page
+
+        # The top level table maps itself, so this is the DTB.
+        if frame >= len(self.types):
+            return obj.NoneObject("DTB invalid."), []
+
+        structures.append(("DTB", self.pte_frames[frame] << self.PAGE_BITS))
+        structures.reverse()
+
+        return result, structures
+
+    def to_primitive(self):
+        """Returns a JSON serializable representation of the index."""
+        result = dict(version=self.VERSION,
+                      database_offset=self.database_offset)
+
+        for _, attribute, typecode, _ in self.FIELDS:
+            values = getattr(self, attribute)
+            result[attribute] = [typecode, values.itemsize, base64.b64encode(
+                zlib.compress(values.tostring()))]
+
+        return result
+
+    @classmethod
+    def from_primitive(cls, data):
+        """Recreates the index from to_primitive()'s output, or None."""
+        if not data or data.get("version") != cls.VERSION:
+            return None
+
+        result = cls()
+        result.database_offset = data["database_offset"]
+        for _, attribute, _, _ in cls.FIELDS:
+            typecode, itemsize, values = data[attribute]
+            array_obj = array.array(str(typecode))
+            if array_obj.itemsize != itemsize:
+                return None
+
+            array_obj.fromstring(zlib.decompress(base64.b64decode(values)))
+            setattr(result, attribute, array_obj)
+
+        return result
+
+
+class PFNIndexHook(kb.ParameterHook):
+    """Builds (or loads from the persistent cache) the PFN database index."""
+
+    name = "pfn_index"
+
+    def calculate(self):
+        return self.session.plugins.pfn(session=self.session).get_index()
+
+
 class VtoP(plugin.KernelASMixin, plugin.ProfileCommand):
     """Prints information about the virtual to physical translation."""
 
@@ -311,6 +532,33 @@ class PFNInfo(common.WindowsCommandPlugin):
         # Return the pfn record.
         return self.pfn_database[pfn]
 
+    def get_index(self):
+        """Returns a PFNDatabaseIndex of the whole database.
+
+        Use the session's pfn_index parameter instead, so the index is only
+        built once per session.
+        """
+        database_offset = self.pfn_database.obj_offset
+        key = "pfn_index/%#x" % self.kernel_address_space.dtb
+
+        index = PFNDatabaseIndex.from_primitive(
+            self.session.persistent_cache.Get(key))
+
+        if index is None or index.database_offset != database_offset:
+            # The database has a record for every physical page.
+            highest_address = 0
+            for start, _, length in (
+                    self.physical_address_space.get_available_addresses()):
+                highest_address = max(highest_address, start + length)
+
+            index = PFNDatabaseIndex.build(
+                self.profile, self.kernel_address_space, database_offset,
+                highest_address / self.PAGE_SIZE, session=self.session)
+
+            self.session.persistent_cache.Put(key, index.to_primitive())
+
+        return index
+
     def render(self, renderer):
         pfn = self.pfn
         if self.physical_address is not None:
@@ -391,14 +639,44 @@ class PtoV(common.WinProcessFilter):
     PAGE_SIZE = 0x1000
     PAGE_BITS = 12
 
-    def __init__(self, physical_address=None, **kwargs):
-        """Converts a physical address to a virtual address."""
+    # The paging structures for each memory model, from the PTE up. Each is
+    # (name, shift, mask, error): The virtual address bits are recovered by
+    # shifting the address of the paging structure entry.
+    LEVELS_X86 = [
+        ("PTE", 10, 0x3FF000, "PTE invalid."),
+        ("PDE", 20, 0xffc00000, "PDE invalid (Is this a large page?)."),
+        ]
+
+    LEVELS_X86_PAE = [
+        ("PTE", 9, 0x1FF000, "PTE invalid."),
+        ("PDE", 18, 0x3fe00000, "PDE invalid (Is this a large page?)."),
+        ("PDPTE", 27, 0x7FC0000000,
+         "PDPTE invalid (Is this a one gig page?)."),
+        ]
+
+    LEVELS_X64 = LEVELS_X86_PAE + [
+        ("PML4E", 36, 0xff8000000000, "PML4E invalid."),
+        ]
+
+    def __init__(self, physical_address=None, use_index=False, **kwargs):
+        """Converts a physical address to a virtual address.
+
+        Args:
+          physical_address: The physical address to convert.
+          use_index: If set, use the session's pfn_index rather than reading
+            _MMPFN records. Building the index reads the whole PFN database,
+            so this is only worth it when converting many addresses.
+        """
         super(PtoV, self).__init__(**kwargs)
 
         # Get a handle to the pfninfo plugin
         self.pfn_plugin = self.session.plugins.pfn(session=self.session)
         self.physical_address = physical_address
 
+        self.pfn_index = None
+        if use_index:
+            self.pfn_index = self.session.GetParameter("pfn_index")
+
     def _ptov_x86(self, physical_address):
         """An implementation of ptov for x86."""
         result = physical_address & 0xFFF
@@ -557,8 +835,17 @@ class PtoV(common.WinProcessFilter):
         """Convert the physical address to a virtual address.
 
         Returns:
-          a tuple (_EPROCESS of owning process, virtual address in process AS).
+          a tuple (virtual address, paging structures). The paging structures
+          are a list of (name, physical address), starting with the DTB of the
+          owning address space.
         """
+        if self.pfn_index:
+            levels = self.get_levels()
+            if levels is None:
+                return obj.NoneObject("Memory model not supported."), []
+
+            return self.pfn_index.ptov(physical_address, levels)
+
         if self.kernel_address_space.metadata("arch") == "I386":
             if self.kernel_address_space.metadata("pae"):
                 return self._ptov_x86_pae(physical_address)
@@ -569,6 +856,17 @@ class PtoV(common.WinProcessFilter):
 
         return obj.NoneObject("Memory model not supported."), []
 
+    def get_levels(self):
+        """Returns the paging structures of the kernel's memory model."""
+        if self.kernel_address_space.metadata("arch") == "I386":
+            if self.kernel_address_space.metadata("pae"):
+                return self.LEVELS_X86_PAE
+
+            return self.LEVELS_X86
+
+        elif self.kernel_address_space.metadata("arch") == "AMD64":
+            return self.LEVELS_X64
+
     def render(self, renderer):
         if self.physical_address is None:
             return
@@ -586,6 +884,102 @@ class PtoV(common.WinProcessFilter):
                             "{1!r}\n", self.physical_address, result)
 
 
+class DTBCandidateVerifier(object):
+    """Checks which pages of physical memory are DTBs mapping an address.
+
+    A page is a DTB of the kernel if walking its page tables for a known kernel
+    address leads to the physical address of that address. The top level entry
+    mapping the address is at the same offset in every candidate page, so we
+    read large chunks of physical memory and decode this entry for all the
+    pages at once. Only pages whose entry is present need to be walked further.
+
+    The rest of the walk only depends on the top level entry, and the real DTBs
+    all share the same entry for a kernel address. The result of each distinct
+    entry is therefore remembered, and the walk itself goes through a single
+    address space (whose page table cache serves all the candidates).
+    """
+
+    # The amount of physical memory read at once.
+    CHUNK_SIZE = 16 * 1024 * 1024
+
+    # The number of distinct top level entries whose walk we remember.
+    WALK_CACHE_SIZE = 10000
+
+    def __init__(self, address_space=None, virtual_address=None,
+                 physical_address=None, session=None):
+        """Create the verifier.
+
+        Args:
+          address_space: A paged address space of the correct memory model
+            (usually the kernel address space). Its DTB is not used.
+          virtual_address: The virtual address the DTBs must map.
+          physical_address: The physical address it must map to.
+        """
+        self.address_space = address_space
+        self.session = session
+        self.virtual_address = virtual_address & ~0xFFF
+        self.physical_address = physical_address - (virtual_address & 0xFFF)
+        self.entry_offset, self.entry_format = (
+            address_space.top_entry_layout(self.virtual_address))
+        self.entry_size = struct.calcsize(self.entry_format)
+        self._walks = utils.FastStore(max_size=self.WALK_CACHE_SIZE)
+
+    def check_entry(self, entry):
+        """Does the top level entry map the address correctly?"""
+        try:
+            return self._walks.Get(entry)
+        except KeyError:
+            result = self.address_space.page_walk_from(
+                self.virtual_address, entry) == self.physical_address
+            self._walks.Put(entry, result)
+
+            return result
+
+    def verify(self, physical_address_space, start, length, step=0x1000):
+        """Yields the candidate DTBs in the range which pass.
+
+        Every step bytes from start is a candidate.
+        """
+        chunk_size = self.CHUNK_SIZE - self.CHUNK_SIZE % step
+        end = start + length
+        for chunk_start in xrange(start, end, chunk_size):
+            if self.session:
+                self.session.report_progress(
+                    "Checking DTBs at %#x (%smb)", chunk_start,
+                    chunk_start / 1024 / 1024)
+
+            count = min(chunk_size, end - chunk_start) / step
+            data = physical_address_space.read(
+                chunk_start, count * step).ljust(count * step, "\x00")
+
+            if numpy:
+                candidates = self._get_candidates_numpy(data, count, step)
+            else:
+                candidates = self._get_candidates_python(data, count, step)
+
+            for i, entry in candidates:
+                if self.check_entry(entry):
+                    yield chunk_start + i * step
+
+    def _get_candidates_python(self, data, count, step):
+        """Yields (index, entry) for candidates whose entry is present."""
+        unpacker = struct.Struct("<" + self.entry_format)
+        for i in xrange(count):
+            entry = unpacker.unpack_from(data, i * step + self.entry_offset)[0]
+            if self.address_space.entry_present(entry):
+                yield i, entry
+
+    def _get_candidates_numpy(self, data, count, step):
+        entries = numpy.ndarray(
+            shape=(count,), dtype="<u%d" % self.entry_size, buffer=data,
+            offset=self.entry_offset, strides=(step,))
+
+        indexes = numpy.flatnonzero(
+            self.address_space.entries_present(entries))
+
+        return zip(indexes.tolist(), entries[indexes].tolist())
+
+
 class DTBScan2(common.WindowsCommandPlugin):
     """A Fast scanner for hidden DTBs.
 
@@ -601,6 +995,10 @@ class DTBScan2(common.WindowsCommandPlugin):
         physical_kernel_base = self.kernel_address_space.vtop(kernel_base)
         phys_as = self.physical_address_space
 
+        if physical_kernel_base is None:
+            raise plugin.PluginError("The kernel base %#x is not mapped." %
+                                     kernel_base)
+
         renderer.table_header([("DTB", "dtb", "[addrpad]"),
                                ("Base", "dtb", "[addrpad]"),
                                ("Phys", "dtb", "[addrpad]"),
@@ -609,14 +1007,17 @@ class DTBScan2(common.WindowsCommandPlugin):
         # On 64 bit images DTBs are aligned to page boundaries.
         dtb_step = 0x1000
 
-        for start, _, length in phys_as.get_available_addresses():
-            for page in range(start, start+length, dtb_step):
-                test_as = self.session.kernel_address_space.__class__(
-                    dtb=page, base=phys_as)
+        # The candidates are checked against the raw pages, rather than by
+        # building an address space for each one.
+        verifier = DTBCandidateVerifier(
+            address_space=self.kernel_address_space,
+            virtual_address=kernel_base,
+            physical_address=physical_kernel_base,
+            session=self.session)
 
-                if test_as.vtop(kernel_base) == physical_kernel_base:
-                    renderer.table_row(
-                        page, kernel_base, test_as.vtop(kernel_base))
+        for start, _, length in phys_as.get_available_addresses():
+            for page in verifier.verify(phys_as, start, length, dtb_step):
+                renderer.table_row(page, kernel_base, physical_kernel_base)
 
 
 class DTBScan(common.WinProcessFilter):
@@ -639,7 +1040,9 @@ class DTBScan(common.WinProcessFilter):
         self.limit = limit
 
     def render(self, renderer):
-        ptov = self.session.plugins.ptov(session=self.session)
+        # A limited scan does not need to index the whole PFN database.
+        ptov = self.session.plugins.ptov(
+            session=self.session, use_index=not self.limit)
         pslist = self.session.plugins.pslist(session=self.session)
         pfn_plugin = self.session.plugins.pfn(session=self.session)
 
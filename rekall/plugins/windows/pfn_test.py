@@ -22,8 +22,19 @@
 
 """Tests for the pfn plugins."""
 import json
+import logging
+import os
+import random
+import struct
+import time
+import unittest
 
+from rekall import addrspace
+from rekall import obj
+from rekall import session as rekall_session
 from rekall import testlib
+from rekall.plugins.addrspaces import amd64
+from rekall.plugins.windows import pfn
 
 
 class TestPFN(testlib.RekallBaseUnitTestCase):
@@ -76,3 +87,252 @@ class TestPFN(testlib.RekallBaseUnitTestCase):
 
                         self.assertEqual(vaddr, virtual_address)
                         self.assertEqual(metadata['DTB'], process_space.dtb)
+
+
+class PFNDatabase(object):
+    """Provides the _MMPFN records like the pfn plugin does."""
+
+    PAGE_BITS = 12
+
+    def __init__(self, profile, address_space, count):
+        self.pfn_plugin = self
+        self.database = profile.Object(
+            "Array", target="_MMPFN", offset=0, vm=address_space,
+            count=count)
+
+    def pfn_record(self, pfn):
+        return self.database[pfn]
+
+
+class PFNDatabaseIndexTest(unittest.TestCase):
+    """Test the PFN database index against the _MMPFN records."""
+
+    # The DTB and page table frames of the test database.
+    DTB = 5
+    PAGE_TABLE = 7
+
+    # The number of frames in the database.
+    FRAMES = 0x2000
+
+    def setUp(self):
+        self.session = rekall_session.Session()
+        profile = obj.Profile.classes["Profile32Bits"](session=self.session)
+        profile.add_types({
+            '_MMPTE': [4, {}],
+            '_KDDEBUGGER_DATA64': [8, {}],
+            '_MMPFN': [0x18, {
+                'u1': [0, ['unsigned long']],
+                'PteAddress': [4, ['Pointer', dict(target='_MMPTE')]],
+                'u3': [8, ['_MMPFN_u3']],
+                'u4': [0x14, ['_MMPFN_u4']],
+                }],
+            '_MMPFN_u3': [4, {
+                'e1': [0, ['_MMPFNENTRY']],
+                }],
+            '_MMPFNENTRY': [2, {
+                'PageLocation': [0, ['BitField', dict(
+                    start_bit=0, end_bit=3, target='unsigned short')]],
+                }],
+            '_MMPFN_u4': [4, {
+                'PteFrame': [0, ['BitField', dict(
+                    start_bit=0, end_bit=26, target='unsigned long')]],
+                }],
+            })
+        self.profile = pfn.PFNModification(profile)
+
+        # A non PAE database: Every 3rd frame is mapped by the page table,
+        # the rest hold random junk.
+        rand = random.Random(1)
+        records = []
+        self.expected = {}
+        for frame in range(self.FRAMES):
+            pte_frame, pte_address, location = (
+                rand.randrange(1 << 26), rand.randrange(1 << 32),
+                rand.choice([0, 1, 3, 7]))
+
+            # The page directory maps itself at 0xC0300000.
+            if frame == self.DTB:
+                pte_frame, pte_address, location = self.DTB, 0xC0300C00, 6
+                self.expected[frame] = (0xC0300000, [
+                    ("DTB", 0x5000), ("PDE", 0x5C00), ("PTE", 0x5C00)])
+
+            # The page table maps 0x400000 - 0x800000.
+            elif frame == self.PAGE_TABLE:
+                pte_frame, pte_address, location = self.DTB, 0xC0300004, 6
+                self.expected[frame] = (0xC0001000, [
+                    ("DTB", 0x5000), ("PDE", 0x5C00), ("PTE", 0x5004)])
+
+            elif frame % 3 == 0:
+                pte_frame, pte_address, location = (
+                    self.PAGE_TABLE, 0xC0001000 + (frame % 0x400) * 4, 6)
+                self.expected[frame] = (
+                    0x400000 + (frame % 0x400) * 0x1000, [
+                        ("DTB", 0x5000), ("PDE", 0x5004),
+                        ("PTE", 0x7000 + (frame % 0x400) * 4)])
+
+            # Set some bits outside the bit fields too.
+            records.append(struct.pack(
+                "<IIHH8xI", 0, pte_address, location | 0x40, 0,
+                pte_frame | (1 << 30)))
+
+        self.address_space = addrspace.BufferAddressSpace(
+            data="".join(records), session=self.session)
+        self.objects = PFNDatabase(
+            self.profile, self.address_space, self.FRAMES)
+
+    def BuildIndex(self):
+        return pfn.PFNDatabaseIndex.build(
+            self.profile, self.address_space, 0, self.FRAMES)
+
+    def ObjectPtoV(self, physical_address):
+        return pfn.PtoV._ptov_x86.im_func(self.objects, physical_address)
+
+    def IndexPtoV(self, index, physical_address):
+        return index.ptov(physical_address, pfn.PtoV.LEVELS_X86)
+
+    def CheckIndex(self, index):
+        self.assertEqual(len(index), self.FRAMES)
+        for frame in range(self.FRAMES):
+            address = (frame << 12) | 0x123
+            result, structures = self.IndexPtoV(index, address)
+            if frame in self.expected:
+                virtual_address, expected_structures = self.expected[frame]
+                self.assertEqual(result, virtual_address | 0x123)
+                self.assertEqual(structures, expected_structures)
+            else:
+                self.assertFalse(result)
+
+    def testIndex(self):
+        self.CheckIndex(self.BuildIndex())
+
+        # The pure python decoder must agree with numpy.
+        numpy = pfn.numpy
+        try:
+            pfn.numpy = None
+            self.CheckIndex(self.BuildIndex())
+        finally:
+            pfn.numpy = numpy
+
+    def testSerialization(self):
+        data = json.loads(json.dumps(self.BuildIndex().to_primitive()))
+        self.CheckIndex(pfn.PFNDatabaseIndex.from_primitive(data))
+
+    def testAgreement(self):
+        """Compare the index with the _MMPFN based implementation."""
+        index = self.BuildIndex()
+        for frame in range(self.FRAMES):
+            object_result, object_structures = self.ObjectPtoV(frame << 12)
+            result, structures = self.IndexPtoV(index, frame << 12)
+            if result:
+                self.assertEqual(object_result, result)
+                self.assertEqual(list(object_structures), structures)
+            else:
+                self.assertFalse(object_result)
+
+    @unittest.skipUnless(os.environ.get("REKALL_BENCHMARK"),
+                         "Set REKALL_BENCHMARK to run benchmarks.")
+    def testBenchmark(self):
+        """Reports the speedup of the index over the _MMPFN records."""
+        start = time.time()
+        for frame in range(self.FRAMES):
+            self.ObjectPtoV(frame << 12)
+        object_time = time.time() - start
+
+        start = time.time()
+        index = self.BuildIndex()
+        build_time = time.time() - start
+
+        start = time.time()
+        for frame in range(self.FRAMES):
+            self.IndexPtoV(index, frame << 12)
+        index_time = time.time() - start
+
+        logging.info("ptov of %d frames: _MMPFN %.3f sec, index %.3f sec "
+                     "(built in %.3f sec)", self.FRAMES, object_time,
+                     index_time, build_time)
+
+        self.assertLess(index_time + build_time, object_time)
+
+
+class DTBCandidateVerifierTest(unittest.TestCase):
+    """Test the bulk DTB verification of dtbscan2."""
+
+    KERNEL_BASE = 0xfffff80002a00000
+
+    # Physical memory is 0x100 pages of junk. DTBs (at frames 3 and 0x20) map
+    # the kernel base through frames 4, 5 and 6 to frame 0x10. A decoy DTB at
+    # frame 0x21 has a different PDPT (frame 0x22) which maps nothing.
+    DTBS = [0x3000, 0x20000]
+
+    def setUp(self):
+        self.session = rekall_session.Session()
+
+        rand = random.Random(1)
+        pages = ["".join(struct.pack("<Q", rand.getrandbits(64))
+                         for _ in range(0x200)) for _ in range(0x100)]
+
+        def SetEntry(frame, index, value):
+            pages[frame] = (pages[frame][:index * 8] + struct.pack(
+                "<Q", value) + pages[frame][index * 8 + 8:])
+
+        # Clear the page tables.
+        for frame in (4, 5, 6, 0x22):
+            pages[frame] = "\x00" * 0x1000
+
+        pml4_index = (self.KERNEL_BASE >> 39) & 0x1ff
+        pdpt_index = (self.KERNEL_BASE >> 30) & 0x1ff
+        pd_index = (self.KERNEL_BASE >> 21) & 0x1ff
+        pt_index = (self.KERNEL_BASE >> 12) & 0x1ff
+
+        for dtb in self.DTBS:
+            SetEntry(dtb >> 12, pml4_index, 0x4063)
+        SetEntry(0x21, pml4_index, 0x22063)
+        SetEntry(4, pdpt_index, 0x5063)
+        SetEntry(5, pd_index, 0x6063)
+        SetEntry(6, pt_index, 0x10063)
+
+        self.physical_address_space = addrspace.BufferAddressSpace(
+            data="".join(pages), session=self.session)
+        self.kernel_address_space = amd64.AMD64PagedMemory(
+            base=self.physical_address_space, dtb=self.DTBS[0],
+            session=self.session)
+
+    def Verify(self):
+        verifier = pfn.DTBCandidateVerifier(
+            address_space=self.kernel_address_space,
+            virtual_address=self.KERNEL_BASE,
+            physical_address=0x10000, session=self.session)
+        verifier.CHUNK_SIZE = 0x10000
+
+        return list(verifier.verify(
+            self.physical_address_space, 0,
+            len(self.physical_address_space.data)))
+
+    def testVerify(self):
+        self.assertEqual(self.kernel_address_space.vtop(self.KERNEL_BASE),
+                         0x10000)
+
+        # The same pages are found by building an address space for each
+        # (except page 0, which is taken as the session's DTB).
+        expected = []
+        for page in range(0x1000, len(self.physical_address_space.data),
+                          0x1000):
+            test_as = amd64.AMD64PagedMemory(
+                base=self.physical_address_space, dtb=page,
+                session=self.session)
+            if test_as.vtop(self.KERNEL_BASE) == 0x10000:
+                expected.append(page)
+
+        self.assertEqual(expected, self.DTBS)
+        self.assertEqual(self.Verify(), self.DTBS)
+
+        numpy = pfn.numpy
+        try:
+            pfn.numpy = None
+            self.assertEqual(self.Verify(), self.DTBS)
+        finally:
+            pfn.numpy = numpy
+
+
+if __name__ == "__main__":
+    unittest.main()
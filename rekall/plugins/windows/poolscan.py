@@ -0,0 +1,112 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Run several pool scanning plugins in a single pass over the image.
+
+Each pool scanning plugin (e.g. psscan, filescan) normally reads the entire
+image. The poolscan plugin collects the pool scanners of all the plugins it is
+asked to run and scans for all of them at once. The hits are then given to
+each plugin while it renders, so its scanners do not scan again.
+"""
+
+__author__ = "Michael Cohen <scudette@gmail.com>"
+
+import logging
+
+from rekall import config
+from rekall.plugins.windows import common
+
+
+class PoolScan(common.PoolScannerPlugin):
+    """Runs several pool scanning plugins in a single pass."""
+
+    __name = "poolscan"
+
+    # The plugins we run by default.
+    PLUGINS = ["psscan", "filescan", "driverscan", "mutantscan", "symlinkscan",
+               "connscan", "netscan"]
+
+    @classmethod
+    def args(cls, parser):
+        super(PoolScan, cls).args(parser)
+        parser.add_argument(
+            "--scanners", action=config.ArrayStringParser, nargs="+",
+            help="The pool scanning plugins to run (default: %s)." %
+            ", ".join(cls.PLUGINS))
+
+    def __init__(self, scanners=None, **kwargs):
+        """Runs several pool scanning plugins in a single pass.
+
+        Args:
+          scanners: A list of names of PoolScannerPlugin plugins to run.
+        """
+        super(PoolScan, self).__init__(**kwargs)
+        self.plugin_names = scanners or self.PLUGINS
+
+    def scan_plugins(self):
+        """Scans for all the plugins' pool scanners at once.
+
+        Returns:
+          A tuple of (plugins, hits). Plugins is a list of the plugin instances,
+          and hits maps the names of their scanner classes to the offsets
+          found.
+        """
+        plugins = []
+        scanners = {}
+        for name in self.plugin_names:
+            plugin_cls = getattr(self.session.plugins, name, None)
+            if plugin_cls is None:
+                logging.info("Plugin %s is not active for this image.", name)
+                continue
+
+            plugin = plugin_cls(address_space=self.address_space)
+            if not isinstance(plugin, common.PoolScannerPlugin):
+                logging.error("%s is not a pool scanning plugin.", name)
+                continue
+
+            plugins.append(plugin)
+            for scanner in plugin.pool_scanners():
+                scanners[scanner.__class__.__name__] = scanner
+
+        hits = dict((name, []) for name in scanners)
+        if scanners:
+            group = common.PoolScannerGroup(
+                scanners=scanners, session=self.session, profile=self.profile,
+                address_space=self.address_space)
+
+            for name, hit in group.scan():
+                hits[name].append(hit)
+
+            for name, scanner_hits in hits.iteritems():
+                logging.debug("%s: %s hits", name, len(scanner_hits))
+
+        return plugins, hits
+
+    def render(self, renderer):
+        plugins, hits = self.scan_plugins()
+        for plugin in plugins:
+            renderer.section(plugin.name)
+
+            # The hits are only valid for this run, so the plugin only uses
+            # them while we render it.
+            plugin.pool_scan_hits = hits
+            try:
+                plugin.render(renderer)
+            finally:
+                plugin.pool_scan_hits = {}
@@ -91,30 +91,32 @@ class WinDllList(common.WinProcessFilter):
 
 
     def render(self, renderer):
-        for task in self.filter_processes():
-            pid = task.UniqueProcessId
-
-            renderer.write(u"*" * 72 + "\n")
-            renderer.format(u"{0} pid: {1:6}\n", task.ImageFileName, pid)
-
-            if task.Peb:
-                renderer.format(u"Command line : {0}\n",
-                                task.Peb.ProcessParameters.CommandLine)
-
-                if task.IsWow64:
-                    renderer.write(u"Note: use ldrmodules for listing DLLs "
-                                   "in Wow64 processes\n")
-
-                renderer.format(u"{0}\n", task.Peb.CSDVersion)
-                renderer.write(u"\n")
-                renderer.table_header([("Base", "module_base", "[addrpad]"),
-                                       ("Size", "module_size", "[addr]"),
-                                       ("Path", "loaded_dll_path", ""),
-                                       ])
-                for m in task.get_load_modules():
-                    renderer.table_row(m.DllBase, m.SizeOfImage, m.FullDllName)
-            else:
-                renderer.write("Unable to read PEB for task.\n")
+        self.render_items(renderer, self.filter_processes())
+
+    def render_item(self, renderer, task):
+        pid = task.UniqueProcessId
+
+        renderer.write(u"*" * 72 + "\n")
+        renderer.format(u"{0} pid: {1:6}\n", task.ImageFileName, pid)
+
+        if task.Peb:
+            renderer.format(u"Command line : {0}\n",
+                            task.Peb.ProcessParameters.CommandLine)
+
+            if task.IsWow64:
+                renderer.write(u"Note: use ldrmodules for listing DLLs "
+                               "in Wow64 processes\n")
+
+            renderer.format(u"{0}\n", task.Peb.CSDVersion)
+            renderer.write(u"\n")
+            renderer.table_header([("Base", "module_base", "[addrpad]"),
+                                   ("Size", "module_size", "[addr]"),
+                                   ("Path", "loaded_dll_path", ""),
+                                   ])
+            for m in task.get_load_modules():
+                renderer.table_row(m.DllBase, m.SizeOfImage, m.FullDllName)
+        else:
+            renderer.write("Unable to read PEB for task.\n")
 
 
 class WinMemMap(core.MemmapMixIn, common.WinProcessFilter):
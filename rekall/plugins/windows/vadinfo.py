@@ -43,31 +43,33 @@ class VADInfo(common.WinProcessFilter):
     __name = "vadinfo"
 
     def render(self, renderer):
-        for task in self.filter_processes():
-            renderer.section()
-            renderer.write("Pid: {0:6}\n".format(task.UniqueProcessId))
+        self.render_items(renderer, self.filter_processes())
+
+    def render_item(self, renderer, task):
+        renderer.section()
+        renderer.write("Pid: {0:6}\n".format(task.UniqueProcessId))
 
-            count = 0
-            for count, vad in enumerate(task.RealVadRoot.traverse()):
-                try:
-                    self.write_vad_short(renderer, vad)
-                except AttributeError:
-                    pass
+        count = 0
+        for count, vad in enumerate(task.RealVadRoot.traverse()):
+            try:
+                self.write_vad_short(renderer, vad)
+            except AttributeError:
+                pass
 
-                try:
-                    self.write_vad_control(renderer, vad)
-                except AttributeError:
-                    pass
+            try:
+                self.write_vad_control(renderer, vad)
+            except AttributeError:
+                pass
 
-                try:
-                    self.write_vad_ext(renderer, vad)
-                except AttributeError:
-                    pass
+            try:
+                self.write_vad_ext(renderer, vad)
+            except AttributeError:
+                pass
 
-                renderer.write("\n")
+            renderer.write("\n")
 
-            self.session.report_progress("Pid %s: %s Vads" % (
-                    task.UniqueProcessId, count))
+        self.session.report_progress("Pid %s: %s Vads" % (
+                task.UniqueProcessId, count))
 
     def write_vad_short(self, renderer, vad):
         """Renders a text version of a Short Vad"""
@@ -0,0 +1,125 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Runs a function over many items in a pool of forked worker processes.
+
+The workers inherit the state they need (e.g. a scanner, a plugin or an
+address space) when they are forked, so only the items and the results are
+passed between processes. Each worker reopens the address spaces it reads from
+so it does not share file offsets with its parent.
+"""
+import collections
+import multiprocessing
+
+from rekall import addrspace
+
+
+# The (state, session, address_spaces) of the pool being started. Workers
+# inherit this when they are forked.
+_POOL_STATE = None
+
+# In a worker process this is the state passed to the function.
+_WORKER_STATE = None
+
+# True in a worker process.
+_IN_WORKER = False
+
+
+def InWorker():
+    """Returns True in a worker process.
+
+    Workers never start their own pools.
+    """
+    return _IN_WORKER
+
+
+def _InitWorker():
+    """Prepares a freshly forked worker process."""
+    global _WORKER_STATE, _IN_WORKER  # pylint: disable=global-statement
+
+    _WORKER_STATE, session, address_spaces = _POOL_STATE
+    _IN_WORKER = True
+
+    # Do not share file offsets with the parent process.
+    addrspace.ReopenAddressSpaces(*address_spaces)
+
+    # Progress is reported by the parent process.
+    if session is not None:
+        session.progress = None
+
+
+def _RunInWorker(function, item):
+    return function(_WORKER_STATE, item)
+
+
+def RunInWorkers(function, items, workers, state=None, session=None,
+                 address_spaces=(), items_per_worker=8):
+    """Calls function(state, item) for each item in worker processes.
+
+    Results are yielded in the order of the items, as soon as they (and all
+    those before them) are ready. At most items_per_worker items per worker are
+    in flight, so memory use is bounded however many items there are. Once the
+    caller stops iterating, the remaining work is cancelled by terminating the
+    pool.
+
+    Args:
+      function: A module level function. It is called in a worker with the
+        state and an item, both of which (and its result) must be picklable.
+      items: An iterable of the items. It is consumed while the workers run.
+      workers: The number of worker processes.
+      state: Passed to the function in the workers. It is inherited, so it need
+        not be picklable.
+      session: The workers do not report progress to this session.
+      address_spaces: The address spaces the function reads from. They are
+        reopened in each worker.
+      items_per_worker: How many items each worker may have waiting.
+
+    Yields:
+      Tuples of (item, result).
+    """
+    global _POOL_STATE  # pylint: disable=global-statement
+
+    _POOL_STATE = (state, session, address_spaces)
+    try:
+        pool = multiprocessing.Pool(workers, initializer=_InitWorker)
+    finally:
+        _POOL_STATE = None
+
+    pending = collections.deque()
+    max_pending = workers * items_per_worker
+
+    try:
+        for item in items:
+            pending.append((item, pool.apply_async(
+                _RunInWorker, (function, item))))
+
+            # Yield finished results as soon as possible, but wait if too many
+            # are pending.
+            while pending and (len(pending) >= max_pending or
+                               pending[0][1].ready()):
+                pending_item, result = pending.popleft()
+                yield pending_item, result.get()
+
+        while pending:
+            pending_item, result = pending.popleft()
+            yield pending_item, result.get()
+
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,91 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the process pool."""
+import itertools
+import os
+import unittest
+
+from rekall import addrspace
+from rekall import processpool
+from rekall import session
+
+
+class ReopenedAddressSpace(addrspace.BufferAddressSpace):
+    """Counts how many times it was reopened."""
+
+    reopened = 0
+
+    def reopen(self):
+        self.reopened += 1
+
+
+def _ReadInWorker(address_space, offset):
+    return (address_space.read(offset, 2), os.getpid(),
+            processpool.InWorker(), address_space.reopened,
+            address_space.base.reopened)
+
+
+class ProcessPoolTest(unittest.TestCase):
+    """Test running functions in worker processes."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.base = ReopenedAddressSpace(
+            data="0123456789", session=self.session)
+        self.address_space = ReopenedAddressSpace(
+            data="abcdefghij", base=self.base, session=self.session)
+
+    def testRunInWorkers(self):
+        offsets = range(0, 10, 2) * 3
+        results = list(processpool.RunInWorkers(
+            _ReadInWorker, offsets, 3, state=self.address_space,
+            session=self.session,
+            address_spaces=[self.address_space, self.base],
+            items_per_worker=1))
+
+        # Results are in the order of the items.
+        self.assertEqual([x[0] for x in results], offsets)
+        self.assertEqual([x[1][0] for x in results],
+                         [self.address_space.read(x, 2) for x in offsets])
+
+        for _, (_, pid, in_worker, reopened, base_reopened) in results:
+            self.assertNotEqual(pid, os.getpid())
+            self.assertTrue(in_worker)
+
+            # The stack is reopened once in each worker.
+            self.assertEqual(reopened, 1)
+            self.assertEqual(base_reopened, 1)
+
+        self.assertFalse(processpool.InWorker())
+        self.assertEqual(self.address_space.reopened, 0)
+
+    def testStopEarly(self):
+        # Only a bounded number of items is consumed.
+        results = processpool.RunInWorkers(
+            _ReadInWorker, itertools.count(), 2, state=self.address_space,
+            items_per_worker=2)
+
+        self.assertEqual([x for x, _ in itertools.islice(results, 5)],
+                         range(5))
+        results.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,13 +21,27 @@
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 import ahocorasick
+import logging
+import os
 import re
 
 from rekall import addrspace
+from rekall import config
 from rekall import constants
+from rekall import processpool
 from rekall import registry
 
 
+config.DeclareOption(
+    "--scan_workers", group="Performance",
+    action=config.IntParser,
+    help="The number of processes used to scan the image in parallel.")
+
+
+def _ScanChunkInWorker(scanner, chunk):
+    return list(scanner.scan_chunk(*chunk))
+
+
 class BaseScanner(object):
     """ A more thorough scanner which checks every byte """
 
@@ -110,6 +124,9 @@ class BaseScanner(object):
           maxlen: The maximum length to scan. If no provided we just scan until
             there is no data.
 
+        If the scan_workers parameter is set, the chunks are scanned by a pool
+        of worker processes.
+
         Yields:
           offsets where all the constrainst are satisfied.
         """
@@ -121,17 +138,35 @@ class BaseScanner(object):
         if self.constraints is None:
             self.build_constraints()
 
-        # We try to optimize the scanning by first merging contiguous ranges
-        # and then passing up to constants.SCAN_BLOCKSIZE bytes to the checkers
-        # and skippers.
-        #
-        # If range has less data than the block size, then the full range is
-        # scanned at once.
-        #
-        # If a range is larger than the block size, it's split in chunks until
-        # it's fully consumed. Overlap is applied only in this case, starting
-        # from the second chunk.
+        workers = self.session.GetParameter("scan_workers", 1)
+        if workers > 1 and not processpool.InWorker():
+            if hasattr(os, "fork"):
+                hits = self._scan_chunks_in_parallel(
+                    list(self.generate_chunks(offset, end)), workers)
+            else:
+                logging.warn("Parallel scanning is not supported on this "
+                             "platform.")
+                hits = self._scan_chunks(self.generate_chunks(offset, end))
+        else:
+            hits = self._scan_chunks(self.generate_chunks(offset, end))
+
+        for hit in hits:
+            yield hit
+
+    def generate_chunks(self, offset, end):
+        """Splits the address ranges between offset and end into chunks.
+
+        We try to optimize the scanning by first merging contiguous ranges and
+        then passing up to constants.SCAN_BLOCKSIZE bytes to the checkers and
+        skippers.
+
+        If range has less data than the block size, then the full range is
+        scanned at once. If a range is larger than the block size, it's split
+        in chunks until it's fully consumed.
 
+        Yields:
+          (chunk_offset, phys_chunk_offset, chunk_size) tuples.
+        """
         for (range_start, phys_start,
              length) in self.address_space.get_address_ranges(offset, end):
 
@@ -146,52 +181,84 @@ class BaseScanner(object):
 
             # Calculate where in the range we'll be reading data from.
             # Covers the case where offset falls within a range.
-            start = max(range_start, offset)
-
-            # Store where this chunk will start. Absolute offset.
-            chunk_offset = start
+            chunk_offset = max(range_start, offset)
 
             # Keep scanning this range as long as the current chunk isn't
             # past the end of the range or the end of the scanner.
             while chunk_offset < end and chunk_offset < range_end:
-                if self.session:
-                    self.session.report_progress(
-                        "Scanning 0x%08X with %s" %
-                        (chunk_offset, self.__class__.__name__))
-
-                chunk_offset = max(start, chunk_offset)
-
                 # Our chunk is SCAN_BLOCKSIZE long or as much data there's
-                # left in the range.
+                # left in the range. Adjust chunk_size if the chunk we're gonna
+                # read goes past the end or we could end up scanning more data
+                # than requested.
                 chunk_size = min(constants.SCAN_BLOCKSIZE,
-                                 range_end - chunk_offset)
-
-                # Adjust chunk_size if the chunk we're gonna read goes past
-                # the end or we could end up scanning more data than requested.
-                chunk_size = min(chunk_size, end - chunk_offset)
+                                 range_end - chunk_offset,
+                                 end - chunk_offset)
 
                 phys_chunk_offset = phys_start + (chunk_offset - range_start)
-                # Consume the next block in this range.
-                buffer_as = addrspace.BufferAddressSpace(
-                    session=self.session,
+                yield chunk_offset, phys_chunk_offset, chunk_size
+
+                chunk_offset += chunk_size
+
+    def scan_chunk(self, chunk_offset, phys_chunk_offset, chunk_size):
+        """Yields the hits within a single chunk.
 
-                    data=self.address_space.base.read(
-                        phys_chunk_offset, chunk_size + self.overlap),
+        The data read for the chunk overlaps the next chunk, so that structures
+        starting near the end of the chunk can still be checked.
+        """
+        # Consume the next block in this range. If the physical address space
+        # is able to, this does not copy the data.
+        buffer_as = addrspace.BufferAddressSpace(
+            session=self.session,
+
+            data=self.address_space.base.get_buffer(
+                phys_chunk_offset, chunk_size + self.overlap),
 
-                    base_offset=chunk_offset)
+            base_offset=chunk_offset)
 
-                scan_offset = chunk_offset
-                while scan_offset < chunk_offset + chunk_size:
-                    # Check the current offset for a match.
-                    res = self.check_addr(scan_offset, buffer_as=buffer_as)
-                    if res is not None:
-                        yield res
+        return self.scan_buffer(buffer_as, chunk_offset, chunk_size)
 
-                    # Skip as much data as the skippers tell us to.
-                    scan_offset += min(chunk_size,
-                                       self.skip(buffer_as, scan_offset))
+    def scan_buffer(self, buffer_as, chunk_offset, chunk_size):
+        """Yields the hits between chunk_offset and chunk_offset + chunk_size.
 
-                chunk_offset = scan_offset
+        Args:
+          buffer_as: A BufferAddressSpace holding the data of the chunk.
+          chunk_offset: The offset of the chunk in self.address_space.
+          chunk_size: The length of the chunk to scan.
+        """
+        scan_offset = chunk_offset
+        while scan_offset < chunk_offset + chunk_size:
+            # Check the current offset for a match.
+            res = self.check_addr(scan_offset, buffer_as=buffer_as)
+            if res is not None:
+                yield res
+
+            # Skip as much data as the skippers tell us to.
+            scan_offset += min(chunk_size, self.skip(buffer_as, scan_offset))
+
+    def _scan_chunks(self, chunks):
+        for chunk in chunks:
+            self.session.report_progress(
+                "Scanning 0x%08X with %s" % (chunk[0], self.__class__.__name__))
+
+            for hit in self.scan_chunk(*chunk):
+                yield hit
+
+    def _scan_chunks_in_parallel(self, chunks, workers):
+        """Scans the chunks in a pool of forked worker processes.
+
+        Each worker inherits a copy of this scanner and reopens the image.
+        Hits are returned in address order. Note that hits must be picklable
+        (by default they are just offsets).
+        """
+        for chunk, hits in processpool.RunInWorkers(
+                _ScanChunkInWorker, chunks, workers, state=self,
+                session=self.session, address_spaces=[self.address_space]):
+            self.session.report_progress(
+                "Scanning 0x%08X with %s (%s workers)" % (
+                    chunk[0], self.__class__.__name__, workers))
+
+            for hit in hits:
+                yield hit
 
 
 class PointerScanner(BaseScanner):
@@ -295,6 +362,7 @@ class MultiStringFinderCheck(ScannerCheck):
             self.tree.add(needle)
 
         self.tree.make()
+        self.needles = needles
         self.base_offset = None
         self.next_hit = None
 
@@ -330,15 +398,13 @@ class StringCheck(ScannerCheck):
 
     def check(self, buffer_as, offset):
         # Just check the buffer without needing to copy it on slice.
-        buffer_offset = buffer_as.get_buffer_offset(offset)
-        return buffer_as.data.startswith(self.needle, buffer_offset)
+        return buffer_as.startswith(self.needle, offset)
 
     def skip(self, buffer_as, offset):
         # Search the rest of the buffer for the needle.
-        buffer_offset = buffer_as.get_buffer_offset(offset)
-        dindex = buffer_as.data.find(self.needle, buffer_offset + 1)
-        if dindex > -1:
-            return dindex - buffer_offset
+        index = buffer_as.find(self.needle, offset + 1)
+        if index > -1:
+            return index - offset
 
         # Skip entire region.
         return buffer_as.end() - offset
@@ -360,7 +426,13 @@ class RegexCheck(ScannerCheck):
 
 
 class ScannerGroup(BaseScanner):
-    """Runs a bunch of scanners in one pass over the image."""
+    """Runs a bunch of scanners in one pass over the image.
+
+    Each chunk of the image is only read once, and all the scanners are run over
+    the same buffer. The scan yields (name, hit) tuples, where the hits of each
+    scanner are in address order. Note that the hits are the raw offsets found
+    by each scanner's checks - the scanners' own scan() methods are not called.
+    """
 
     def __init__(self, scanners=None, **kwargs):
         """Create a new scanner group.
@@ -374,38 +446,33 @@ class ScannerGroup(BaseScanner):
         for scanner in scanners.values():
             scanner.address_space = self.address_space
 
+        # The overlap must be large enough for all the scanners.
+        self.overlap = max(
+            [self.overlap] + [x.overlap for x in scanners.values()])
+
         # A dict to hold all hits for each scanner.
         self.result = {}
 
-    def scan(self, offset=0, maxlen=None):
-        available_length = maxlen or self.profile.get_constant("MaxPointer")
-
-        while available_length > 0:
-            to_read = min(constants.SCAN_BLOCKSIZE + self.overlap,
-                          available_length)
-
-            # Now feed all the scanners from the same address space.
-            for name, scanner in self.scanners.items():
-                for hit in scanner.scan(offset=offset, maxlen=to_read):
-                    # Yield the result as well as cache it.
-                    yield name, hit
+    def build_constraints(self):
+        self.constraints = []
+        self.skippers = []
+        for scanner in self.scanners.values():
+            if scanner.constraints is None:
+                scanner.build_constraints()
 
-            # Move to the next scan block.
-            offset += constants.SCAN_BLOCKSIZE
-            available_length -= constants.SCAN_BLOCKSIZE
+    def scan_buffer(self, buffer_as, chunk_offset, chunk_size):
+        """Yields (name, hit) tuples for all the scanners."""
+        for name, scanner in self.scanners.items():
+            for hit in scanner.scan_buffer(buffer_as, chunk_offset, chunk_size):
+                yield name, hit
 
 
 class DiscontigScannerGroup(ScannerGroup):
-    """A scanner group which works over a virtual address space."""
-
-    def scan(self, offset=0, maxlen=None):
-        maxlen = maxlen or self.profile.get_constant("MaxPointer")
+    """A scanner group which works over a virtual address space.
 
-        for (start, pstart, length) in self.address_space.get_address_ranges(
-            offset, offset + maxlen):
-            for match in super(DiscontigScannerGroup, self).scan(
-                start, maxlen=length):
-                yield match
+    Since the ScannerGroup only reads the address ranges which are mapped, this
+    is now the same as the ScannerGroup.
+    """
 
 
 class DebugChecker(ScannerCheck):
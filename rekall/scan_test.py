@@ -0,0 +1,76 @@
+import unittest
+
+from rekall import addrspace
+from rekall import constants
+from rekall import scan
+from rekall import session
+
+
+class NeedleScanner(scan.BaseScanner):
+    checks = [("StringCheck", dict(needle="needle"))]
+
+
+class SuffixScanner(scan.BaseScanner):
+    checks = [("StringCheck", dict(needle="lex"))]
+
+
+class ScannerTest(unittest.TestCase):
+    """Test the BaseScanner implementation."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.data = ("x" * 994 + "needle") * 100
+        self.address_space = addrspace.BufferAddressSpace(
+            data=self.data, session=self.session)
+
+        # Use small chunks so that hits straddle chunk boundaries.
+        self.blocksize = constants.SCAN_BLOCKSIZE
+        constants.SCAN_BLOCKSIZE = 4096
+
+    def tearDown(self):
+        constants.SCAN_BLOCKSIZE = self.blocksize
+
+    def Scan(self):
+        scanner = NeedleScanner(address_space=self.address_space,
+                                profile=object(), session=self.session)
+        return list(scanner.scan(maxlen=len(self.data)))
+
+    def testScan(self):
+        self.assertEqual(self.Scan(), range(994, len(self.data), 1000))
+
+    def testParallelScan(self):
+        expected = self.Scan()
+        self.session.SetParameter("scan_workers", 3)
+        self.assertEqual(self.Scan(), expected)
+
+    def testScannerGroup(self):
+        reads = []
+        get_buffer = self.address_space.get_buffer
+        def CountingGetBuffer(addr, length):
+            reads.append(addr)
+            return get_buffer(addr, length)
+
+        self.address_space.get_buffer = CountingGetBuffer
+
+        group = scan.ScannerGroup(
+            scanners=dict(needle=NeedleScanner(
+                address_space=self.address_space, session=self.session,
+                profile=object()),
+                          suffix=SuffixScanner(
+                address_space=self.address_space, session=self.session,
+                profile=object())),
+            address_space=self.address_space, session=self.session,
+            profile=object())
+
+        hits = list(group.scan(maxlen=len(self.data)))
+        self.assertEqual([x for name, x in hits if name == "needle"],
+                         range(994, len(self.data), 1000))
+        self.assertEqual([x for name, x in hits if name == "suffix"],
+                         range(998, len(self.data) - 1000, 1000))
+
+        # Each chunk is only read once.
+        self.assertEqual(reads, range(0, len(self.data), 4096))
+
+
+if __name__ == "__main__":
+    unittest.main()
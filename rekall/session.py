@@ -26,6 +26,7 @@ way for people to save their own results.
 
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
+import contextlib
 import inspect
 import logging
 import pdb
@@ -34,6 +35,7 @@ import sys
 import time
 
 from rekall import addrspace
+from rekall import cache
 from rekall import config
 from rekall import constants
 from rekall import io_manager
@@ -177,9 +179,27 @@ class Session(object):
     This session contains the bare minimum to use rekall.
     """
 
+    # Parameters which are derived from the image and are expensive to
+    # calculate (e.g. by scanning). These are kept in the persistent cache, so
+    # later sessions on the same image start with them.
+    PERSISTENT_PARAMETERS = set([
+        "profile", "dtb", "kdbg", "PsActiveProcessHead", "PsLoadedModuleList",
+        "kernel_base", "vm_kernel_slide", "kaslr_shift", "tcpip_guid"])
+
+    # The name of the persistent parameters in the persistent cache.
+    PARAMETERS_CACHE_NAME = "session_parameters"
+
     def __init__(self, **kwargs):
         self._parameter_hooks = {}
 
+        # The image whose persistent parameters were restored.
+        self._restored_filename = None
+
+        # Saving the persistent parameters is deferred while this is set (See
+        # DeferParameterSaves()).
+        self._deferred_saves = 0
+        self._unsaved_parameters = False
+
         self.profile = obj.NoneObject("Set this to a valid profile "
                                       "(e.g. type profiles. and tab).")
 
@@ -190,6 +210,12 @@ class Session(object):
 
         self.entities = entity.EntityCache(session=self)
 
+        # Data derived from the image which is kept between sessions.
+        self.persistent_cache = cache.PersistentCache(session=self)
+
+        # Data read by all the address spaces is cached here.
+        self.page_cache = addrspace.PageCache(session=self)
+
         # Store user configurable attributes here. These will be read/written to
         # the configuration file.
         self.state = Configuration(self, cache=Cache(), **kwargs)
@@ -199,6 +225,8 @@ class Session(object):
         self.physical_address_space = None
         self.kernel_address_space = None
         self.state.cache.clear()
+        self.page_cache.Flush()
+        self._restored_filename = None
 
     def UpdateFromConfigObject(self):
         """This method is called whenever the config object was updated.
@@ -207,6 +235,8 @@ class Session(object):
         """
         filename = self.state.filename
         if filename:
+            self._RestoreParameters()
+
             # This may fire off the profile auto-detection code if a profile was
             # not provided by the user.
             profile_parameter = self.GetParameter("profile")
@@ -260,6 +290,12 @@ class Session(object):
         if result == None:
             # self.state.cache holds cached parameters.
             result = self.state.cache.Get(item)
+
+            # Objects restored from the persistent cache are rebuilt on first
+            # use.
+            if isinstance(result, obj.BaseObjectIdentity):
+                result = self._RestoreObject(item, result)
+
             if result == None:
                 result = self._RunParameterHook(item)
 
@@ -275,6 +311,134 @@ class Session(object):
         else:
             self.state.cache[item] = value
 
+            if item in self.PERSISTENT_PARAMETERS:
+                self._SaveParameters()
+
+    def InvalidateParameters(self, *names):
+        """Discards the calculated values of these parameters.
+
+        They are calculated again when they are next needed. Values set by the
+        user are kept.
+        """
+        removed = False
+        for name in names:
+            if self.state.cache.pop(name, None) is not None:
+                removed = True
+
+        if removed and self.PERSISTENT_PARAMETERS.intersection(names):
+            self._SaveParameters()
+
+    @contextlib.contextmanager
+    def DeferParameterSaves(self):
+        """Persistent parameters set in this context are saved when it ends.
+
+        This is used while the parameters may still be discarded (e.g. the
+        KASLR slide calculated for a candidate profile during autodetection),
+        so they never reach the persistent cache. Nothing is saved if the
+        context ends with an exception.
+        """
+        self._deferred_saves += 1
+        try:
+            yield
+        finally:
+            self._deferred_saves -= 1
+
+        if not self._deferred_saves and self._unsaved_parameters:
+            self._SaveParameters()
+
+    def _SaveParameters(self):
+        """Stores the persistent parameters in the persistent cache."""
+        if self._deferred_saves:
+            self._unsaved_parameters = True
+            return
+
+        self._unsaved_parameters = False
+        parameters = {}
+        for name in self.PERSISTENT_PARAMETERS:
+            value = self.state.cache.Get(name)
+            if isinstance(value, obj.BaseObject):
+                value = obj.BaseObjectIdentity(base_obj=value)
+
+            if isinstance(value, obj.BaseObjectIdentity):
+                parameters[name] = ["object", list(value.__getstate__())]
+
+            elif isinstance(value, obj.Profile):
+                parameters[name] = ["value", value.name]
+
+            elif (isinstance(value, (int, long, basestring)) and
+                  not isinstance(value, bool)):
+                parameters[name] = ["value", value]
+
+        self.persistent_cache.Put(self.PARAMETERS_CACHE_NAME, parameters)
+
+    def _RestoreParameters(self):
+        """Restores the persistent parameters of an earlier session.
+
+        If the flush_cache parameter is set, the persistent cache of the image
+        is removed instead, and all the parameters are calculated again.
+        """
+        filename = self.state.filename
+        if filename == self._restored_filename:
+            return
+
+        self._restored_filename = filename
+        if self.GetParameter("flush_cache"):
+            self.persistent_cache.Flush()
+            return
+
+        parameters = self.persistent_cache.Get(self.PARAMETERS_CACHE_NAME)
+        if not parameters:
+            return
+
+        # The parameters were derived using the saved profile, so they are of
+        # no use if the user asked for a different one.
+        profile = self.state.Get("profile")
+        if isinstance(profile, obj.Profile):
+            profile = profile.name
+        elif profile:
+            profile = os.path.splitext(profile.replace("\\", "/"))[0]
+
+        saved_profile = parameters.get("profile", (None, None))[1]
+        if profile and profile != saved_profile:
+            logging.debug("Not restoring parameters derived using profile %s.",
+                          saved_profile)
+            return
+
+        for name, (kind, value) in parameters.iteritems():
+            if (name not in self.PERSISTENT_PARAMETERS or
+                    self.state.cache.Get(name) != None):
+                continue
+
+            if kind == "object":
+                obj_type, obj_offset, dtb = value
+                value = obj.BaseObjectIdentity(
+                    obj_type=obj_type, obj_offset=obj_offset, dtb=dtb)
+
+            self.state.cache[name] = value
+
+        logging.debug("Restored parameters %s from the persistent cache.",
+                      sorted(parameters))
+
+    def _RestoreObject(self, name, identity):
+        """Rebuilds an object restored from the persistent cache.
+
+        Returns:
+          The object, or None if it can not be rebuilt with the current session
+          (in which case the parameter is calculated again).
+        """
+        # Objects in the kernel address space need it to be loaded.
+        if identity.dtb and not self.kernel_address_space:
+            self.GetParameter("default_address_space")
+
+        try:
+            result = identity.restore(self)
+        except AttributeError as e:
+            logging.debug("Unable to restore %s: %s", name, e)
+            result = None
+
+        self.state.cache[name] = result
+        return result
+
     def _RunParameterHook(self, name):
         hook = self._parameter_hooks.get(name)
         if hook:
@@ -439,7 +603,7 @@ class Session(object):
             container = io_manager.Factory(os.path.dirname(filename))
             result = obj.Profile.LoadProfileFromData(
                 container.GetData(os.path.basename(filename)),
-                self, name=canonical_name)
+                self, name=canonical_name, source=filename)
 
         # Traverse the profile path until one works.
         else:
@@ -455,7 +619,7 @@ class Session(object):
                     manager = io_manager.Factory(path)
                     result = obj.Profile.LoadProfileFromData(
                         manager.GetData(filename), self,
-                        name=canonical_name)
+                        name=canonical_name, source=(str(manager), filename))
                     logging.info(
                         "Loaded profile %s from %s", filename, manager)
 
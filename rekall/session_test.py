@@ -0,0 +1,123 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the session."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+
+# Import and register all the plugins.
+from rekall import plugins  # pylint: disable=unused-import
+
+
+class PersistentParametersTest(unittest.TestCase):
+    """Test that computed parameters are kept between sessions."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.image = os.path.join(self.temp_dir, "image.raw")
+        with open(self.image, "wb") as fd:
+            fd.write("\x01\x02\x03\x04" * 0x400)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def NewSession(self, profile=None, **kwargs):
+        result = session.Session(cache_dir=self.temp_dir, no_autodetect=True,
+                                 **kwargs)
+        with result.state as state:
+            state.filename = self.image
+            if profile:
+                state.profile = profile
+
+        result.profile = obj.Profile.classes["Profile32Bits"](session=result)
+        result.physical_address_space = addrspace.BufferAddressSpace(
+            data="\x01\x02\x03\x04" * 0x400, session=result)
+
+        return result
+
+    def testRestore(self):
+        first = self.NewSession()
+        first.SetParameter("dtb", 0x187000)
+        first.SetParameter("kdbg", first.profile.Object(
+            "unsigned int", offset=0x10, vm=first.physical_address_space))
+
+        # Parameters which are not derived from the image are not kept.
+        first.SetParameter("process_context", 5)
+
+        second = self.NewSession()
+        self.assertEqual(second.GetParameter("dtb"), 0x187000)
+        self.assertEqual(second.GetParameter("process_context"), None)
+
+        kdbg = second.GetParameter("kdbg")
+        self.assertEqual(kdbg.obj_offset, 0x10)
+        self.assertEqual(kdbg.v(), 0x04030201)
+
+        # Flushing the cache forgets all the parameters.
+        third = self.NewSession(flush_cache=True)
+        self.assertEqual(third.GetParameter("dtb"), None)
+
+    def testDeferredSaves(self):
+        first = self.NewSession()
+        with first.DeferParameterSaves():
+            first.SetParameter("kaslr_shift", 0x1000)
+            first.SetParameter("dtb", 0x187000)
+
+            # Nothing is saved yet.
+            self.assertEqual(self.NewSession().GetParameter("dtb"), None)
+
+            # The shift was calculated for a rejected profile.
+            first.InvalidateParameters("kaslr_shift")
+
+        second = self.NewSession()
+        self.assertEqual(second.GetParameter("dtb"), 0x187000)
+        self.assertEqual(second.state.cache.Get("kaslr_shift"), None)
+
+    def WriteProfile(self, name):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "wb") as fd:
+            json.dump({"$METADATA": dict(ProfileClass="Profile32Bits",
+                                         Type="Profile"),
+                       "$STRUCTS": {}}, fd)
+
+        return path
+
+    def testOtherProfile(self):
+        first_profile = self.WriteProfile("first")
+        first = self.NewSession()
+        first.SetParameter("profile", first_profile)
+        first.SetParameter("dtb", 0x187000)
+
+        # The same profile restores the parameters.
+        second = self.NewSession(profile=first_profile)
+        self.assertEqual(second.GetParameter("dtb"), 0x187000)
+
+        # The parameters were derived using a different profile.
+        third = self.NewSession(profile=self.WriteProfile("second"))
+        self.assertEqual(third.GetParameter("dtb"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -27,6 +27,8 @@ try:
 except Exception:  # curses sometimes raises weird exceptions.
     curses = None
 
+import codecs
+import copy
 import logging
 import json
 import re
@@ -56,7 +58,7 @@ config.DeclareOption(
 config.DeclareOption(
     "--renderer", default="TextRenderer", group="Interface",
     help="The renderer to use. e.g. (TextRenderer, "
-    "JsonRenderer).")
+    "JsonRenderer, NdjsonRenderer).")
 
 config.DeclareOption(
     "--nocolors", default=False, action="store_true", group="Interface",
@@ -168,6 +170,85 @@ class UnicodeWrapper(object):
         return self.fd.isatty()
 
 
+class PagingBuffer(object):
+    """Keeps the output written to a renderer for the pager.
+
+    Writes are held in memory until they take more than max_size bytes. They
+    are then spilled to an (anonymous) temporary file, so the memory used does
+    not depend on the size of the output.
+
+    len() is the number of writes, and iterating over the buffer yields the
+    written data in order.
+    """
+
+    # The size of the blocks read back from the spill file.
+    read_size = 64 * 1024
+
+    def __init__(self, max_size=1024*1024, keep=True):
+        """Create the buffer.
+
+        Args:
+          max_size: The number of bytes to hold in memory before spilling.
+          keep: If False the data is not stored at all - only writes are
+            counted.
+        """
+        self.max_size = max_size
+        self.keep = keep
+        self.count = 0
+        self.size = 0
+        self.chunks = []
+        self.spill_fd = None
+
+    def __len__(self):
+        return self.count
+
+    def append(self, data):
+        self.count += 1
+        if not self.keep:
+            return
+
+        data = utils.SmartUnicode(data).encode("utf8")
+        self.chunks.append(data)
+        self.size += len(data)
+
+        if self.size > self.max_size:
+            self._Spill()
+
+    def _Spill(self):
+        if self.spill_fd is None:
+            self.spill_fd = tempfile.TemporaryFile(prefix="rekall")
+
+        # Iteration moves the file pointer so always append at the end.
+        self.spill_fd.seek(0, 2)
+        self.spill_fd.write("".join(self.chunks))
+        self.chunks = []
+        self.size = 0
+
+    def __iter__(self):
+        if self.spill_fd is not None:
+            self.spill_fd.flush()
+            self.spill_fd.seek(0)
+
+            # The reader takes care of characters split between blocks.
+            reader = codecs.getreader("utf8")(self.spill_fd, "replace")
+            while 1:
+                data = reader.read(self.read_size)
+                if not data:
+                    break
+
+                yield data
+
+        for data in self.chunks:
+            yield data.decode("utf8", "replace")
+
+    def clear(self):
+        self.count = self.size = 0
+        self.chunks = []
+        if self.spill_fd is not None:
+            self.spill_fd.close()
+            self.spill_fd = None
+
+
 class Formatter(string.Formatter):
     """A formatter which supports extended formating specs."""
     # This comes from http://docs.python.org/library/string.html
@@ -474,6 +555,10 @@ class RendererBaseClass(object):
 
     __metaclass__ = registry.MetaclassRegistry
 
+    # If True, the output of copies made with copy_to() may be joined together
+    # in order. This allows plugins to render parts of their output in parallel.
+    joinable_output = False
+
     def __init__(self, session=None, fd=None):
         self.session = session
         self.fd = fd
@@ -584,16 +669,18 @@ class TextRenderer(RendererBaseClass):
     progress_fd = None
     paging_limit = None
 
+    # Output is flushed at most this often (in seconds) while rendering.
+    flush_interval = 0.2
+    last_flush_time = 0
+
+    joinable_output = True
+
     def __init__(self, tablesep=" ", elide=False, max_data=1024*1024,
                  paging_limit=None, **kwargs):
         super(TextRenderer, self).__init__(**kwargs)
         self.tablesep = tablesep
         self.elide = elide
 
-        # We keep the data that we produce in memory for while.
-        self.data = []
-        self.max_data = max_data
-
         # Make sure that our output is unicode safe.
         self.fd = UnicodeWrapper(self.fd or sys.stdout)
 
@@ -605,6 +692,12 @@ class TextRenderer(RendererBaseClass):
             self.paging_limit = paging_limit
             self.isatty = True
 
+        # We keep the data that we produce for the pager, but only hold up to
+        # max_data bytes of it in memory. Output which can not be paged is only
+        # counted.
+        self.max_data = max_data
+        self.data = PagingBuffer(max_size=max_data, keep=self.isatty)
+
     def start(self, plugin_name=None, kwargs=None):
         """The method is called when new output is required.
 
@@ -623,6 +716,21 @@ class TextRenderer(RendererBaseClass):
         if self.session:
             self.session.progress = None
 
+        self.fd.flush()
+
+    def copy_to(self, fd):
+        """Returns a copy of this renderer which writes to fd instead.
+
+        The copy continues the current table, but its output is never paged.
+        """
+        result = copy.copy(self)
+        result.fd = UnicodeWrapper(fd)
+        result.isatty = False
+        result.progress_fd = None
+        result.data = PagingBuffer(keep=False)
+
+        return result
+
     def format(self, formatstring, *data):
         # Only clear the progress if we share the same output stream as the
         # progress.
@@ -639,7 +747,7 @@ class TextRenderer(RendererBaseClass):
             self.paging_limit is None or  # No paging limit specified.
             len(self.data) < self.paging_limit):  # Not enough output yet.
             self.fd.write(data)
-            self.fd.flush()
+            self.MaybeFlush()
 
         # Write a single message to the terminal.
         elif len(self.data) == self.paging_limit:
@@ -654,10 +762,21 @@ class TextRenderer(RendererBaseClass):
             return
 
     def flush(self):
-        self.data = []
+        self.data.clear()
         self.ClearProgress()
         self.fd.flush()
 
+    def MaybeFlush(self):
+        """Flush the output if it was not flushed recently.
+
+        Flushing after every write is expensive for plugins which write many
+        rows, so we only flush every flush_interval seconds.
+        """
+        now = time.time()
+        if now > self.last_flush_time + self.flush_interval:
+            self.last_flush_time = now
+            self.fd.flush()
+
     def table_header(self, columns=None, suppress_headers=False,
                      **kwargs):
         """Table header renders the title row of a table.
@@ -705,6 +824,10 @@ class TextRenderer(RendererBaseClass):
         return int(os.environ.get("COLUMNS", 80))
 
     def RenderProgress(self, message=" %(spinner)s", *args, **kwargs):
+        # Progress is reported while the plugin is busy, so do not keep the
+        # last rows waiting.
+        self.MaybeFlush()
+
         if self.progress_fd is None:
             return
 
@@ -818,29 +941,74 @@ class JsonTable(TextTable):
         data = {}
         for c, obj in zip(self.columns, row):
             data[c.cname] = c.render_cell(obj)
-        renderer.table_data.append(data)
+        renderer.emit(data)
 
 
 class JsonRenderer(TextRenderer):
-    """Render the output as a json object."""
+    """Render the output as a json object.
+
+    The output is streamed: The document's metadata is written before the first
+    element, and each element of the data list (a row, statement or string) is
+    written as soon as it is produced. Nothing is retained after it is written
+    so memory use does not grow with the size of the output.
+    """
+
+    # Elements written by a copy would not be part of this document.
+    joinable_output = False
 
     def start(self, plugin_name=None, kwargs=None):
         self.formatter = JsonFormatter()
 
-        # We store the data here.
-        self.data = dict(plugin_name=plugin_name,
-                         tool_name="rekall-ng",
-                         tool_version=constants.VERSION,
-                         kwargs=self.formatter.format_dict(kwargs or {}),
-                         data=[])
+        # The document metadata. This is only written out with the first
+        # element since start() is called again once the plugin is known.
+        self.metadata = dict(plugin_name=plugin_name,
+                             tool_name="rekall-ng",
+                             tool_version=constants.VERSION,
+                             kwargs=self.formatter.format_dict(kwargs or {}))
+
+        # Number of elements written in the current document.
+        self.elements = 0
+        self.document_started = False
 
         super(JsonRenderer, self).start(plugin_name=plugin_name,
                                         kwargs=kwargs)
         self.headers = []
 
     def end(self):
-        # Just dump out the json object.
-        self.fd.write(json.dumps(self.data, indent=4))
+        # Close the document.
+        if not self.document_started:
+            self.write_preamble()
+
+        self.write_trailer()
+        self.document_started = False
+        self.fd.flush()
+
+        super(JsonRenderer, self).end()
+
+    def emit(self, element):
+        """Writes a single element of the data list to the output."""
+        if not self.document_started:
+            self.write_preamble()
+            self.document_started = True
+
+        self.write_element(element)
+        self.elements += 1
+
+        # Let the consumer see each element as soon as it is produced.
+        self.fd.flush()
+
+    def write_preamble(self):
+        """Opens the document with the metadata and the start of the data."""
+        self.fd.write(json.dumps(self.metadata)[:-1] + ', "data": [\n')
+
+    def write_element(self, element):
+        if self.elements:
+            self.fd.write(",\n")
+
+        self.fd.write(json.dumps(element))
+
+    def write_trailer(self):
+        self.fd.write("\n]}\n")
 
     def format(self, formatstring, *args):
         statement = [formatstring]
@@ -848,22 +1016,33 @@ class JsonRenderer(TextRenderer):
             # Just store the statement in the output.
             statement.append(self.formatter.format_field(arg, "s"))
 
-        self.data['data'].append(statement)
+        self.emit(statement)
 
     def table_header(self, columns = None, **kwargs):
         self.table = JsonTable(columns=columns)
 
-        # This is the current table - the JsonTable object will write on it.
-        self.table_data = []
-
-        # Append it to the data.
-        self.data['data'] = self.table_data
-
         # Write the headers.
         self.headers = self.table.get_header(self)
 
     def write(self, data):
-        self.data['data'].append(data)
+        self.emit(data)
+
+
+class NdjsonRenderer(JsonRenderer):
+    """Render the output as newline delimited json.
+
+    The first line holds the metadata of the document and every following line
+    is a single element of the data list (e.g. a table row).
+    """
+
+    def write_preamble(self):
+        self.fd.write(json.dumps(self.metadata) + "\n")
+
+    def write_element(self, element):
+        self.fd.write(json.dumps(element) + "\n")
+
+    def write_trailer(self):
+        pass
 
 
 class TestRenderer(TextRenderer):
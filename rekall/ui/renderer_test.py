@@ -0,0 +1,195 @@
+# Rekall Memory Forensics
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for the renderers."""
+import json
+import os
+import StringIO
+import subprocess
+import sys
+import unittest
+
+from rekall import session
+from rekall.ui import renderer
+
+
+COLUMNS = [("Offset", "offset", "[addrpad]"),
+           ("Name", "name", "20s")]
+
+
+# Renders rows in a new process and prints its peak memory use (in kb).
+MEASURE_SCRIPT = """
+import resource
+import sys
+
+from rekall import session
+from rekall.ui import renderer
+from rekall.ui import renderer_test
+
+renderer_test.RenderRows(
+    session.Session(), getattr(renderer, sys.argv[1]),
+    renderer_test.NullFile(), int(sys.argv[2])).end()
+
+sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+"""
+
+
+def RenderRows(ui_session, renderer_cls, fd, count):
+    ui_renderer = renderer_cls(session=ui_session, fd=fd)
+    ui_renderer.start(plugin_name="test", kwargs=dict(count=count))
+    ui_renderer.table_header(COLUMNS)
+    for i in xrange(count):
+        ui_renderer.table_row(i * 0x1000, "process%d" % i)
+
+    return ui_renderer
+
+
+def PeakMemory(renderer_cls, count):
+    """Returns the peak memory (in kb) of a process which renders count rows."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    return int(subprocess.check_output(
+        [sys.executable, "-c", MEASURE_SCRIPT, renderer_cls.__name__,
+         str(count)], env=env))
+
+
+class NullFile(object):
+    """A file which discards everything written to it."""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class JsonRendererTest(unittest.TestCase):
+    """Test the streaming json renderers."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+    def RenderRows(self, renderer_cls, fd, count):
+        return RenderRows(self.session, renderer_cls, fd, count)
+
+    def testJson(self):
+        fd = StringIO.StringIO()
+        ui_renderer = self.RenderRows(renderer.JsonRenderer, fd, 3)
+
+        # Rows reach the output before the plugin finishes.
+        self.assertTrue('"process2"' in fd.getvalue())
+
+        ui_renderer.end()
+        result = json.loads(fd.getvalue())
+        self.assertEqual(result["plugin_name"], "test")
+        self.assertEqual(result["kwargs"], dict(count=dict(value=3)))
+        self.assertEqual(len(result["data"]), 3)
+        self.assertEqual(result["data"][1], dict(
+            offset=dict(value=0x1000), name=dict(value="process1")))
+
+    def testEmptyJson(self):
+        fd = StringIO.StringIO()
+        ui_renderer = renderer.JsonRenderer(session=self.session, fd=fd)
+        ui_renderer.start(plugin_name="test")
+        ui_renderer.end()
+
+        self.assertEqual(json.loads(fd.getvalue())["data"], [])
+
+    def testNdjson(self):
+        fd = StringIO.StringIO()
+        self.RenderRows(renderer.NdjsonRenderer, fd, 3).end()
+
+        lines = [json.loads(x) for x in fd.getvalue().splitlines()]
+        self.assertEqual(lines[0]["plugin_name"], "test")
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[3]["name"], dict(value="process2"))
+
+    def testMemoryIsBounded(self):
+        """Peak memory should not grow with the number of rows."""
+        for renderer_cls in (renderer.JsonRenderer, renderer.NdjsonRenderer):
+            # Each count is rendered in a new process, since the peak memory
+            # of this process depends on the tests which ran before.
+            small = PeakMemory(renderer_cls, 1000)
+            large = PeakMemory(renderer_cls, 100000)
+
+            # The peak is in kb. Holding 100000 rows in memory takes more
+            # than a hundred mb.
+            self.assertLess(large - small, 8 * 1024)
+
+
+class PagingBufferTest(unittest.TestCase):
+    """Test the buffer which holds the output for the pager."""
+
+    def testSpill(self):
+        buf = renderer.PagingBuffer(max_size=100)
+        buf.read_size = 7
+
+        lines = [u"line %d \u00e9\u20ac\n" % i for i in range(100)]
+        for line in lines:
+            buf.append(line)
+
+        # Most of the data is in the file.
+        self.assertEqual(len(buf), 100)
+        self.assertLessEqual(buf.size, 100)
+        self.assertNotEqual(buf.spill_fd, None)
+
+        # Multi byte characters split between blocks are read back intact.
+        self.assertEqual(u"".join(buf), u"".join(lines))
+
+        # We can keep writing after reading.
+        buf.append(u"last")
+        self.assertEqual(u"".join(buf), u"".join(lines) + u"last")
+
+        buf.clear()
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(list(buf), [])
+
+    def testCountOnly(self):
+        buf = renderer.PagingBuffer(keep=False)
+        buf.append("hello")
+        self.assertEqual(len(buf), 1)
+        self.assertEqual(list(buf), [])
+
+
+class TextRendererTest(unittest.TestCase):
+    """Test the text renderer."""
+
+    def testOutputIsNotKept(self):
+        fd = StringIO.StringIO()
+        ui_renderer = renderer.TextRenderer(session=session.Session(), fd=fd)
+        ui_renderer.start()
+        ui_renderer.table_header(COLUMNS)
+        for i in range(10):
+            ui_renderer.table_row(i, "process%d" % i)
+        ui_renderer.end()
+
+        self.assertTrue("process9" in fd.getvalue())
+
+        # The output is not a tty so it will never be paged.
+        self.assertEqual(len(ui_renderer.data), 12)
+        self.assertEqual(list(ui_renderer.data), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -118,6 +118,7 @@ class LinkedList(object):
         last_node.next = node
         node.prev = last_node
         node.next = self
+        self.prev = node
 
         return node
 
@@ -135,7 +136,7 @@ class LinkedList(object):
         if self.prev is self:
             raise IndexError("Pop from empty list.")
 
-        last_node = self.tail
+        last_node = self.prev
         self.Unlink(last_node)
         return last_node.data
 